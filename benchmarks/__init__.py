@@ -0,0 +1 @@
+"""Offline benchmarks for Tokopedia Fashion Bot (run with python -m benchmarks.<name>)."""
@@ -0,0 +1,110 @@
+"""
+Measure Tokopedia enrichment latency and request volume against a local stub.
+
+Enriches recorded analysis responses three ways: a naive baseline (one new
+HTTP client and one request per item, in sequence), the pooled enricher with
+an empty cache, and the same enricher again with a warm cache.
+
+Usage:
+    python -m benchmarks.enrichment_bench [--responses 50] [--concurrency 8]
+        [--search-latency 0.2]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+import httpx
+
+from benchmarks.fakes import FakeTokopediaServer, LatencyModel, load_recorded_responses
+from src.config import BALI_CITY_IDS
+from src.tokopedia_enrichment import TokopediaEnricher
+from src.tokopedia_search import item_search_query
+
+
+async def naive_enrich(url: str, analysis: dict) -> None:
+    """Search every item one after another, each over a new connection."""
+    for person in analysis.get("people", []):
+        for item in person.get("items", []):
+            query = item_search_query(item)
+            if query:
+                async with httpx.AsyncClient() as client:
+                    response = await client.get(url, params={"q": query, "fcity": BALI_CITY_IDS})
+                    response.json()
+
+
+async def measure(name: str, server: FakeTokopediaServer, analyses: list[dict],
+                  concurrency: int, enrich) -> None:
+    """Enrich all analyses, `concurrency` at a time, and print one result row."""
+    requests_before = server.requests
+    server.max_active = 0
+    slots = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(analysis: dict) -> None:
+        async with slots:
+            started = time.monotonic()
+            await enrich(analysis)
+            latencies.append(time.monotonic() - started)
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(analysis) for analysis in analyses))
+    elapsed = time.monotonic() - started
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(
+        f"{name:<14}{statistics.mean(latencies):>9.3f}{p95:>9.3f}{elapsed:>9.2f}"
+        f"{server.requests - requests_before:>10}{server.max_active:>8}"
+    )
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Start the stub, run the three passes and print a table."""
+    responses = load_recorded_responses(args.responses_file)
+    analyses = [json.loads(responses[i % len(responses)]) for i in range(args.responses)]
+    items = sum(len(p.get("items", [])) for a in analyses for p in a.get("people", []))
+
+    server = FakeTokopediaServer(LatencyModel(args.search_latency), seed=args.seed)
+    await server.start()
+    print(f"{len(analyses)} responses, {items} items, "
+          f"search latency ~{args.search_latency * 1000:.0f} ms\n")
+    print(f"{'mode':<14}{'mean s':>9}{'p95 s':>9}{'total s':>9}{'requests':>10}{'peak':>8}")
+
+    await measure("naive", server, analyses, args.concurrency,
+                  lambda analysis: naive_enrich(server.url, analysis))
+
+    enricher = TokopediaEnricher(server.url, results=args.results, timeout=30,
+                                 per_host_limit=args.per_host_limit)
+    await measure("pooled cold", server, analyses, args.concurrency, enricher.enrich)
+    await measure("pooled warm", server, analyses, args.concurrency, enricher.enrich)
+    print(f"\nenricher: {enricher.stats()}")
+
+    await enricher.close()
+    await server.close()
+    # Let the stub's connection handlers see their sockets close
+    await asyncio.sleep(0.1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--responses", type=int, default=50)
+    parser.add_argument("--responses-file", help="JSONL of recorded analyses")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Responses enriched at the same time")
+    parser.add_argument("--search-latency", type=float, default=0.2,
+                        help="Median stub search latency in seconds")
+    parser.add_argument("--results", type=int, default=1, help="Products per item")
+    parser.add_argument("--per-host-limit", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
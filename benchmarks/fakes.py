@@ -0,0 +1,410 @@
+"""
+Fake Telegram and Gemini layers for driving the bot offline.
+
+FakeGeminiClient replays recorded analysis responses with a configurable
+latency distribution and failure rates. FakeTelegram builds updates whose
+replies, edits and downloads take a configurable time and are recorded, so
+handle_photo() can run end to end without network access or API quota.
+FakeTokopediaServer is a local search endpoint for the enrichment stage.
+"""
+
+import asyncio
+import io
+import itertools
+import json
+import random
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+
+from google.genai import errors
+from PIL import Image
+from telegram import PhotoSize
+
+from src.http_server import HTTPServer, Request, Response
+from src.reference_artifact import get_reference_artifact
+
+
+@dataclass
+class LatencyModel:
+    """Lognormal latency with the given median (seconds) and shape."""
+
+    median: float
+    sigma: float = 0.5
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0.0
+        return self.median * rng.lognormvariate(0, self.sigma)
+
+
+def load_recorded_responses(path: str | None = None) -> list[str]:
+    """
+    Load recorded Gemini analysis responses.
+
+    Args:
+        path: JSONL file with one analysis per line (either a JSON object or
+            a JSON string holding the raw response text). Without a path,
+            responses are synthesized from the reference looks.
+
+    Returns:
+        Raw response texts.
+    """
+    if path:
+        responses = []
+        for line in Path(path).read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                value = json.loads(line)
+                responses.append(value if isinstance(value, str) else json.dumps(value))
+        return responses
+
+    responses = []
+    looks = get_reference_artifact().reference_data.get("looks", {})
+    for look in looks.get("male_unisex", []) + looks.get("female", []):
+        items = [
+            {
+                "name_ua": search.get("name_ua", search["query"]),
+                "search_query_id": search["query"],
+                "category": "top",
+            }
+            for search in look.get("searches", [])
+            if search.get("query")
+        ]
+        if items:
+            responses.append(json.dumps({
+                "greeting_ua": "Ого, який лук!",
+                "people": [{"description_ua": look.get("name", "Людина"), "items": items}],
+            }, ensure_ascii=False))
+    return responses
+
+
+# A hung call; long enough to outlast any deadline
+HANG_SECONDS = 3600.0
+
+
+class _FakeModels:
+    """Implements the subset of client.aio.models used by gemini_analyzer."""
+
+    def __init__(self, client: "FakeGeminiClient"):
+        self._client = client
+
+    async def generate_content(self, model: str, contents, config=None):
+        text = await self._client._respond(model)
+        return self._client._response(text)
+
+    async def generate_content_stream(self, model: str, contents, config=None):
+        client = self._client
+        delay, text = client._plan(model)
+        chunks = client.stream_chunks
+
+        async def stream():
+            if isinstance(text, Exception):
+                await asyncio.sleep(delay)
+                raise text
+            step = max(1, len(text) // chunks)
+            for start in range(0, len(text), step):
+                await asyncio.sleep(delay / chunks)
+                yield client._response(text[start:start + step])
+
+        return stream()
+
+
+class FakeGeminiClient:
+    """
+    Stand-in for google.genai.Client that replays recorded responses.
+
+    Args:
+        responses: Raw response texts to cycle through.
+        latency: Latency of a full model call.
+        error_rate: Probability of a 503 ServerError.
+        hang_rate: Probability of a call that never answers (until cancelled).
+        truncation_rate: Probability of a response cut off mid-JSON
+            (exercises the repair path).
+        stream_chunks: Number of chunks a streamed response is split into.
+        seed: Random seed.
+    """
+
+    def __init__(
+        self,
+        responses: list[str],
+        latency: LatencyModel,
+        error_rate: float = 0.0,
+        truncation_rate: float = 0.0,
+        stream_chunks: int = 8,
+        seed: int = 0,
+        hang_rate: float = 0.0,
+    ):
+        self.responses = itertools.cycle(responses)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.truncation_rate = truncation_rate
+        self.hang_rate = hang_rate
+        self.stream_chunks = stream_chunks
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.aio = SimpleNamespace(models=_FakeModels(self))
+
+    def _plan(self, model: str) -> tuple[float, str | Exception]:
+        """Pick the latency and the response text (or error) of the next call."""
+        self.calls += 1
+        delay = self.latency.sample(self.rng)
+        if self.rng.random() < self.hang_rate:
+            delay = HANG_SECONDS
+        if self.rng.random() < self.error_rate:
+            return delay, errors.ServerError(
+                503, {"error": {"code": 503, "message": "overloaded", "status": "UNAVAILABLE"}}
+            )
+        text = next(self.responses)
+        if self.rng.random() < self.truncation_rate:
+            text = text[: self.rng.randint(len(text) // 3, len(text) - 1)]
+        return delay, text
+
+    async def _respond(self, model: str) -> str:
+        delay, text = self._plan(model)
+        await asyncio.sleep(delay)
+        if isinstance(text, Exception):
+            raise text
+        return text
+
+    @staticmethod
+    def _response(text: str):
+        usage = SimpleNamespace(
+            prompt_token_count=1500, candidates_token_count=len(text) // 4,
+            total_token_count=1500 + len(text) // 4,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+
+def make_photo(seed: int, width: int = 1280, height: int = 960) -> bytes:
+    """A JPEG of random colour blocks, distinct per seed (defeats the caches)."""
+    rng = random.Random(seed)
+    small = Image.frombytes("RGB", (32, 24), rng.randbytes(32 * 24 * 3))
+    buffer = io.BytesIO()
+    small.resize((width, height), Image.Resampling.BILINEAR).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+# Replies that end a request without results (errors and rejections)
+FAILURE_PREFIXES = ("Ой", "Забагато", "Зараз забагато")
+
+
+def track_photo_completion() -> None:
+    """
+    Resolve each photo message's `done` future when its analysis job returns.
+
+    Results arrive as an edit of the processing message, which looks the
+    same as a progress edit, so completion is taken from process_photo().
+    """
+    from src import bot
+
+    process_photo = getattr(bot.process_photo, "__wrapped__", bot.process_photo)
+
+    async def tracked(update, *args, **kwargs):
+        result = None
+        try:
+            result = await process_photo(update, *args, **kwargs)
+            return result
+        finally:
+            if not update.message.done.done():
+                update.message.done.set_result(result is not None)
+
+    tracked.__wrapped__ = process_photo
+    bot.process_photo = tracked
+
+
+@dataclass
+class SentMessage:
+    """A message the bot sent, recorded for inspection."""
+
+    kind: str
+    text: str | None
+    size: int = 0
+
+
+class FakeMessage:
+    """
+    A Telegram message that records replies and edits.
+
+    `done` resolves when the bot has answered the photo: True with results,
+    False on an error or rejection (see track_photo_completion()).
+    """
+
+    def __init__(self, telegram: "FakeTelegram", chat_id: int, text: str | None = None,
+                 photo: list[PhotoSize] | None = None, media_group_id: str | None = None,
+                 caption: str | None = None):
+        self._telegram = telegram
+        self.chat_id = chat_id
+        self.message_id = next(telegram.message_ids)
+        self.text = text
+        self.caption = caption
+        self.photo = photo or []
+        self.media_group_id = media_group_id
+        self.sent: list[SentMessage] = []
+        self.done = asyncio.get_running_loop().create_future()
+
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._telegram.delay()
+        self.sent.append(SentMessage("text", text))
+        if text.startswith(FAILURE_PREFIXES) and not self.done.done():
+            self.done.set_result(False)
+        return FakeMessage(self._telegram, self.chat_id, text)
+
+    async def reply_photo(self, photo, caption: str | None = None, **kwargs) -> "FakeMessage":
+        await self._telegram.delay()
+        size = len(photo) if isinstance(photo, (bytes, bytearray)) else 0
+        self._telegram.bytes_uploaded += size
+        self.sent.append(SentMessage("photo", caption, size))
+        sizes = self.photo if isinstance(photo, str) else [PhotoSize("sent", "sent", 1, 1)]
+        return FakeMessage(self._telegram, self.chat_id, photo=sizes, caption=caption)
+
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        await self._telegram.delay()
+        self.text = text
+        self._telegram.edits += 1
+        return self
+
+    async def edit_caption(self, caption: str, **kwargs) -> "FakeMessage":
+        await self._telegram.delay()
+        self.caption = caption
+        self._telegram.edits += 1
+        return self
+
+    async def delete(self) -> bool:
+        await self._telegram.delay()
+        return True
+
+
+class FakeFile:
+    """A downloadable Telegram file backed by in-memory bytes."""
+
+    def __init__(self, telegram: "FakeTelegram", data: bytes):
+        self._telegram = telegram
+        self._data = data
+        self.file_size = len(data)
+
+    async def download_as_bytearray(self, buf: bytearray | None = None) -> bytearray:
+        await self._telegram.delay()
+        self._telegram.bytes_downloaded += len(self._data)
+        if buf is None:
+            buf = bytearray()
+        buf.extend(self._data)
+        return buf
+
+    async def download_to_memory(self, out) -> None:
+        await self._telegram.delay()
+        self._telegram.bytes_downloaded += len(self._data)
+        # A fresh copy, as a network read would return
+        out.write(bytes(memoryview(self._data)))
+
+
+class FakeBot:
+    """The subset of telegram.Bot used by the photo handlers."""
+
+    def __init__(self, telegram: "FakeTelegram"):
+        self._telegram = telegram
+
+    async def get_file(self, file_id: str) -> FakeFile:
+        await self._telegram.delay()
+        return FakeFile(self._telegram, self._telegram.files[file_id])
+
+
+@dataclass
+class FakeTelegram:
+    """
+    Fake Telegram API: builds photo updates and records what the bot sends.
+
+    Args:
+        latency: Latency of each Bot API call.
+        seed: Random seed.
+    """
+
+    latency: LatencyModel
+    seed: int = 0
+    files: dict[str, bytes] = field(default_factory=dict)
+    bytes_downloaded: int = 0
+    bytes_uploaded: int = 0
+    edits: int = 0
+    api_calls: int = 0
+
+    def __post_init__(self):
+        self.rng = random.Random(self.seed)
+        self.message_ids = itertools.count(1)
+        self.bot = FakeBot(self)
+        self.context = SimpleNamespace(bot=self.bot, bot_data={}, user_data={}, chat_data={})
+
+    async def delay(self) -> None:
+        """Simulate the latency of one Bot API call."""
+        self.api_calls += 1
+        await asyncio.sleep(self.latency.sample(self.rng))
+
+    def photo_update(self, photo: bytes, chat_id: int, user_id: int):
+        """Build an update carrying a photo in the sizes Telegram would offer."""
+        file_id = f"file-{len(self.files)}"
+        self.files[file_id] = photo
+        with Image.open(io.BytesIO(photo)) as image:
+            width, height = image.size
+        sizes = [
+            PhotoSize(f"{file_id}-s", f"{file_id}-s", width // 4, height // 4, len(photo) // 16),
+            PhotoSize(file_id, file_id, width, height, len(photo)),
+        ]
+        message = FakeMessage(self, chat_id, photo=sizes)
+        return SimpleNamespace(
+            update_id=message.message_id,
+            message=message,
+            effective_message=message,
+            effective_user=SimpleNamespace(id=user_id),
+            effective_chat=SimpleNamespace(id=chat_id),
+        )
+
+
+class FakeTokopediaServer:
+    """
+    Local stand-in for the Tokopedia search endpoint (see tokopedia_enrichment).
+
+    Answers GET /search with `rows` made-up products for the query after a
+    sampled latency, and counts requests and peak concurrency.
+
+    Args:
+        latency: Latency of each search.
+        seed: Random seed.
+    """
+
+    def __init__(self, latency: LatencyModel, seed: int = 0):
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+        self._server = HTTPServer("127.0.0.1", 0)
+        self._server.route("GET", "/search", self._search)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._server.port}/search"
+
+    async def start(self) -> None:
+        await self._server.start()
+
+    async def close(self) -> None:
+        await self._server.close()
+
+    async def _search(self, request: Request) -> Response:
+        self.requests += 1
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency.sample(self.rng))
+        finally:
+            self.active -= 1
+        query = request.query.get("q", "")
+        slug = "-".join(query.split())
+        products = [
+            {
+                "name": f"{query} {n + 1}",
+                "url": f"https://www.tokopedia.com/toko/{slug}-{n + 1}",
+                "price": self.rng.randrange(15, 300) * 1000,
+                "image_url": f"https://images.tokopedia.net/{slug}-{n + 1}.jpg",
+            }
+            for n in range(int(request.query.get("rows", "1")))
+        ]
+        return Response.json({"data": {"products": products}})
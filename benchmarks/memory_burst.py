@@ -0,0 +1,185 @@
+"""
+Measure peak RSS while a burst of large photos arrives at once.
+
+Sends `--photos` large photos through handle_photo at the same moment, with
+as many scheduler slots, against fake Telegram and Gemini layers, and samples the process's RSS until
+all of them are answered. Each configuration runs in a fresh interpreter
+(the settings are read from the environment at import): with no memory
+bound, with only spooling to disk, with only the byte budget, and with both.
+
+The photos are one noisy JPEG with a distinct trailer each, so every request
+misses the analysis cache (near-duplicate lookup is switched off). The fake
+Telegram keeps all of them in memory; that is the baseline RSS, measured
+before the burst.
+
+Usage:
+    python -m benchmarks.memory_burst [--photos 40] [--budget-mb 16] [--spool-mb 1]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+MB = 1024 * 1024
+
+
+def make_large_photo(seed: int, width: int, height: int) -> bytes:
+    """A noisy JPEG of several MB, the size a phone camera produces."""
+    rng = random.Random(seed)
+    blocks = Image.frombytes("RGB", (32, 24), rng.randbytes(32 * 24 * 3))
+    blocks = blocks.resize((width, height), Image.Resampling.BILINEAR)
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    buffer = io.BytesIO()
+    Image.blend(blocks, noise, 0.3).save(buffer, "JPEG", quality=92)
+    return buffer.getvalue()
+
+
+async def burst(args: argparse.Namespace) -> dict:
+    """Run one burst in this process and return its measurements."""
+    from benchmarks.fakes import (
+        FakeGeminiClient,
+        FakeTelegram,
+        LatencyModel,
+        load_recorded_responses,
+    )
+    from benchmarks.replay_bench import LoopMonitor, _rss_bytes
+    from src import bot, gemini_analyzer, scheduler
+    from src.photo_download import get_photo_budget
+
+    telegram = FakeTelegram(LatencyModel(args.telegram_latency, 0.3), seed=args.seed)
+    gemini_analyzer._client = FakeGeminiClient(
+        load_recorded_responses(), LatencyModel(args.gemini_latency, 0.3), seed=args.seed
+    )
+    gemini_analyzer._semaphore = None
+    photo_scheduler = scheduler.PhotoScheduler(
+        max_queue=args.photos, rate_per_minute=1e9, burst=args.photos
+    )
+    scheduler._scheduler = photo_scheduler
+
+    base = make_large_photo(args.seed, args.width, args.height)
+    updates = [
+        # Bytes after the JPEG's end marker make each photo distinct to the cache
+        telegram.photo_update(base + i.to_bytes(4, "big"), chat_id=i, user_id=i)
+        for i in range(args.photos)
+    ]
+    del base
+    baseline = _rss_bytes()
+
+    started = time.perf_counter()
+    with LoopMonitor() as monitor:
+        for update in updates:
+            await bot.handle_photo(update, telegram.context)
+        done = await asyncio.gather(*(update.message.done for update in updates))
+        await photo_scheduler.close()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "photo_mb": len(telegram.files[next(iter(telegram.files))]) / MB,
+        "ok": sum(1 for ok in done if ok),
+        "elapsed_s": elapsed,
+        "baseline_mb": baseline / MB,
+        "peak_mb": monitor.peak_rss / MB,
+        "budget": get_photo_budget().stats(),
+    }
+
+
+def child_main(args: argparse.Namespace) -> None:
+    """Entry point of the child interpreter: run one burst, print JSON."""
+    from benchmarks.fakes import track_photo_completion
+    from src import bot
+    from src.lazy_import import warm_up
+
+    logging.disable(logging.ERROR)
+    track_photo_completion()
+    # The bot does this at startup: main() compiles the prompt, and
+    # start_warm_up() imports these in the background
+    bot.get_analysis_version()
+    warm_up(*bot.WARM_UP_MODULES)
+    print(json.dumps(asyncio.run(burst(args))))
+
+
+def run_child(args: argparse.Namespace, budget: int, spool_threshold: int) -> dict:
+    """Run one configuration in a fresh interpreter and return its measurements."""
+    with_env = {
+        **os.environ,
+        "PYTHONPATH": str(Path(__file__).resolve().parent.parent),
+        "PHOTO_MEMORY_BUDGET_BYTES": str(budget),
+        "PHOTO_SPOOL_THRESHOLD_BYTES": str(spool_threshold),
+        # Download the full-size photo rather than Telegram's smaller rendition
+        "PHOTO_MIN_EDGE": str(max(args.width, args.height)),
+        "NEAR_DUPLICATE_ENABLED": "false",
+        "ANALYSIS_CACHE_DIR": "",
+        "JOB_STORE_PATH": "",
+        "WORKER_PROCESSES": "0",
+        # Let the whole burst in at once; only the memory bound holds it back
+        "SCHEDULER_WORKERS": str(args.workers or args.photos),
+        "GEMINI_MAX_CONCURRENCY": str(args.workers or args.photos),
+    }
+    command = [sys.executable, "-m", "benchmarks.memory_burst", "--child", *sys.argv[1:]]
+    output = subprocess.run(
+        command, env=with_env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    """Run every configuration in turn and print a results table."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--photos", type=int, default=40)
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Scheduler slots and Gemini concurrency (default: --photos)")
+    parser.add_argument("--budget-mb", type=float, default=16,
+                        help="Byte budget of the bounded configurations")
+    parser.add_argument("--spool-mb", type=float, default=1,
+                        help="Spool threshold of the spooling configurations")
+    parser.add_argument("--gemini-latency", type=float, default=2.0,
+                        help="Median model latency in seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.05,
+                        help="Median Bot API call latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child_main(args)
+        return
+
+    unbounded = 2**62
+    budget = int(args.budget_mb * MB)
+    spool = int(args.spool_mb * MB)
+    configurations = {
+        "unbounded": (unbounded, unbounded),
+        "spool": (unbounded, spool),
+        "budget": (budget, unbounded),
+        "budget+spool": (budget, spool),
+    }
+
+    print(f"{args.photos} photos of {args.width}x{args.height} at once, "
+          f"budget {args.budget_mb:g} MB, spool above {args.spool_mb:g} MB\n")
+    print(f"{'memory bound':<14}{'ok':>4}{'total s':>9}{'base MB':>9}{'peak MB':>9}"
+          f"{'burst MB':>10}{'waits':>7}{'max wait s':>12}")
+    for name, (limit, threshold) in configurations.items():
+        result = run_child(args, limit, threshold)
+        stats = result["budget"]
+        print(
+            f"{name:<14}{result['ok']:>4}{result['elapsed_s']:>9.2f}"
+            f"{result['baseline_mb']:>9.1f}{result['peak_mb']:>9.1f}"
+            f"{result['peak_mb'] - result['baseline_mb']:>10.1f}"
+            f"{stats['waits']:>7}{stats['wait_seconds_max']:>12.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Benchmark perceptual hashing and near-duplicate lookups.
+
+Usage:
+    python -m benchmarks.near_duplicate_index [--sizes 1000,10000,100000,500000]
+"""
+
+import argparse
+import io
+import random
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from src.perceptual_hash import HASH_BITS, HammingIndex, dhash, hamming_distance
+
+
+def _flip_bits(hash_value: int, count: int, rng: random.Random) -> int:
+    """Flip `count` random bits of a hash."""
+    for position in rng.sample(range(HASH_BITS), count):
+        hash_value ^= 1 << position
+    return hash_value
+
+
+def _synthetic_photo(width: int, height: int, seed: int) -> Image.Image:
+    """Build a smooth synthetic image that survives resizing like a real photo."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(12, 9, 3), dtype=np.uint8)
+    return Image.fromarray(coarse).resize((width, height), Image.Resampling.BICUBIC)
+
+
+def _encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    """Encode an image as JPEG."""
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def bench_dhash(samples: int) -> None:
+    """Report dHash cost and the distance between Telegram-style variants."""
+    print("dHash on Telegram PhotoSize variants (1280px q87 vs 800px/320px q80)")
+    timings = []
+    distances = []
+    for seed in range(samples):
+        original = _synthetic_photo(960, 1280, seed)
+        large = _encode_jpeg(original, 87)
+        start = time.perf_counter()
+        large_hash = dhash(large)
+        timings.append(time.perf_counter() - start)
+
+        for size in ((600, 800), (240, 320)):
+            variant = _encode_jpeg(original.resize(size, Image.Resampling.LANCZOS), 80)
+            distances.append(hamming_distance(large_hash, dhash(variant)))
+
+    print(f"  dhash(1280px JPEG): mean {statistics.mean(timings) * 1000:.2f} ms")
+    print(
+        f"  variant distance: mean {statistics.mean(distances):.1f}, "
+        f"max {max(distances)} bits"
+    )
+    print()
+
+
+def bench_index(sizes: list[int], queries: int, max_distance: int, seed: int) -> None:
+    """Report index build and lookup cost as the index grows."""
+    rng = random.Random(seed)
+    print(f"HammingIndex lookups, max_distance={max_distance}, {queries} queries per size")
+    print(f"{'entries':>10} {'build s':>9} {'mean us':>9} {'p99 us':>9} {'hit rate':>9}")
+
+    for size in sizes:
+        index = HammingIndex()
+        stored = [rng.getrandbits(HASH_BITS) for _ in range(size)]
+
+        start = time.perf_counter()
+        for i, hash_value in enumerate(stored):
+            index.add(hash_value, str(i))
+        build_seconds = time.perf_counter() - start
+
+        # Half the queries are near-duplicates of stored hashes, half are unseen
+        query_hashes = []
+        for i in range(queries):
+            if i % 2 == 0:
+                base = stored[rng.randrange(size)]
+                query_hashes.append(_flip_bits(base, rng.randint(0, max_distance), rng))
+            else:
+                query_hashes.append(rng.getrandbits(HASH_BITS))
+
+        timings = []
+        hits = 0
+        for query in query_hashes:
+            start = time.perf_counter()
+            match = index.nearest(query, max_distance)
+            timings.append(time.perf_counter() - start)
+            hits += match is not None
+
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(
+            f"{size:>10} {build_seconds:>9.2f} {statistics.mean(timings) * 1e6:>9.1f} "
+            f"{p99 * 1e6:>9.1f} {hits / queries:>9.2f}"
+        )
+
+
+def main() -> None:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1000,10000,100000,500000")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--photos", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_dhash(args.photos)
+    bench_index(
+        [int(size) for size in args.sizes.split(",")],
+        args.queries,
+        args.max_distance,
+        args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
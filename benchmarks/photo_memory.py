@@ -0,0 +1,80 @@
+"""
+Measure bytes uploaded and peak Python memory per photo request.
+
+Runs photos one at a time through handle_photo against fake Telegram and
+Gemini layers, tracing allocations with tracemalloc.
+
+Usage:
+    python -m benchmarks.photo_memory [--requests 20] [--width 2560 --height 1920]
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import tracemalloc
+
+from benchmarks.fakes import (
+    FakeGeminiClient,
+    FakeTelegram,
+    LatencyModel,
+    load_recorded_responses,
+    make_photo,
+    track_photo_completion,
+)
+from src import bot, gemini_analyzer, scheduler
+from src.lazy_import import warm_up
+
+
+async def run(args: argparse.Namespace) -> None:
+    """Send the photos sequentially and print per-request statistics."""
+    telegram = FakeTelegram(LatencyModel(0))
+    gemini_analyzer._client = FakeGeminiClient(load_recorded_responses(), LatencyModel(0.01))
+    scheduler._scheduler = scheduler.PhotoScheduler(rate_per_minute=1e9, burst=10**6)
+
+    photos = [make_photo(args.seed + i, args.width, args.height) for i in range(args.requests)]
+    peaks = []
+    uploaded = []
+
+    tracemalloc.start()
+    for i, photo in enumerate(photos):
+        update = telegram.photo_update(photo, chat_id=i, user_id=i)
+        uploaded_before = telegram.bytes_uploaded
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+
+        await bot.handle_photo(update, telegram.context)
+        await update.message.done
+        await scheduler.get_photo_scheduler().join()
+
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        uploaded.append(telegram.bytes_uploaded - uploaded_before)
+    tracemalloc.stop()
+    await scheduler.get_photo_scheduler().close()
+
+    print(f"photo size:          {statistics.mean(len(p) for p in photos) / 1024:8.1f} KiB")
+    print(f"bytes uploaded:      {statistics.mean(uploaded) / 1024:8.1f} KiB per request")
+    print(f"peak memory (mean):  {statistics.mean(peaks) / 1024:8.1f} KiB per request")
+    print(f"peak memory (max):   {max(peaks) / 1024:8.1f} KiB per request")
+
+
+def main() -> None:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20)
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--height", type=int, default=1920)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)
+    track_photo_completion()
+    # The bot does this at startup: main() compiles the prompt, and
+    # start_warm_up() imports these in the background
+    bot.get_analysis_version()
+    warm_up(*bot.WARM_UP_MODULES)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Benchmark reference query lookups as the reference file grows.
+
+Usage:
+    python -m benchmarks.reference_index [--looks 18,1000,5000,20000]
+"""
+
+import argparse
+import random
+import statistics
+import time
+
+from src.reference_artifact import get_reference_artifact
+from src.reference_index import ReferenceQueryIndex
+
+COLORS = ["putih", "hitam", "merah", "biru", "pink", "hijau", "kuning", "emas", "perak"]
+GARMENTS = ["Kemeja pria", "Celana pendek", "Tank top wanita", "Jaket denim", "Topi", "Sandal"]
+DETAILS = ["motif bunga", "polos", "garis-garis", "motif macan", "lengan pendek", "oversized"]
+
+SAMPLE_QUERIES = [
+    "Kemeja pria putih motif bunga lengan pendek murah",
+    "Celana pendek pria hitam polos murah",
+    "Tank top wanita pink polos murah",
+    "Mankini hijau",
+    "Kacamata hitam vintage retro",
+]
+
+
+def synthetic_reference_data(looks: int, seed: int) -> dict:
+    """Grow the real reference data with generated looks."""
+    rng = random.Random(seed)
+    data = get_reference_artifact().reference_data
+    extra = []
+    for i in range(max(looks - 18, 0)):
+        searches = [
+            {"query": f"{rng.choice(GARMENTS)} {rng.choice(COLORS)} {rng.choice(DETAILS)} {i}"}
+            for _ in range(4)
+        ]
+        extra.append({"id": f"look-{i}", "name": f"LOOK {i}", "searches": searches})
+
+    looks_data = dict(data.get("looks", {}))
+    looks_data["male_unisex"] = looks_data.get("male_unisex", []) + extra
+    return {**data, "looks": looks_data}
+
+
+def main() -> None:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--looks", default="18,1000,5000,20000")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'looks':>8} {'entries':>8} {'build s':>8} {'mean us':>9} {'p99 us':>9}")
+    for looks in (int(value) for value in args.looks.split(",")):
+        data = synthetic_reference_data(looks, args.seed)
+
+        start = time.perf_counter()
+        index = ReferenceQueryIndex.from_reference_data(data)
+        build_seconds = time.perf_counter() - start
+
+        timings = []
+        for i in range(args.repeat):
+            query = SAMPLE_QUERIES[i % len(SAMPLE_QUERIES)]
+            start = time.perf_counter()
+            index.search(query, k=5)
+            timings.append(time.perf_counter() - start)
+
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        print(
+            f"{looks:>8} {len(index):>8} {build_seconds:>8.2f} "
+            f"{statistics.mean(timings) * 1e6:>9.1f} {p99 * 1e6:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Replay photos through handle_photo end to end against fake Telegram and Gemini.
+
+Reports throughput, p50/p99 latency (photo received -> results sent), peak
+RSS, event-loop lag and Bot API calls per photo at increasing concurrency,
+without network access or API quota.
+
+Usage:
+    python -m benchmarks.replay_bench [--concurrency 1,8,32,64] [--requests N]
+        [--gemini-latency 2.0] [--gemini-sigma 0.5] [--error-rate 0.0]
+        [--hang-rate 0.0] [--truncation-rate 0.0] [--telegram-latency 0.05]
+        [--responses recorded.jsonl] [--json results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import statistics
+import time
+
+from benchmarks.fakes import (
+    FakeGeminiClient,
+    FakeTelegram,
+    LatencyModel,
+    load_recorded_responses,
+    make_photo,
+    track_photo_completion,
+)
+from src import bot, gemini_analyzer, resilience, scheduler
+from src.lazy_import import warm_up
+from src.metrics import metrics
+
+LAG_INTERVAL_SECONDS = 0.01
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes() -> int:
+    """Current resident set size (falls back to the peak where /proc is missing)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class LoopMonitor:
+    """Sample event-loop lag and RSS while a benchmark level runs."""
+
+    def __init__(self):
+        self.lags: list[float] = []
+        self.peak_rss = 0
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL_SECONDS
+            await asyncio.sleep(LAG_INTERVAL_SECONDS)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self.peak_rss = max(self.peak_rss, _rss_bytes())
+
+    def __enter__(self) -> "LoopMonitor":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._task.cancel()
+
+
+def _resilience_counters() -> dict[str, float]:
+    """Totals of the retry, hedge and circuit breaker counters."""
+    counters = metrics.snapshot()["counters"]
+    return {
+        name: sum(counters.get(name, {}).values())
+        for name in (
+            "gemini_retries_total", "gemini_hedges_total",
+            "circuit_opened_total", "circuit_rejections_total",
+        )
+    }
+
+
+def _percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+async def run_level(args: argparse.Namespace, concurrency: int, seed_offset: int) -> dict:
+    """Drive `requests` photos through handle_photo with `concurrency` clients."""
+    requests = args.requests or max(20, concurrency * 4)
+    telegram = FakeTelegram(LatencyModel(args.telegram_latency, 0.3), seed=seed_offset)
+    client = FakeGeminiClient(
+        load_recorded_responses(args.responses),
+        LatencyModel(args.gemini_latency, args.gemini_sigma),
+        error_rate=args.error_rate,
+        truncation_rate=args.truncation_rate,
+        seed=seed_offset,
+        hang_rate=args.hang_rate,
+    )
+    gemini_analyzer._client = client
+    gemini_analyzer._semaphore = None
+    resilience._model_callers.clear()
+    counters_before = _resilience_counters()
+    # Admission control is not under test here: no rate limit, unbounded queue
+    photo_scheduler = scheduler.PhotoScheduler(
+        max_queue=requests, rate_per_minute=1e9, burst=requests
+    )
+    scheduler._scheduler = photo_scheduler
+
+    # Distinct photos so every request misses the analysis caches
+    photos = [make_photo(seed_offset + i) for i in range(requests)]
+    pending = iter(range(requests))
+    latencies: list[float] = []
+    failures = 0
+
+    async def client_loop(client_id: int) -> None:
+        nonlocal failures
+        for i in pending:
+            # Each photo comes from its own chat, as from many users sending one
+            # photo each (per-chat send pacing would otherwise dominate)
+            update = telegram.photo_update(photos[i], chat_id=i, user_id=i)
+            started = time.perf_counter()
+            await bot.handle_photo(update, telegram.context)
+            if await update.message.done:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    with LoopMonitor() as monitor:
+        started = time.perf_counter()
+        await asyncio.gather(*(client_loop(c) for c in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        await photo_scheduler.close()
+
+    latencies.sort()
+    lags = sorted(monitor.lags)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "ok": len(latencies),
+        "failed": failures,
+        "throughput_per_s": requests / elapsed,
+        "p50_s": _percentile(latencies, 0.50),
+        "p99_s": _percentile(latencies, 0.99),
+        "mean_s": statistics.mean(latencies) if latencies else 0.0,
+        "loop_lag_p99_ms": _percentile(lags, 0.99) * 1000,
+        "loop_lag_max_ms": (lags[-1] if lags else 0.0) * 1000,
+        "peak_rss_mb": monitor.peak_rss / 2**20,
+        "gemini_calls": client.calls,
+        "bytes_downloaded": telegram.bytes_downloaded,
+        "bytes_uploaded": telegram.bytes_uploaded,
+        "api_calls_per_request": telegram.api_calls / requests,
+        **{
+            name: value - counters_before[name]
+            for name, value in _resilience_counters().items()
+        },
+    }
+
+
+async def run(args: argparse.Namespace) -> list[dict]:
+    """Run every concurrency level in turn and print a results table."""
+    print(
+        f"{'conc':>5} {'reqs':>5} {'ok':>5} {'fail':>5} {'req/s':>7} "
+        f"{'p50 s':>7} {'p99 s':>7} {'lag p99':>8} {'lag max':>8} {'RSS MB':>7} "
+        f"{'retries':>7} {'hedges':>6} {'opened':>6} {'calls':>5}"
+    )
+    results = []
+    for level, concurrency in enumerate(int(value) for value in args.concurrency.split(",")):
+        result = await run_level(args, concurrency, seed_offset=args.seed + level * 100_000)
+        results.append(result)
+        print(
+            f"{result['concurrency']:>5} {result['requests']:>5} {result['ok']:>5} "
+            f"{result['failed']:>5} {result['throughput_per_s']:>7.2f} "
+            f"{result['p50_s']:>7.2f} {result['p99_s']:>7.2f} "
+            f"{result['loop_lag_p99_ms']:>8.1f} {result['loop_lag_max_ms']:>8.1f} "
+            f"{result['peak_rss_mb']:>7.1f} {result['gemini_retries_total']:>7.0f} "
+            f"{result['gemini_hedges_total']:>6.0f} {result['circuit_opened_total']:>6.0f} "
+            f"{result['api_calls_per_request']:>5.1f}"
+        )
+    return results
+
+
+def main() -> None:
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", default="1,8,32,64")
+    parser.add_argument("--requests", type=int, default=0,
+                        help="Photos per level (default: max(20, 4 x concurrency))")
+    parser.add_argument("--gemini-latency", type=float, default=2.0,
+                        help="Median model latency in seconds")
+    parser.add_argument("--gemini-sigma", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="Probability of a model call that never answers")
+    parser.add_argument("--truncation-rate", type=float, default=0.0)
+    parser.add_argument("--telegram-latency", type=float, default=0.05,
+                        help="Median Bot API call latency in seconds")
+    parser.add_argument("--responses", help="JSONL of recorded analysis responses")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Keep the bot's INFO logs")
+    args = parser.parse_args()
+
+    if not args.verbose:
+        # Injected failures would otherwise flood the output with tracebacks
+        logging.disable(logging.ERROR)
+
+    track_photo_completion()
+    # The bot does this at startup: main() compiles the prompt, and
+    # start_warm_up() imports these in the background
+    bot.get_analysis_version()
+    warm_up(*bot.WARM_UP_MODULES)
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Measure cold-start time: module imports and time until the bot is ready to poll.
+
+Each run starts a fresh interpreter that imports the bot, loads the
+reference data (through the compiled artifact), builds the Application and
+runs its startup hooks, the way main() does before polling. Runs alternate
+between a missing artifact (first start after a deploy) and a current one.
+The deferred imports that start_warm_up() loads in the background are timed
+separately: that is what the first photo would otherwise pay.
+
+Usage:
+    python -m benchmarks.startup_bench [--runs 5] [--looks 18]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from benchmarks.reference_index import synthetic_reference_data
+
+# Runs in the child interpreter; prints one JSON line of timings
+CHILD = """
+import asyncio, json, time
+started = time.perf_counter()
+from src import bot
+imported = time.perf_counter()
+
+async def start():
+    bot.get_analysis_version()
+    referenced = time.perf_counter()
+    application = bot.Application.builder().token("123:fake").build()
+    await bot.start_background_tasks(application)
+    ready = time.perf_counter()
+    await application.bot_data.pop("warm_up")
+    warm = time.perf_counter()
+    await bot.stop_metrics(application)
+    return referenced, ready, warm
+
+referenced, ready, warm = asyncio.run(start())
+print(json.dumps({
+    "import": imported - started,
+    "reference": referenced - imported,
+    "ready": ready - started,
+    "deferred": warm - ready,
+}))
+"""
+
+
+def run_child(env: dict[str, str]) -> dict[str, float]:
+    """Start the bot's startup path in a fresh interpreter and return its timings."""
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--looks", type=int, default=18,
+                        help="Grow the reference data to this many looks")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        reference_path = Path(tmp) / "reference.json"
+        reference_path.write_text(
+            json.dumps(synthetic_reference_data(args.looks, args.seed), ensure_ascii=False),
+            encoding="utf-8",
+        )
+        artifact_path = Path(tmp) / "reference-artifact.pickle"
+        env = {
+            **os.environ,
+            "PYTHONPATH": str(Path(__file__).resolve().parent.parent),
+            "REFERENCE_DATA_PATH": str(reference_path),
+            "REFERENCE_ARTIFACT_PATH": str(artifact_path),
+            "METRICS_PORT": "0",
+            "METRICS_JSON_PATH": "",
+            "JOB_STORE_PATH": "",
+            "WORKER_PROCESSES": "0",
+        }
+
+        results: dict[str, list[dict[str, float]]] = {"no artifact": [], "artifact": []}
+        for _ in range(args.runs):
+            artifact_path.unlink(missing_ok=True)
+            results["no artifact"].append(run_child(env))
+            results["artifact"].append(run_child(env))
+
+    print(f"reference data: {args.looks} looks, {args.runs} runs each (median)\n")
+    print(f"{'start':<14}{'import s':>10}{'reference s':>13}{'ready s':>10}{'deferred s':>12}")
+    for name, runs in results.items():
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(
+            f"{name:<14}{median['import']:>10.3f}{median['reference']:>13.4f}"
+            f"{median['ready']:>10.3f}{median['deferred']:>12.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
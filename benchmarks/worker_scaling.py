@@ -0,0 +1,168 @@
+"""
+Measure how photo throughput scales with the number of worker processes.
+
+For each process count N, starts N processes the way the worker pool does
+(spawned, one event loop and photo scheduler each) and gives process i the
+photos of the chats with chat_id % N == i, as WorkerPool.dispatch() would.
+Each process runs its shard through handle_photo against fake Telegram and
+Gemini layers, with a short model latency by default so that the CPU work
+(decoding, preprocessing, hashing, parsing, formatting) dominates. All
+processes start together once warmed up, and throughput is the total number
+of photos over the time until the last one is answered. CPU time per photo
+(all processes) shows whether a run was CPU-bound: when it stays flat while
+throughput grows, the extra processes only added concurrency.
+
+The ingress hop (one queue put per photo) is left out, so this measures the
+workers' capacity. Expect speedup close to N up to the number of cores and
+flat beyond it.
+
+Usage:
+    python -m benchmarks.worker_scaling [--processes 1,2,4] [--photos 64]
+        [--concurrency 8] [--gemini-latency 0.05]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+# Spawned like the pool's workers, so each loads the settings below afresh
+_mp = multiprocessing.get_context("spawn")
+
+
+async def run_shard(args: argparse.Namespace, chats: list[int], photos: list[bytes]) -> int:
+    """Answer this process's photos with `--concurrency` clients; return how many succeeded."""
+    from benchmarks.fakes import (
+        FakeGeminiClient,
+        FakeTelegram,
+        LatencyModel,
+        load_recorded_responses,
+    )
+    from src import bot, gemini_analyzer, scheduler
+
+    telegram = FakeTelegram(LatencyModel(args.telegram_latency, 0.3), seed=args.seed)
+    gemini_analyzer._client = FakeGeminiClient(
+        load_recorded_responses(), LatencyModel(args.gemini_latency, 0.3), seed=args.seed
+    )
+    gemini_analyzer._semaphore = None
+    photo_scheduler = scheduler.PhotoScheduler(
+        max_queue=len(chats), rate_per_minute=1e9, burst=len(chats)
+    )
+    scheduler._scheduler = photo_scheduler
+
+    pending = iter(zip(chats, photos))
+    ok = 0
+
+    async def client_loop() -> None:
+        nonlocal ok
+        for chat_id, photo in pending:
+            update = telegram.photo_update(photo, chat_id=chat_id, user_id=chat_id)
+            await bot.handle_photo(update, telegram.context)
+            if await update.message.done:
+                ok += 1
+
+    await asyncio.gather(*(client_loop() for _ in range(args.concurrency)))
+    await photo_scheduler.close()
+    return ok
+
+
+def worker_main(
+    index: int,
+    processes: int,
+    args: argparse.Namespace,
+    start: multiprocessing.Barrier,
+    results: multiprocessing.Queue,
+) -> None:
+    """Entry point of one measured process."""
+    from benchmarks.fakes import make_photo, track_photo_completion
+    from src import bot
+    from src.lazy_import import warm_up
+
+    logging.disable(logging.ERROR)
+    track_photo_completion()
+    bot.get_analysis_version()
+    warm_up(*bot.WARM_UP_MODULES)
+
+    # Distinct photos so every request misses the analysis cache
+    chats = [chat_id for chat_id in range(args.photos) if chat_id % processes == index]
+    photos = [make_photo(args.seed + chat_id) for chat_id in chats]
+
+    start.wait()
+    started = time.time()
+    cpu_started = time.process_time()
+    ok = asyncio.run(run_shard(args, chats, photos))
+    results.put((started, time.time(), time.process_time() - cpu_started, ok))
+
+
+def run_processes(args: argparse.Namespace, processes: int) -> dict:
+    """Run the photos on `processes` processes; return throughput and outcome."""
+    start = _mp.Barrier(processes)
+    results = _mp.Queue()
+    workers = [
+        _mp.Process(target=worker_main, args=(index, processes, args, start, results))
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    outcomes = [results.get() for _ in workers]
+    for worker in workers:
+        worker.join()
+
+    elapsed = max(finished for _, finished, _, _ in outcomes) - min(
+        started for started, _, _, _ in outcomes
+    )
+    return {
+        "processes": processes,
+        "ok": sum(ok for _, _, _, ok in outcomes),
+        "elapsed_s": elapsed,
+        "throughput_per_s": args.photos / elapsed,
+        "cpu_ms_per_photo": sum(cpu for _, _, cpu, _ in outcomes) / args.photos * 1000,
+    }
+
+
+def main() -> None:
+    """Run every process count in turn and print a results table."""
+    cores = os.cpu_count() or 1
+    default_counts = sorted({1, 2, *(2**i for i in range(cores.bit_length()) if 2**i <= cores)})
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", default=",".join(map(str, default_counts)),
+                        help="Comma-separated process counts (default: powers of 2 up to cores)")
+    parser.add_argument("--photos", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Photos in flight per process")
+    parser.add_argument("--gemini-latency", type=float, default=0.05,
+                        help="Median model latency in seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.005,
+                        help="Median Bot API call latency in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # Read by the spawned processes when they import the bot
+    os.environ.update({
+        "WORKER_PROCESSES": "0",
+        "JOB_STORE_PATH": "",
+        "ANALYSIS_CACHE_DIR": "",
+        "NEAR_DUPLICATE_ENABLED": "false",
+        "SCHEDULER_WORKERS": str(args.concurrency),
+        "GEMINI_MAX_CONCURRENCY": str(args.concurrency),
+    })
+
+    print(f"{args.photos} photos, {args.concurrency} in flight per process, {cores} core(s)\n")
+    print(f"{'processes':>9} {'ok':>5} {'total s':>8} {'photos/s':>9} {'speedup':>8} "
+          f"{'cpu ms/photo':>13}")
+    baseline = None
+    for processes in (int(value) for value in args.processes.split(",")):
+        result = run_processes(args, processes)
+        baseline = baseline or result["throughput_per_s"]
+        print(
+            f"{result['processes']:>9} {result['ok']:>5} {result['elapsed_s']:>8.2f} "
+            f"{result['throughput_per_s']:>9.2f} "
+            f"{result['throughput_per_s'] / baseline:>8.2f} "
+            f"{result['cpu_ms_per_photo']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""Content-addressed cache for Gemini analysis results."""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, BinaryIO
+
+from .config import (
+    ANALYSIS_CACHE_DIR,
+    ANALYSIS_CACHE_MAX_ENTRIES,
+    ANALYSIS_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Read size when hashing an image held in a file
+_HASH_CHUNK_SIZE = 64 * 1024
+
+
+def make_cache_key(image_bytes: bytes | BinaryIO, version: str) -> str:
+    """
+    Build a cache key from the image content and the analysis version.
+
+    Args:
+        image_bytes: The raw image data, or a file holding it (hashed in chunks).
+        version: Identifier of the prompt/model combination that produced the result.
+
+    Returns:
+        Hex digest identifying this image under this analysis version.
+    """
+    digest = hashlib.sha256()
+    digest.update(version.encode("utf-8"))
+    digest.update(b"\0")
+    if isinstance(image_bytes, bytes):
+        digest.update(image_bytes)
+    else:
+        image_bytes.seek(0)
+        while chunk := image_bytes.read(_HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache of parsed analysis results.
+
+    The memory tier is an LRU bounded by entry count; both tiers expire
+    entries after a TTL. The disk tier stores one JSON file per key so
+    results survive restarts.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 86400,
+        disk_dir: str | Path | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.near_duplicate_hits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> dict[str, Any] | None:
+        """
+        Look up a cached result.
+
+        Args:
+            key: Cache key from make_cache_key().
+
+        Returns:
+            The cached result dict, or None on a miss.
+        """
+        result, from_disk = self._lookup(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.disk_hits += from_disk
+        return result
+
+    def peek(self, key: str) -> dict[str, Any] | None:
+        """Like get(), but not counted as a hit or miss (e.g. for candidate matches)."""
+        return self._lookup(key)[0]
+
+    def record_near_duplicate_hit(self) -> None:
+        """Count the last miss as a hit: a near-duplicate photo's result answered it."""
+        self.misses -= 1
+        self.hits += 1
+        self.near_duplicate_hits += 1
+
+    def put(self, key: str, result: dict[str, Any]) -> None:
+        """
+        Store a result in both tiers.
+
+        Args:
+            key: Cache key from make_cache_key().
+            result: The parsed analysis result.
+        """
+        now = time.time()
+        self._remember(key, result, now)
+        self._write_disk(key, result, now)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the current memory tier size."""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "near_duplicate_hits": self.near_duplicate_hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+        }
+
+    def _lookup(self, key: str) -> tuple[dict[str, Any] | None, bool]:
+        """Find a non-expired result; returns it and whether it came from disk."""
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, result = entry
+            if now - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                return result, False
+            del self._entries[key]
+
+        result = self._read_disk(key, now)
+        if result is not None:
+            self._remember(key, result, now)
+            return result, True
+        return None, False
+
+    def _remember(self, key: str, result: dict[str, Any], now: float) -> None:
+        """Insert into the memory tier, evicting the least recently used entries."""
+        self._entries[key] = (now, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key: str) -> Path:
+        """Return the on-disk location for a key."""
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _read_disk(self, key: str, now: float) -> dict[str, Any] | None:
+        """Read a non-expired entry from the disk tier."""
+        if not self.disk_dir:
+            return None
+
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                payload = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+        if now - payload.get("stored_at", 0) > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+        return payload.get("result")
+
+    def _write_disk(self, key: str, result: dict[str, Any], now: float) -> None:
+        """Atomically write an entry to the disk tier."""
+        if not self.disk_dir:
+            return
+
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": now, "result": result}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache entry {path}: {e}")
+
+
+_cache = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Get or create the shared analysis cache."""
+    global _cache
+    if _cache is None:
+        _cache = AnalysisCache(
+            max_entries=ANALYSIS_CACHE_MAX_ENTRIES,
+            ttl_seconds=ANALYSIS_CACHE_TTL_SECONDS,
+            disk_dir=ANALYSIS_CACHE_DIR,
+        )
+    return _cache
@@ -0,0 +1,213 @@
+"""Response schema and validated parsing for Gemini clothing analyses."""
+
+import json
+import logging
+from typing import Any
+
+from pydantic import BaseModel, Field, ValidationError
+
+logger = logging.getLogger(__name__)
+
+
+# Field order matters: Gemini emits properties in this order, which lets the
+# streaming parser show the greeting and descriptions before the items.
+# No defaults here - the Gemini API rejects defaults in response schemas.
+class ClothingItem(BaseModel):
+    """A single clothing item with its Tokopedia search query."""
+
+    name_ua: str = Field(description="Коротка смішна назва українською (3-5 слів)")
+    search_query_id: str = Field(
+        description="Indonesian Tokopedia query with color+pattern+style+murah"
+    )
+    category: str = Field(description="top, bottom, accessory, footwear або headwear")
+
+
+class PersonAnalysis(BaseModel):
+    """One person in the photo and what they are wearing."""
+
+    description_ua: str = Field(description="Опис людини українською")
+    items: list[ClothingItem]
+
+
+class AlbumPersonAnalysis(PersonAnalysis):
+    """A person in one of the photos of an album."""
+
+    photo_index: int = Field(description="Номер фото в альбомі, починаючи з 1")
+
+
+class AnalysisResult(BaseModel):
+    """Full analysis of a single photo."""
+
+    greeting_ua: str = Field(description="Коротке смішне вітання українською")
+    people: list[PersonAnalysis]
+
+
+class AlbumAnalysisResult(BaseModel):
+    """Full analysis of an album of photos."""
+
+    greeting_ua: str = Field(description="Коротке смішне вітання українською")
+    people: list[AlbumPersonAnalysis]
+
+
+_PERSON_MODELS = {
+    AnalysisResult: PersonAnalysis,
+    AlbumAnalysisResult: AlbumPersonAnalysis,
+}
+
+# Parse outcome counters, exposed for monitoring
+_parse_stats = {
+    "parsed": 0,
+    "failures": 0,
+    "repaired": 0,
+    "unrecoverable": 0,
+}
+
+
+def get_parse_stats() -> dict[str, int]:
+    """Return counters of parse outcomes since startup."""
+    return dict(_parse_stats)
+
+
+def strip_markdown_fences(text: str) -> str:
+    """Remove ```json ... ``` fences around a response, if present."""
+    text = text.strip()
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def repair_truncated_json(text: str) -> Any | None:
+    """
+    Recover the complete prefix of a truncated or malformed JSON document.
+
+    The text is cut back to the last point where every open value was
+    complete (dropping a partial trailing element), and the open objects
+    and arrays are closed.
+
+    Args:
+        text: JSON text, possibly cut off mid-value.
+
+    Returns:
+        The decoded JSON value, or None if nothing could be recovered.
+    """
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    if start < 0:
+        return None
+
+    stack: list[str] = []
+    in_string = False
+    escaped = False
+    cut = None  # (end index, closers needed)
+
+    for pos in range(start, len(text)):
+        char = text[pos]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+            cut = (pos + 1, list(stack))
+        elif char in "}]":
+            if not stack or stack[-1] != char:
+                break
+            stack.pop()
+            cut = (pos + 1, list(stack))
+            if not stack:
+                break
+        elif char == ",":
+            cut = (pos, list(stack))
+
+    if cut is None:
+        return None
+
+    end, closers = cut
+    candidate = text[start:end].rstrip().rstrip(",") + "".join(reversed(closers))
+    try:
+        return json.loads(candidate)
+    except json.JSONDecodeError:
+        return None
+
+
+def _salvage(data: Any, person_model: type[PersonAnalysis]) -> dict[str, Any] | None:
+    """Keep the valid people and items of a partially valid analysis."""
+    if not isinstance(data, dict) or not isinstance(data.get("people"), list):
+        return None
+
+    people = []
+    for person in data["people"]:
+        if not isinstance(person, dict):
+            continue
+        items = []
+        for item in person.get("items") or []:
+            try:
+                items.append(ClothingItem.model_validate(item).model_dump())
+            except ValidationError:
+                continue
+        if not items:
+            continue
+        try:
+            people.append(
+                person_model.model_validate(
+                    {"description_ua": "", **person, "items": items}
+                ).model_dump()
+            )
+        except ValidationError:
+            continue
+
+    greeting = data.get("greeting_ua")
+    return {
+        "greeting_ua": greeting if isinstance(greeting, str) else "",
+        "people": people,
+    }
+
+
+def parse_analysis(
+    text: str,
+    model: type[BaseModel] = AnalysisResult,
+) -> dict[str, Any] | None:
+    """
+    Parse and validate a model response against the analysis schema.
+
+    Valid responses are returned as-is. Otherwise the lenient path repairs
+    truncated JSON and keeps whatever people and items still validate.
+
+    Args:
+        text: Raw response text.
+        model: Schema to validate against.
+
+    Returns:
+        The analysis as a plain dict, or None if nothing could be recovered.
+    """
+    text = strip_markdown_fences(text)
+    try:
+        result = model.model_validate_json(text).model_dump()
+        _parse_stats["parsed"] += 1
+        return result
+    except ValidationError as e:
+        _parse_stats["failures"] += 1
+        logger.warning(f"Response failed schema validation: {e.error_count()} error(s)")
+
+    result = _salvage(repair_truncated_json(text), _PERSON_MODELS[model])
+    if result is None or not result["people"]:
+        return None
+
+    _parse_stats["repaired"] += 1
+    logger.info(f"Repaired response locally, kept {len(result['people'])} people")
+    return result
+
+
+def record_unrecoverable() -> None:
+    """Count a response that could not be parsed even after repair."""
+    _parse_stats["unrecoverable"] += 1
@@ -0,0 +1,205 @@
+"""
+Analyze a directory of outfit photos offline and write the results to JSONL.
+
+Photos are analyzed concurrently, paced by an optional rate limit, and each
+result is appended to the output as soon as it completes. Photos that already
+have a successful result in the output are skipped, so an interrupted run can
+simply be restarted.
+
+Usage:
+    python -m src.batch_cli PHOTO_DIR results.jsonl [--workers 8]
+        [--rate-per-minute 60] [--format plain|html]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from pathlib import Path
+from typing import Any, TextIO
+
+import httpx
+from google.genai import errors
+
+from .analysis_cache import get_analysis_cache, make_cache_key
+from .config import GEMINI_MAX_CONCURRENCY
+from .gemini_analyzer import analyze_image_async, get_analysis_version
+from .image_preprocessing import preprocess_image
+from .resilience import CircuitOpenError
+from .response_formatter import format_analysis_response
+from .scheduler import TokenBucket
+from .tokopedia_enrichment import get_tokopedia_enricher
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def find_photos(photo_dir: Path) -> list[Path]:
+    """All images below a directory, in a stable order."""
+    return sorted(
+        path for path in photo_dir.rglob("*")
+        if path.is_file() and path.suffix.lower() in IMAGE_SUFFIXES
+    )
+
+
+def load_completed(output: Path) -> set[str]:
+    """Photos with a successful result in an existing output file."""
+    completed = set()
+    if not output.exists():
+        return completed
+    with open(output, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut off by an interrupted run
+                continue
+            if not isinstance(record, dict) or "photo" not in record:
+                # Not one of our records (e.g. a hand-edited line)
+                continue
+            if "error" not in record:
+                completed.add(record["photo"])
+    return completed
+
+
+class BatchRunner:
+    """
+    Analyze photos with a fixed number of workers and an optional rate limit.
+
+    Args:
+        photo_dir: Directory the photo names are relative to.
+        out: Open JSONL file that receives one record per photo.
+        workers: Number of photos analyzed at once.
+        rate_per_minute: Maximum analyses started per minute (0 for no limit).
+        html_links: Format responses as HTML (see format_analysis_response()).
+    """
+
+    def __init__(
+        self,
+        photo_dir: Path,
+        out: TextIO,
+        workers: int = GEMINI_MAX_CONCURRENCY,
+        rate_per_minute: float = 0,
+        html_links: bool = False,
+    ):
+        self.photo_dir = photo_dir
+        self.out = out
+        self.workers = workers
+        self.html_links = html_links
+        self._bucket = TokenBucket(rate_per_minute / 60, 1) if rate_per_minute > 0 else None
+        self.latencies: list[float] = []
+        self.failed = 0
+        self.cached = 0
+
+    async def run(self, photos: list[Path]) -> None:
+        """Analyze every photo, writing each record as soon as it is ready."""
+        pending: asyncio.Queue[Path] = asyncio.Queue()
+        for path in photos:
+            pending.put_nowait(path)
+        await asyncio.gather(*(
+            self._worker(pending) for _ in range(min(self.workers, len(photos)))
+        ))
+        enricher = get_tokopedia_enricher()
+        if enricher is not None:
+            await enricher.close()
+
+    async def _worker(self, pending: asyncio.Queue) -> None:
+        while not pending.empty():
+            path = pending.get_nowait()
+            if self._bucket is not None:
+                while not self._bucket.try_acquire():
+                    await asyncio.sleep(self._bucket.retry_after())
+            record = await self._analyze(path)
+            self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.out.flush()
+
+            done = len(self.latencies) + self.failed
+            status = f"error: {record['error']}" if "error" in record else f"{record['seconds']:.1f}s"
+            logger.info(f"[{done}] {record['photo']}: {status}")
+
+    async def _analyze(self, path: Path) -> dict[str, Any]:
+        """Analyze one photo and build its output record."""
+        name = path.relative_to(self.photo_dir).as_posix()
+        started = time.monotonic()
+        try:
+            photo_bytes = await asyncio.to_thread(path.read_bytes)
+            cache = get_analysis_cache()
+            cache_key = make_cache_key(photo_bytes, get_analysis_version())
+            result = cache.get(cache_key)
+            if result is not None:
+                self.cached += 1
+            else:
+                prepared = await asyncio.to_thread(preprocess_image, photo_bytes)
+                result = await analyze_image_async(prepared.data, prepared.mime_type)
+                if "error" not in result:
+                    cache.put(cache_key, result)
+        except (
+            OSError, TimeoutError, CircuitOpenError, errors.APIError, httpx.TransportError
+        ) as e:
+            self.failed += 1
+            return {"photo": name, "error": f"{type(e).__name__}: {e}"}
+
+        seconds = time.monotonic() - started
+        if "error" in result:
+            self.failed += 1
+            return {"photo": name, "error": result["error"], "analysis": result}
+
+        self.latencies.append(seconds)
+        enricher = get_tokopedia_enricher()
+        shown = await enricher.enrich(result) if enricher is not None else result
+        return {
+            "photo": name,
+            "seconds": round(seconds, 3),
+            "analysis": result,
+            "response": format_analysis_response(shown, self.html_links),
+        }
+
+
+def main() -> None:
+    """Run a batch analysis from the command line."""
+    parser = argparse.ArgumentParser(description="Analyze a directory of outfit photos to JSONL")
+    parser.add_argument("photo_dir", type=Path)
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--workers", type=int, default=GEMINI_MAX_CONCURRENCY,
+                        help="Photos analyzed at once")
+    parser.add_argument("--rate-per-minute", type=float, default=0,
+                        help="Maximum analyses started per minute (default: no limit)")
+    parser.add_argument("--format", choices=("plain", "html"), default="plain",
+                        help="Rendering of the formatted response")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    photos = find_photos(args.photo_dir)
+    completed = load_completed(args.output)
+    todo = [
+        path for path in photos
+        if path.relative_to(args.photo_dir).as_posix() not in completed
+    ]
+    skipped = len(photos) - len(todo)
+    logger.info(f"{len(photos)} photo(s) found, {skipped} already done, {len(todo)} to analyze")
+
+    started = time.monotonic()
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.output, "a", encoding="utf-8") as out:
+        runner = BatchRunner(
+            args.photo_dir, out, args.workers, args.rate_per_minute, args.format == "html"
+        )
+        asyncio.run(runner.run(todo))
+    elapsed = time.monotonic() - started
+
+    latencies = sorted(runner.latencies)
+    print(f"photos:      {len(todo)} processed ({runner.cached} from cache), "
+          f"{runner.failed} failed, {skipped} skipped")
+    print(f"elapsed:     {elapsed:.1f}s")
+    print(f"throughput:  {len(todo) / elapsed if elapsed else 0.0:.2f} photos/s")
+    if latencies:
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"latency:     mean {statistics.mean(latencies):.1f}s, p95 {p95:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,29 +2,105 @@
 
 import asyncio
 import logging
+import random
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import BinaryIO, TypeVar
 
-from telegram import Update
+from telegram import Message, Update
+from telegram.error import TelegramError
 from telegram.ext import (
     Application,
+    CallbackContext,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     filters,
 )
 
-from .config import TELEGRAM_BOT_API, validate_config
-from .gemini_analyzer import analyze_image
+from .analysis_cache import get_analysis_cache, make_cache_key
+from .config import (
+    BOT_MODE,
+    GEMINI_CASCADE,
+    GEMINI_MODEL,
+    GEMINI_STREAMING,
+    JOB_LEASE_SECONDS,
+    METRICS_JSON_INTERVAL_SECONDS,
+    METRICS_JSON_PATH,
+    METRICS_LISTEN,
+    METRICS_PORT,
+    NEAR_DUPLICATE_ENABLED,
+    RESPONSE_FORMAT,
+    NEAR_DUPLICATE_MAX_DISTANCE,
+    PHOTO_SIZE_ESTIMATE_BYTES,
+    STREAM_EDIT_INTERVAL_SECONDS,
+    TELEGRAM_BOT_API,
+    validate_config,
+)
+from .gemini_analyzer import (
+    analyze_image_async,
+    analyze_images_async,
+    analyze_image_stream,
+    get_analysis_version,
+)
+from .http_server import HTTPServer
+from .image_preprocessing import PreparedImage, preprocess_image, select_photo_size
+from .job_store import Job, get_job_store
+from .lazy_import import lazy_import, warm_up
+from .media_group import MediaGroupCollector
+from .metrics import COUNT_BUCKETS, add_metrics_routes, dump_json_periodically, metrics
+from .model_cascade import analyze_image_cascade
+from .perceptual_hash import dhash, get_near_duplicate_index
+from .photo_download import close_download_client, download_photo, get_photo_budget
+from .resilience import CircuitOpenError, breaker_stats
 from .response_formatter import (
+    GREETINGS,
+    format_album_response,
     format_analysis_response,
     format_error_message,
+    format_queue_message,
+    format_rejection_message,
     format_start_message,
     split_message_for_caption,
+    visible_length,
 )
+from .scheduler import get_photo_scheduler
+from .telegram_sender import get_telegram_sender, message_options
+from .tokopedia_enrichment import get_tokopedia_enricher
+from .webhook import run_webhook
+from .worker_pool import get_worker_pool
+
+# Loaded on first use; see start_warm_up()
+errors = lazy_import("google.genai.errors")
+analysis_schema = lazy_import(f"{__package__}.analysis_schema")
+
+# Imported in the background once the bot is up, so that neither startup nor
+# the first photo waits for them
+WARM_UP_MODULES = ("google.genai", f"{__package__}.analysis_schema", "numpy")
+
+# Shown when Gemini keeps failing or the circuit breaker is open
+MODEL_UNAVAILABLE_MESSAGE = "Сервіс аналізу зараз перевантажений. Спробуй за хвилинку!"
 
 # Telegram message limits (conservative to be safe)
 TELEGRAM_CAPTION_LIMIT = 900
 TELEGRAM_MESSAGE_LIMIT = 4096
 
+# Telegram counts HTML responses by their visible text
+_response_length = visible_length if RESPONSE_FORMAT == "html" else len
+
+
+def _split_response(text: str, first_limit: int) -> tuple[str, list[str]]:
+    """Split a formatted response into a first part of `first_limit` and follow-ups."""
+    # HTML responses have one item per line, so a person's block may be split
+    # between items rather than moved whole to the next message
+    return split_message_for_caption(
+        text, first_limit, TELEGRAM_MESSAGE_LIMIT, _response_length,
+        split_blocks=RESPONSE_FORMAT == "html",
+    )
+
 # Set up logging
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -54,63 +130,714 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         await update.message.reply_text(help_text)
 
 
+T = TypeVar("T")
+
+# The analysis cache and the near-duplicate index read and write files, so
+# they are used from one thread of their own rather than the event loop; with
+# a single thread, their in-memory state never changes concurrently either
+_cache_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analysis-cache")
+
+
+async def _in_cache_thread(function: Callable[..., T], *args) -> T:
+    """Run a function that uses the analysis cache or the near-duplicate index."""
+    return await asyncio.get_running_loop().run_in_executor(
+        _cache_executor, partial(function, *args)
+    )
+
+
+def _hash_photo(
+    photo_bytes: bytes | BinaryIO, version: str, perceptual: bool
+) -> tuple[str, int | None]:
+    """
+    Compute a photo's exact cache key and, if wanted, its perceptual hash.
+
+    Both read the whole photo (possibly from a spooled file on disk) and
+    dHash decodes it, so this runs in a worker thread.
+
+    Args:
+        photo_bytes: The downloaded photo (see DownloadedPhoto.data).
+        version: The analysis version (see get_analysis_version()).
+        perceptual: Whether to compute the perceptual hash.
+
+    Returns:
+        Tuple of (exact cache key, perceptual hash or None).
+    """
+    cache_key = make_cache_key(photo_bytes, version)
+    image_hash = None
+    if perceptual:
+        try:
+            image_hash = dhash(photo_bytes)
+        except Exception as e:
+            logger.warning(f"Could not compute perceptual hash: {e}")
+    return cache_key, image_hash
+
+
+def _find_near_duplicate(image_hash: int) -> dict | None:
+    """
+    Look up a cached analysis of a visually similar photo.
+
+    Matches are tried closest first; those whose result has left the
+    analysis cache are dropped from the index. Candidates are only peeked
+    at, so they do not count as cache misses. Runs in the cache thread.
+
+    Args:
+        image_hash: Perceptual hash of the photo.
+
+    Returns:
+        The cached result, or None.
+    """
+    index = get_near_duplicate_index()
+    cache = get_analysis_cache()
+    for distance, cache_key in index.search(image_hash, NEAR_DUPLICATE_MAX_DISTANCE):
+        analysis_result = cache.peek(cache_key)
+        if analysis_result is not None:
+            logger.info(f"Found near-duplicate photo at Hamming distance {distance}")
+            return analysis_result
+        # Evicted or expired from the cache, so it can never match again
+        index.remove(cache_key)
+    return None
+
+
+async def _lookup_analysis(
+    photo_bytes: bytes | BinaryIO,
+) -> tuple[dict | None, str, int | None]:
+    """
+    Look up a cached analysis of this photo or of a near-duplicate.
+
+    Args:
+        photo_bytes: The downloaded photo (see DownloadedPhoto.data).
+
+    Returns:
+        Tuple of (cached result or None, exact cache key, perceptual hash or None).
+    """
+    cache_key, image_hash = await asyncio.to_thread(
+        _hash_photo, photo_bytes, get_analysis_version(), NEAR_DUPLICATE_ENABLED
+    )
+    analysis_result = await _in_cache_thread(_find_cached_analysis, cache_key, image_hash)
+    return analysis_result, cache_key, image_hash
+
+
+def _find_cached_analysis(cache_key: str, image_hash: int | None) -> dict | None:
+    """Cached analysis under the exact key or of a near-duplicate (in the cache thread)."""
+    cache = get_analysis_cache()
+    analysis_result = cache.get(cache_key)
+
+    if analysis_result is None and image_hash is not None:
+        # Same outfit at a different resolution or compression level?
+        analysis_result = _find_near_duplicate(image_hash)
+        if analysis_result is not None:
+            cache.record_near_duplicate_hit()
+            cache.put(cache_key, analysis_result)
+
+    if analysis_result is not None:
+        logger.info(f"Analysis cache hit ({cache.stats()})")
+    else:
+        logger.info(f"Analysis cache miss ({cache.stats()})")
+    return analysis_result
+
+
+def _remember_analysis(cache_key: str, image_hash: int | None, analysis_result: dict) -> None:
+    """Cache a fresh analysis under its exact key and perceptual hash (in the cache thread)."""
+    if "error" in analysis_result:
+        return
+    get_analysis_cache().put(cache_key, analysis_result)
+    if image_hash is not None:
+        get_near_duplicate_index().add(image_hash, cache_key)
+
+
+def _record_analysis_shape(analysis_result: dict) -> None:
+    """Count people and items per analyzed image, and failed analyses."""
+    if "error" in analysis_result:
+        metrics.inc("analysis_errors_total")
+        return
+    people = analysis_result.get("people", [])
+    metrics.observe("people_per_image", len(people), buckets=COUNT_BUCKETS)
+    metrics.observe(
+        "items_per_image",
+        sum(len(person.get("items", [])) for person in people),
+        buckets=COUNT_BUCKETS,
+    )
+
+
+async def _enrich(analysis_result: dict) -> dict:
+    """Add the top Tokopedia products to a result for display, if enrichment is on."""
+    enricher = get_tokopedia_enricher()
+    if enricher is None:
+        return analysis_result
+    with metrics.span("enrich"):
+        return await enricher.enrich(analysis_result)
+
+
+async def _finish_processing_message(
+    processing_message: Message, fallback: Message, text: str, formatted: bool = False
+) -> None:
+    """
+    Put the final text (results or an error) into the processing message.
+
+    The processing message is edited in place: its caption when it is the
+    photo reply, its text otherwise. If it cannot be edited (e.g. the user
+    deleted it), the text is sent as a new reply to `fallback` instead.
+
+    Args:
+        processing_message: The "processing" message to replace.
+        fallback: Message to reply to if the edit fails.
+        text: The final text.
+        formatted: Whether `text` is a formatted response (see RESPONSE_FORMAT).
+    """
+    sender = get_telegram_sender()
+    is_photo = bool(processing_message.photo)
+    options = message_options(text_message=not is_photo) if formatted else {}
+    try:
+        if is_photo:
+            await sender.edit_caption(processing_message, text, coalesce=True, **options)
+        else:
+            await sender.edit_text(processing_message, text, coalesce=True, **options)
+    except TelegramError as e:
+        logger.warning(f"Could not edit the processing message, replying instead: {e}")
+        await sender.reply_text(fallback, text, **(message_options() if formatted else {}))
+
+
+# Progress edits still waiting for their turn (tasks are only weakly referenced)
+_progress_edits: set[asyncio.Task] = set()
+
+
+async def _stream_analysis(
+    prepared: PreparedImage,
+    processing_message: Message,
+    received_at: float,
+    model: str = GEMINI_MODEL,
+) -> dict:
+    """
+    Stream the analysis, showing items in the processing message as they arrive.
+
+    Edits are spaced at least STREAM_EDIT_INTERVAL_SECONDS apart and run in
+    the background through the Telegram sender, so a throttled edit never
+    holds up the stream: a newer edit (or the final result) replaces one
+    that is still waiting, and a failed edit never fails the request.
+
+    Args:
+        prepared: The preprocessed image.
+        processing_message: The "processing" photo reply whose caption is edited.
+        received_at: time.monotonic() when the photo was received.
+        model: Gemini model to stream from.
+
+    Returns:
+        The fully parsed analysis result.
+    """
+    sender = get_telegram_sender()
+    # One fallback greeting for the whole stream (until the model's arrives):
+    # a fresh random one per edit would flicker and defeat the duplicate check
+    partial = {"greeting_ua": random.choice(GREETINGS), "people": []}
+    result = None
+    next_edit_at = 0.0
+    last_text = None
+    first_link_sent = False
+
+    async def show_progress(text: str) -> None:
+        nonlocal first_link_sent
+        try:
+            sent = await sender.edit_caption(
+                processing_message, text, coalesce=True, **message_options(text_message=False)
+            )
+        except TelegramError as e:
+            logger.debug(f"Skipped progress edit: {e}")
+            return
+        if sent is not None and not first_link_sent:
+            first_link_sent = True
+            time_to_first_link = time.monotonic() - received_at
+            metrics.observe("time_to_first_link_seconds", time_to_first_link)
+            logger.info(f"Time to first link: {time_to_first_link * 1000:.0f} ms")
+
+    async for event in analyze_image_stream(prepared.data, prepared.mime_type, model=model):
+        if event.kind == "result":
+            result = event.data
+            continue
+
+        if event.kind == "greeting":
+            partial["greeting_ua"] = event.data or partial["greeting_ua"]
+            continue
+
+        while len(partial["people"]) <= event.person_index:
+            partial["people"].append({"items": []})
+        person = partial["people"][event.person_index]
+        if event.kind == "person":
+            person["description_ua"] = event.data
+            continue
+        person["items"].append(event.data)
+
+        now = time.monotonic()
+        if now < next_edit_at:
+            continue
+        next_edit_at = now + STREAM_EDIT_INTERVAL_SECONDS
+
+        text, _ = _split_response(format_analysis_response(partial), TELEGRAM_CAPTION_LIMIT)
+        if text == last_text:
+            continue
+        last_text = text
+        task = asyncio.create_task(show_progress(text))
+        _progress_edits.add(task)
+        task.add_done_callback(_progress_edits.discard)
+
+    return result
+
+
+async def handle_album(updates: list[Update], context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Analyze all photos of an album in one model call and reply once."""
+    first_message = updates[0].message
+    logger.info(f"Received album of {len(updates)} photo(s)")
+
+    sender = get_telegram_sender()
+    processing_message = await sender.reply_text(first_message, "Аналізую альбом... Зачекай трохи!")
+
+    photos = [select_photo_size(update.message.photo) for update in updates]
+    downloads = []
+    reservation = None
+    try:
+        # Reserve the whole album at once: albums holding part of the budget
+        # while waiting for the rest could otherwise block each other
+        reservation = await get_photo_budget().reserve(
+            sum(photo.file_size or PHOTO_SIZE_ESTIMATE_BYTES for photo in photos)
+        )
+
+        # Download all photos concurrently
+        files = await asyncio.gather(*(context.bot.get_file(photo.file_id) for photo in photos))
+        downloads = await asyncio.gather(*(download_photo(file) for file in files))
+        reservation.resize(sum(download.size for download in downloads))
+
+        lookups = await asyncio.gather(*(
+            _lookup_analysis(download.data) for download in downloads
+        ))
+        analysis_results = [result for result, _, _ in lookups]
+        missing = [i for i, result in enumerate(analysis_results) if result is None]
+
+        if missing:
+            prepared = await asyncio.gather(*(
+                asyncio.to_thread(preprocess_image, downloads[i].data) for i in missing
+            ))
+            # Only the prepared uploads are needed from here on
+            for download in downloads:
+                download.close()
+            reservation.resize(sum(len(image.data) for image in prepared))
+            fresh_results = await analyze_images_async(
+                [(image.data, image.mime_type) for image in prepared]
+            )
+            del prepared
+            for i, analysis_result in zip(missing, fresh_results):
+                _record_analysis_shape(analysis_result)
+                _, cache_key, image_hash = lookups[i]
+                await _in_cache_thread(
+                    _remember_analysis, cache_key, image_hash, analysis_result
+                )
+                analysis_results[i] = analysis_result
+
+        for download in downloads:
+            download.close()
+        reservation.release()
+
+        enriched = await asyncio.gather(*(_enrich(result) for result in analysis_results))
+        response = format_album_response(enriched)
+
+        # One consolidated reply in place of the processing message, split
+        # only where Telegram's length limit requires
+        first_chunk, follow_ups = _split_response(response, TELEGRAM_MESSAGE_LIMIT)
+        await _finish_processing_message(
+            processing_message, first_message, first_chunk, formatted=True
+        )
+        for msg in follow_ups:
+            await sender.reply_text(first_message, msg, **message_options())
+
+        logger.info(
+            f"Sent album response for {len(updates)} photo(s), "
+            f"{len(missing)} analyzed in one call"
+        )
+        metrics.inc("albums_total", outcome="ok")
+
+    except TimeoutError:
+        metrics.inc("albums_total", outcome="timeout")
+        logger.warning("Gemini album analysis timed out")
+        await _finish_processing_message(
+            processing_message, first_message,
+            format_error_message("Аналіз триває занадто довго. Спробуй ще раз!"),
+        )
+
+    except (CircuitOpenError, errors.APIError) as e:
+        metrics.inc("albums_total", outcome="unavailable")
+        logger.warning(f"Gemini unavailable for album: {e}")
+        await _finish_processing_message(
+            processing_message, first_message, format_error_message(MODEL_UNAVAILABLE_MESSAGE)
+        )
+
+    except Exception as e:
+        metrics.inc("albums_total", outcome="error")
+        logger.error(f"Error processing album: {e}", exc_info=True)
+        await _finish_processing_message(
+            processing_message, first_message, format_error_message(str(e))
+        )
+
+    finally:
+        for download in downloads:
+            download.close()
+        if reservation is not None:
+            reservation.release()
+
+
+async def _run_job(job_id: int | None, work: Awaitable[dict | None]) -> None:
+    """
+    Run a scheduled job and record its outcome in the job store.
+
+    A cancelled job (shutdown) stays claimed, so it is released and resumed
+    later rather than marked finished.
+    """
+    try:
+        result = await work
+    except Exception as e:
+        if job_id is not None:
+            store = get_job_store()
+            await store.run(store.fail, job_id, str(e))
+        raise
+    if job_id is not None:
+        store = get_job_store()
+        await store.run(store.complete, job_id, result)
+
+
+async def _add_job(kind: str, updates: list[Update]) -> tuple[bool, int | None]:
+    """
+    Record a job in the job store, if one is configured.
+
+    Jobs for worker processes are left unclaimed for the worker to claim.
+
+    Returns:
+        Tuple of (whether the job is new, its id or None without a store).
+    """
+    store = get_job_store()
+    if store is None:
+        return True, None
+
+    first_update = updates[0]
+    job = await store.run(
+        store.add,
+        first_update.update_id,
+        first_update.effective_chat.id,
+        first_update.effective_user.id if first_update.effective_user else 0,
+        first_update.message.photo[-1].file_unique_id,
+        kind,
+        [update.to_dict() for update in updates],
+        claim=get_worker_pool() is None,
+    )
+    if job is None:
+        # Telegram redelivered the update, or the photo is already queued
+        metrics.inc("duplicate_updates_total")
+        logger.info(f"Ignoring duplicate {kind} update {first_update.update_id}")
+        return False, None
+    return True, job.id
+
+
+async def _dispatch_job(
+    kind: str, updates: list[Update], job_id: int | None, received_at: float
+) -> None:
+    """Hand a job to the worker process that owns its chat."""
+    first_update = updates[0]
+    dispatched = get_worker_pool().dispatch(first_update.effective_chat.id, {
+        "kind": kind,
+        "job_id": job_id,
+        "received_at": received_at,
+        "updates": [update.to_dict() for update in updates],
+    })
+    if not dispatched:
+        if job_id is not None:
+            store = get_job_store()
+            await store.run(store.fail, job_id, "queue_full")
+        await get_telegram_sender().reply_text(
+            first_update.message, format_rejection_message("queue_full", 0)
+        )
+
+
+async def run_dispatched_job(application: Application, job: dict) -> None:
+    """Queue a job that the ingress process dispatched to this worker process."""
+    job_id = job["job_id"]
+    store = get_job_store()
+    if job_id is not None and await store.run(store.claim, job_id) is None:
+        logger.info(f"Job {job_id} is finished or held by another worker; skipping")
+        return
+
+    updates = [Update.de_json(data, application.bot) for data in job["updates"]]
+    context = CallbackContext.from_update(updates[0], application)
+    if job["kind"] == "album":
+        await _schedule_album(updates, context, job_id)
+    else:
+        await _schedule_photo(updates[0], context, job["received_at"], job_id)
+
+
+async def schedule_album(updates: list[Update], context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Queue a collected album as one job, charged per photo."""
+    is_new, job_id = await _add_job("album", updates)
+    if not is_new:
+        return
+    if get_worker_pool() is not None:
+        await _dispatch_job("album", updates, job_id, time.monotonic())
+        return
+    await _schedule_album(updates, context, job_id)
+
+
+async def _schedule_album(
+    updates: list[Update],
+    context: ContextTypes.DEFAULT_TYPE,
+    job_id: int | None,
+    resumed: bool = False,
+) -> None:
+    """Queue an album job on this process's scheduler (see _schedule_photo())."""
+    first_update = updates[0]
+    admission = get_photo_scheduler().submit(
+        first_update.effective_chat.id,
+        first_update.effective_user.id if first_update.effective_user else 0,
+        lambda: _run_job(job_id, handle_album(updates, context)),
+        cost=0 if resumed else len(updates),
+    )
+    if admission.accepted:
+        return
+    store = get_job_store()
+    if resumed:
+        await store.run(store.release, job_id)
+        return
+    if job_id is not None:
+        await store.run(store.fail, job_id, admission.reason)
+    await get_telegram_sender().reply_text(
+        first_update.message, format_rejection_message(admission.reason, admission.retry_after)
+    )
+
+
+# Buffers album photos until the whole media group has arrived
+_media_groups = MediaGroupCollector(schedule_album)
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle photo messages."""
+    """Handle photo messages by queueing them for analysis."""
     if not update.message or not update.message.photo:
         return
 
-    logger.info(f"Received photo from user {update.effective_user.id if update.effective_user else 'unknown'}")
+    if update.message.media_group_id:
+        _media_groups.add(update.message.media_group_id, update, context)
+        return
+
+    received_at = time.monotonic()
+    user_id = update.effective_user.id if update.effective_user else 0
+    logger.info(f"Received photo from user {user_id or 'unknown'}")
+
+    is_new, job_id = await _add_job("photo", [update])
+    if not is_new:
+        return
+    if get_worker_pool() is not None:
+        await _dispatch_job("photo", [update], job_id, received_at)
+        return
+
+    await _schedule_photo(update, context, received_at, job_id)
+
 
-    # Send "processing" message
-    processing_message = await update.message.reply_text(
-        "Аналізую фото... Зачекай трохи!"
+async def _schedule_photo(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    received_at: float,
+    job_id: int | None,
+    resumed: bool = False,
+) -> None:
+    """
+    Queue a photo job and post its place in line.
+
+    Args:
+        update: The update carrying the photo.
+        context: Handler context.
+        received_at: time.monotonic() when the photo was received.
+        job_id: The job's id in the job store, or None without one.
+        resumed: Whether the job was claimed from the store after a restart;
+            such jobs were already charged and are not rejected to the user.
+    """
+    user_id = update.effective_user.id if update.effective_user else 0
+    store = get_job_store()
+    sender = get_telegram_sender()
+
+    # The job may start before the processing message is sent, so hand it over as a future
+    processing_message = asyncio.get_running_loop().create_future()
+    admission = get_photo_scheduler().submit(
+        update.effective_chat.id,
+        user_id,
+        lambda: _run_job(job_id, process_photo(update, context, received_at, processing_message)),
+        cost=0 if resumed else 1,
     )
+    if not admission.accepted:
+        if resumed:
+            # Leave it for the next maintenance round (or another worker)
+            await store.run(store.release, job_id)
+            return
+        if job_id is not None:
+            await store.run(store.fail, job_id, admission.reason)
+        await sender.reply_text(
+            update.message, format_rejection_message(admission.reason, admission.retry_after)
+        )
+        return
 
     try:
-        # Get the largest photo (best quality)
-        photo = update.message.photo[-1]
+        # Reply with the user's own photo (by file_id, so nothing is uploaded);
+        # its caption shows the queue position and later the results
+        message = await sender.reply_photo(
+            update.message,
+            update.message.photo[-1].file_id,
+            caption=format_queue_message(admission.position),
+        )
+        processing_message.set_result(message)
+    except Exception as e:
+        processing_message.set_exception(e)
+        raise
+    if job_id is not None:
+        await store.run(store.set_processing_message, job_id, message.message_id)
 
-        # Download the photo
-        file = await context.bot.get_file(photo.file_id)
-        photo_bytes = await file.download_as_bytearray()
 
-        logger.info(f"Downloaded photo, size: {len(photo_bytes)} bytes")
+async def process_photo(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    received_at: float,
+    processing_message_future: asyncio.Future,
+) -> dict | None:
+    """
+    Analyze a single photo and reply with the results.
+
+    Args:
+        update: The update carrying the photo.
+        context: Handler context.
+        received_at: time.monotonic() when the photo was received.
+        processing_message_future: Resolves to the "processing" message.
+
+    Returns:
+        The analysis result, or None if the user got an error reply instead.
+    """
+    processing_message = await processing_message_future
 
-        # Analyze the image with Gemini (run in thread to not block other users)
-        analysis_result = await asyncio.to_thread(analyze_image, bytes(photo_bytes))
+    sender = get_telegram_sender()
 
-        # Format the response
-        response = format_analysis_response(analysis_result)
+    # Replace the queue notice now that it is this photo's turn
+    analyzing_text = format_queue_message(0)
+    if processing_message.caption != analyzing_text:
+        try:
+            await sender.edit_caption(processing_message, analyzing_text, coalesce=True)
+        except TelegramError as e:
+            logger.debug(f"Could not update queue notice: {e}")
 
-        # Delete the processing message
-        await processing_message.delete()
+    # Get the smallest photo that is still detailed enough for analysis
+    photo = select_photo_size(update.message.photo)
 
-        # Split response: caption (max 900 chars) + follow-up messages
-        caption, follow_ups = split_message_for_caption(
-            response, TELEGRAM_CAPTION_LIMIT, TELEGRAM_MESSAGE_LIMIT
+    # Wait until the photo fits in the memory budget
+    with metrics.span("memory_budget"):
+        reservation = await get_photo_budget().reserve(
+            photo.file_size or PHOTO_SIZE_ESTIMATE_BYTES
         )
+    download = None
+
+    try:
+        # Download the photo
+        with metrics.span("get_file"):
+            file = await context.bot.get_file(photo.file_id)
+        with metrics.span("download"):
+            download = await download_photo(file)
+        reservation.resize(download.size)
 
-        # Always send photo with caption (as much as fits)
-        await update.message.reply_photo(
-            photo=bytes(photo_bytes),
-            caption=caption
+        logger.info(
+            f"Downloaded photo, size: {download.size} bytes"
+            f"{' (spooled)' if download.spooled else ''}"
         )
 
+        # Reuse a previous analysis of the same image if we have one
+        with metrics.span("cache_lookup"):
+            analysis_result, cache_key, image_hash = await _lookup_analysis(download.data)
+        cached = analysis_result is not None
+
+        if analysis_result is None:
+            # Shrink the upload (CPU-bound, so keep it off the event loop)
+            with metrics.span("preprocess"):
+                prepared = await asyncio.to_thread(preprocess_image, download.data)
+            # Only the prepared upload is needed from here on
+            download.close()
+            reservation.resize(len(prepared.data))
+
+            # Analyze the image with Gemini (awaits a free concurrency slot first)
+            if GEMINI_CASCADE:
+                first_pass = None
+                if GEMINI_STREAMING:
+                    # Stream the fast tier; an escalation replaces it with the pro answer
+                    def first_pass(model: str):
+                        return _stream_analysis(prepared, processing_message, received_at, model)
+                analysis_result = await analyze_image_cascade(
+                    prepared.data, prepared.mime_type, first_pass
+                )
+            elif GEMINI_STREAMING:
+                analysis_result = await _stream_analysis(
+                    prepared, processing_message, received_at
+                )
+            else:
+                analysis_result = await analyze_image_async(prepared.data, prepared.mime_type)
+            del prepared
+            await _in_cache_thread(_remember_analysis, cache_key, image_hash, analysis_result)
+
+        # Nothing of the photo is held while the response is sent
+        download.close()
+        reservation.release()
+
+        _record_analysis_shape(analysis_result)
+
+        # Format the response, with product prices if enrichment is on
+        enriched = await _enrich(analysis_result)
+        with metrics.span("format"):
+            response = format_analysis_response(enriched)
+
+        # Split response: caption (max 900 visible chars) + follow-up messages
+        with metrics.span("split"):
+            caption, follow_ups = _split_response(response, TELEGRAM_CAPTION_LIMIT)
+
+        # The processing message already shows the user's photo, so the
+        # results go into its caption: one edit instead of a delete and a reply
+        with metrics.span("edit_caption"):
+            await _finish_processing_message(
+                processing_message, update.message, caption, formatted=True
+            )
+
         # Send remaining text as follow-up messages
-        for msg in follow_ups:
-            await update.message.reply_text(msg)
+        with metrics.span("follow_ups"):
+            for msg in follow_ups:
+                await sender.reply_text(update.message, msg, **message_options())
+
+        logger.info(
+            f"Sent response: {_response_length(caption)} chars caption + "
+            f"{len(follow_ups)} follow-up(s)"
+        )
+        metrics.inc("photos_total", outcome="cached" if cached else "analyzed")
+        metrics.observe("photo_seconds", time.monotonic() - received_at)
+        return analysis_result
 
-        logger.info(f"Sent response: {len(caption)} chars caption + {len(follow_ups)} follow-up(s)")
+    except TimeoutError:
+        metrics.inc("photos_total", outcome="timeout")
+        logger.warning("Gemini analysis timed out")
+        await _finish_processing_message(
+            processing_message, update.message,
+            format_error_message("Аналіз триває занадто довго. Спробуй ще раз!"),
+        )
+
+    except (CircuitOpenError, errors.APIError) as e:
+        # Retries are exhausted or the circuit breaker is failing fast
+        metrics.inc("photos_total", outcome="unavailable")
+        logger.warning(f"Gemini unavailable: {e}")
+        await _finish_processing_message(
+            processing_message, update.message, format_error_message(MODEL_UNAVAILABLE_MESSAGE)
+        )
 
     except Exception as e:
+        metrics.inc("photos_total", outcome="error")
         logger.error(f"Error processing photo: {e}", exc_info=True)
-        # Delete the processing message
-        try:
-            await processing_message.delete()
-        except Exception:
-            pass
-        # Send error message
-        await update.message.reply_text(format_error_message(str(e)))
+        await _finish_processing_message(
+            processing_message, update.message, format_error_message(str(e))
+        )
+
+    finally:
+        if download is not None:
+            download.close()
+        reservation.release()
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -123,6 +850,144 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         )
 
 
+async def start_metrics(application: Application) -> None:
+    """Register stats collectors and start the metrics endpoint and JSON dumps."""
+    metrics.register_collector("analysis_cache", get_analysis_cache().stats)
+    metrics.register_collector("parse", lambda: analysis_schema.get_parse_stats())
+    metrics.register_collector("scheduler", get_photo_scheduler().stats)
+    metrics.register_collector("circuit_breaker", breaker_stats)
+    metrics.register_collector("telegram_sender", get_telegram_sender().stats)
+    metrics.register_collector("photo_budget", get_photo_budget().stats)
+    enricher = get_tokopedia_enricher()
+    if enricher is not None:
+        metrics.register_collector("tokopedia", enricher.stats)
+
+    # In webhook mode the metrics routes live on the webhook server
+    if BOT_MODE == "polling" and METRICS_PORT:
+        server = HTTPServer(METRICS_LISTEN, METRICS_PORT)
+        add_metrics_routes(server)
+        await server.start()
+        application.bot_data["metrics_server"] = server
+
+    if METRICS_JSON_PATH:
+        application.bot_data["metrics_dump"] = asyncio.create_task(
+            dump_json_periodically(METRICS_JSON_PATH, METRICS_JSON_INTERVAL_SECONDS)
+        )
+
+
+async def stop_metrics(application: Application) -> None:
+    """Stop the metrics endpoint and write the final JSON dump."""
+    dump_task = application.bot_data.pop("metrics_dump", None)
+    if dump_task is not None:
+        dump_task.cancel()
+        await asyncio.gather(dump_task, return_exceptions=True)
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        await server.close()
+
+
+async def _resume_job(application: Application, job: Job) -> None:
+    """Queue a job claimed from the job store (after a restart or a worker crash)."""
+    updates = [Update.de_json(data, application.bot) for data in job.payload]
+    context = CallbackContext.from_update(updates[0], application)
+    logger.info(f"Resuming {job.kind} job {job.id} (attempt {job.attempts})")
+    metrics.inc("jobs_resumed_total", kind=job.kind)
+
+    # The old "processing" message would never be updated again
+    if job.processing_message_id is not None:
+        try:
+            await application.bot.delete_message(job.chat_id, job.processing_message_id)
+        except TelegramError as e:
+            logger.debug(f"Could not delete stale processing message: {e}")
+
+    if job.kind == "album":
+        await _schedule_album(updates, context, job.id, resumed=True)
+    else:
+        await _schedule_photo(updates[0], context, time.monotonic(), job.id, resumed=True)
+
+
+async def maintain_jobs(application: Application) -> None:
+    """Renew this worker's job leases, take over abandoned jobs and purge old ones."""
+    store = get_job_store()
+    scheduler = get_photo_scheduler()
+    while True:
+        try:
+            await store.run(store.renew)
+            free = scheduler.max_queue - scheduler.stats()["queue_depth"]
+            limit = max(0, min(free, scheduler.workers))
+            for job in await store.run(store.claim_abandoned, limit):
+                try:
+                    await _resume_job(application, job)
+                except Exception as e:
+                    logger.error(f"Could not resume job {job.id}: {e}", exc_info=True)
+                    await store.run(store.fail, job.id, str(e))
+            await store.run(store.purge)
+            await store.run(store.stats)
+        except sqlite3.Error as e:
+            logger.warning(f"Job store maintenance failed: {e}")
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+
+
+async def start_job_maintenance(application: Application) -> None:
+    """With a job store, resume the jobs it holds and keep this worker's leases."""
+    store = get_job_store()
+    if store is None:
+        return
+    logger.info(f"Job store at {store.path}: {await store.run(store.stats)}")
+    # Refreshed by maintain_jobs(); the database is not read on the event loop
+    metrics.register_collector("jobs", lambda: store.counts)
+    application.bot_data["job_maintenance"] = asyncio.create_task(maintain_jobs(application))
+
+
+async def start_warm_up(application: Application) -> None:
+    """Import the analysis dependencies in a thread while the bot starts serving."""
+    application.bot_data["warm_up"] = asyncio.create_task(
+        asyncio.to_thread(warm_up, *WARM_UP_MODULES)
+    )
+
+
+async def start_background_tasks(application: Application) -> None:
+    """Start metrics, then the worker processes or the local job maintenance."""
+    await start_metrics(application)
+
+    pool = get_worker_pool()
+    if pool is None:
+        await start_warm_up(application)
+        await start_job_maintenance(application)
+        return
+    # Workers claim, resume and renew jobs themselves
+    pool.start()
+    metrics.register_collector("worker_pool", pool.stats)
+
+
+async def drain_scheduler(application: Application) -> None:
+    """Let queued photo analyses finish before the application shuts down."""
+    maintenance = application.bot_data.pop("job_maintenance", None)
+    if maintenance is not None:
+        maintenance.cancel()
+        await asyncio.gather(maintenance, return_exceptions=True)
+
+    pool = get_worker_pool()
+    if pool is not None:
+        logger.info(f"Stopping worker processes ({pool.stats()['queued']} jobs queued)")
+        await pool.stop()
+
+    logger.info(f"Draining photo queue ({get_photo_scheduler().stats()['queue_depth']} queued)")
+    await get_photo_scheduler().close()
+
+    store = get_job_store()
+    if store is not None:
+        released = await store.run(store.release_all)
+        if released:
+            logger.info(f"Released {released} unfinished job(s) for the next start")
+        await store.close()
+
+    enricher = get_tokopedia_enricher()
+    if enricher is not None:
+        await enricher.close()
+    await close_download_client()
+
+
 def main() -> None:
     """Start the bot."""
     # Validate configuration
@@ -130,8 +995,20 @@ def main() -> None:
 
     logger.info("Starting Tokopedia Fashion Bot...")
 
-    # Create the Application
-    application = Application.builder().token(TELEGRAM_BOT_API).build()
+    # Render the analysis prompt now rather than on the first photo
+    get_analysis_version()
+
+    # Create the Application (updates are handled concurrently; Gemini calls
+    # are bounded separately by GEMINI_MAX_CONCURRENCY)
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_API)
+        .concurrent_updates(True)
+        .post_init(start_background_tasks)
+        .post_stop(drain_scheduler)
+        .post_shutdown(stop_metrics)
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -141,6 +1018,10 @@ def main() -> None:
     # Add error handler
     application.add_error_handler(error_handler)
 
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(application))
+        return
+
     logger.info("Bot is ready! Starting polling...")
 
     # Run the bot until interrupted
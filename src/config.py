@@ -1,6 +1,5 @@
 """Configuration module for Tokopedia Fashion Bot."""
 
-import json
 import os
 from pathlib import Path
 
@@ -18,21 +17,164 @@ BALI_CITY_IDS = "258,259,260,261,262,263,264,265,476,266"
 TOKOPEDIA_BASE_URL = f"https://www.tokopedia.com/search?fcity={BALI_CITY_IDS}&q="
 
 # Gemini model to use (best accuracy for fashion analysis)
-GEMINI_MODEL = "gemini-2.5-pro"
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-pro")
 
-# Load reference data
-_reference_data_path = Path(__file__).parent.parent / "beach-party-tokopedia-looks.json"
+# Model cascade: analyze with the fast model first and escalate to GEMINI_MODEL
+# only when the fast result scores below CASCADE_MIN_SCORE (0-1)
+GEMINI_CASCADE = os.getenv("GEMINI_CASCADE", "false").lower() == "true"
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash")
+CASCADE_MIN_SCORE = float(os.getenv("CASCADE_MIN_SCORE", "0.7"))
 
+# Cheaper model used to fix responses that fail JSON parsing (text only, no image)
+GEMINI_REPAIR_MODEL = os.getenv("GEMINI_REPAIR_MODEL", "gemini-2.5-flash")
 
-def load_reference_data() -> dict:
-    """Load reference data from JSON file."""
-    if _reference_data_path.exists():
-        with open(_reference_data_path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+# Limits for concurrent Gemini calls
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "90"))
 
+# Resilience of model calls: each attempt is capped at GEMINI_ATTEMPT_TIMEOUT_SECONDS
+# (GEMINI_TIMEOUT_SECONDS bounds the whole request), transient errors are retried
+# with exponential backoff, and optional hedged requests go out after the p95 latency
+GEMINI_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("GEMINI_ATTEMPT_TIMEOUT_SECONDS", "60"))
+GEMINI_MAX_ATTEMPTS = int(os.getenv("GEMINI_MAX_ATTEMPTS", "3"))
+GEMINI_RETRY_BASE_SECONDS = float(os.getenv("GEMINI_RETRY_BASE_SECONDS", "1.0"))
+GEMINI_RETRY_MAX_SECONDS = float(os.getenv("GEMINI_RETRY_MAX_SECONDS", "8.0"))
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() == "true"
+GEMINI_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("GEMINI_HEDGE_MIN_DELAY_SECONDS", "5.0"))
 
-REFERENCE_DATA = load_reference_data()
+# Circuit breaker: stop calling the model for BREAKER_COOLDOWN_SECONDS once
+# BREAKER_FAILURE_RATE of the last BREAKER_WINDOW calls (at least BREAKER_MIN_CALLS) failed
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "10"))
+BREAKER_COOLDOWN_SECONDS = float(os.getenv("BREAKER_COOLDOWN_SECONDS", "30"))
+
+# Stream the analysis and show items in the processing message as they arrive
+# (opt-in: it changes what users see while a photo is analyzed)
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "false").lower() == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.5"))
+
+# Photos of one album arrive as separate updates; wait this long for the rest
+MEDIA_GROUP_WINDOW_SECONDS = float(os.getenv("MEDIA_GROUP_WINDOW_SECONDS", "1.0"))
+
+# Register the static prompt as a Gemini cached context so requests only send the image
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "false").lower() == "true"
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL_SECONDS", "3600"))
+
+# Image preprocessing before upload to Gemini (Gemini bills images per
+# 768x768 tile, so capping the longest edge keeps input tokens low)
+PHOTO_MIN_EDGE = int(os.getenv("PHOTO_MIN_EDGE", "768"))
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "768"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+
+# Memory bound on photo ingestion: downloads wait while the photos being
+# processed add up to more than the budget (one larger photo still runs on
+# its own), and downloads above the spool threshold are kept in temporary
+# files instead of RAM. Photos of unknown size are counted at the estimate.
+PHOTO_MEMORY_BUDGET_BYTES = int(os.getenv("PHOTO_MEMORY_BUDGET_BYTES", str(64 * 1024 * 1024)))
+PHOTO_SPOOL_THRESHOLD_BYTES = int(os.getenv("PHOTO_SPOOL_THRESHOLD_BYTES", str(1024 * 1024)))
+PHOTO_SIZE_ESTIMATE_BYTES = int(os.getenv("PHOTO_SIZE_ESTIMATE_BYTES", str(512 * 1024)))
+
+# Analysis result cache (in-memory LRU + optional on-disk tier)
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1024"))
+ANALYSIS_CACHE_TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400"))
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR") or None
+
+# Near-duplicate photo lookup (perceptual hash + Hamming distance index)
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "6"))
+# Without ANALYSIS_CACHE_DIR the index is also capped at ANALYSIS_CACHE_MAX_ENTRIES
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv("NEAR_DUPLICATE_MAX_ENTRIES", "500000"))
+
+# Response rendering: "plain" (item name followed by the bare Tokopedia URL,
+# the original format) or "html" (one linked line per item, parse_mode HTML)
+RESPONSE_FORMAT = os.getenv("RESPONSE_FORMAT", "plain").lower()
+
+# Outbound Bot API pacing: Telegram allows about 30 messages per second per
+# bot and about one per second per chat (short bursts are tolerated)
+TELEGRAM_GLOBAL_RATE_PER_SECOND = float(os.getenv("TELEGRAM_GLOBAL_RATE_PER_SECOND", "30"))
+TELEGRAM_CHAT_RATE_PER_SECOND = float(os.getenv("TELEGRAM_CHAT_RATE_PER_SECOND", "1"))
+TELEGRAM_CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+# Photo analysis scheduling: workers, queue bound (load shedding beyond it)
+# and a per-user token bucket (photos per minute, with bursts up to USER_BURST)
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", str(GEMINI_MAX_CONCURRENCY)))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "6"))
+USER_BURST = int(os.getenv("USER_BURST", "5"))
+
+# Durable jobs: photo jobs are recorded in this SQLite file (unset disables) so
+# they survive restarts and redelivered updates are deduplicated. Workers renew
+# their claims every JOB_LEASE_SECONDS / 3; a job is retried at most
+# JOB_MAX_ATTEMPTS times and finished jobs are kept for JOB_RETENTION_SECONDS.
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH") or None
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", "86400"))
+
+# Worker processes: with WORKER_PROCESSES > 0 this process only receives updates
+# and dispatches photo jobs to that many worker processes, sharded by chat_id
+# (each runs its own scheduler with SCHEDULER_WORKERS slots). On shutdown
+# workers get WORKER_SHUTDOWN_SECONDS to finish their queues.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+WORKER_SHUTDOWN_SECONDS = float(os.getenv("WORKER_SHUTDOWN_SECONDS", "120"))
+
+# Product enrichment: with TOKOPEDIA_SEARCH_API_URL set, the top
+# TOKOPEDIA_ENRICH_RESULTS products of every item's query (filtered to
+# BALI_CITY_IDS) are fetched and shown with their price. Results are cached
+# per query for TOKOPEDIA_CACHE_TTL_SECONDS; at most TOKOPEDIA_PER_HOST_LIMIT
+# requests run against one host at a time, and an item whose search takes
+# longer than TOKOPEDIA_TIMEOUT_SECONDS is shown without products.
+TOKOPEDIA_SEARCH_API_URL = os.getenv("TOKOPEDIA_SEARCH_API_URL") or None
+TOKOPEDIA_ENRICH_RESULTS = int(os.getenv("TOKOPEDIA_ENRICH_RESULTS", "1"))
+TOKOPEDIA_TIMEOUT_SECONDS = float(os.getenv("TOKOPEDIA_TIMEOUT_SECONDS", "3"))
+TOKOPEDIA_PER_HOST_LIMIT = int(os.getenv("TOKOPEDIA_PER_HOST_LIMIT", "8"))
+TOKOPEDIA_CACHE_MAX_ENTRIES = int(os.getenv("TOKOPEDIA_CACHE_MAX_ENTRIES", "4096"))
+TOKOPEDIA_CACHE_TTL_SECONDS = float(os.getenv("TOKOPEDIA_CACHE_TTL_SECONDS", "3600"))
+
+# Fuzzy matching against proven reference queries (scores are in [0, 1])
+REFERENCE_MATCH_MIN_SCORE = float(os.getenv("REFERENCE_MATCH_MIN_SCORE", "0.5"))
+REFERENCE_SNAP_QUERIES = os.getenv("REFERENCE_SNAP_QUERIES", "false").lower() == "true"
+REFERENCE_SNAP_MIN_SCORE = float(os.getenv("REFERENCE_SNAP_MIN_SCORE", "0.75"))
+
+# How updates reach the bot: "polling" (long polling) or "webhook" (embedded HTTP server)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+# Webhook mode; WEBHOOK_URL is the public base URL to register with Telegram
+# (leave empty to serve without registering, e.g. for local testing)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+
+# Metrics: /metrics and /metrics.json are served on the webhook server, or in
+# polling mode on METRICS_LISTEN:METRICS_PORT (0 disables). METRICS_JSON_PATH
+# optionally receives a JSON snapshot every METRICS_JSON_INTERVAL_SECONDS.
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9464"))
+METRICS_JSON_PATH = os.getenv("METRICS_JSON_PATH") or None
+METRICS_JSON_INTERVAL_SECONDS = float(os.getenv("METRICS_JSON_INTERVAL_SECONDS", "60"))
+
+# Reference data: the proven looks and queries. The parts the bot uses (prompt
+# examples, query index, search URLs) are compiled into REFERENCE_ARTIFACT_PATH
+# and recompiled whenever the JSON changes (see reference_artifact).
+REFERENCE_DATA_PATH = Path(
+    os.getenv("REFERENCE_DATA_PATH")
+    or Path(__file__).parent.parent / "beach-party-tokopedia-looks.json"
+)
+REFERENCE_ARTIFACT_PATH = Path(
+    os.getenv("REFERENCE_ARTIFACT_PATH")
+    or Path(__file__).parent.parent / ".cache" / "reference-artifact.pickle"
+)
+
+
+def reference_data_mtime() -> int | None:
+    """Return the reference JSON's modification time in ns, or None if missing."""
+    try:
+        return REFERENCE_DATA_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
 
 
 def validate_config() -> bool:
@@ -41,4 +183,10 @@ def validate_config() -> bool:
         raise ValueError("GEMINI_API_KEY is not set in .env file")
     if not TELEGRAM_BOT_API or TELEGRAM_BOT_API == "YOUR_TELEGRAM_BOT_TOKEN_HERE":
         raise ValueError("TELEGRAM_BOT_API is not set in .env file")
+    if BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"BOT_MODE must be 'polling' or 'webhook', got '{BOT_MODE}'")
+    if RESPONSE_FORMAT not in ("html", "plain"):
+        raise ValueError(f"RESPONSE_FORMAT must be 'html' or 'plain', got '{RESPONSE_FORMAT}'")
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET is required when BOT_MODE is 'webhook'")
     return True
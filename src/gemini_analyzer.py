@@ -1,20 +1,64 @@
 """Gemini Pro image analysis module for clothing identification."""
 
-import base64
-import json
-import logging
-from typing import Any
-
-from google import genai
-from google.genai import types
+# Annotations name google.genai types, which are only imported on first use
+from __future__ import annotations
 
-from .config import GEMINI_API_KEY, GEMINI_MODEL, REFERENCE_DATA
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections.abc import AsyncIterator
+from typing import TYPE_CHECKING, Any
+
+from .config import (
+    GEMINI_API_KEY,
+    GEMINI_CONTEXT_CACHE,
+    GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_MODEL,
+    GEMINI_REPAIR_MODEL,
+    GEMINI_TIMEOUT_SECONDS,
+)
+from .json_stream import AnalysisStreamParser, StreamEvent
+from .lazy_import import lazy_import
+from .metrics import metrics
+from .reference_artifact import get_reference_artifact
+from .resilience import get_model_caller, is_retryable
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+# google.genai takes about a second to import and pydantic (via the schema)
+# adds more, so both are loaded on the first analysis rather than at startup
+genai = lazy_import("google.genai")
+errors = lazy_import("google.genai.errors")
+types = lazy_import("google.genai.types")
+analysis_schema = lazy_import(f"{__package__}.analysis_schema")
 
 logger = logging.getLogger(__name__)
 
-# Initialize the client globally
+# Initialize the client globally (its sync and async halves each keep one connection pool)
 _client = None
 
+# Global cap on in-flight Gemini calls, shared by all async callers
+_semaphore = None
+
+# Rendered prompt as (reference artifact digest, prompt, version); rebuilt when the JSON changes
+_compiled_prompt = None
+
+# Gemini cached context holding the prompt as (version, cache name, expires at)
+_context_cache = None
+_context_cache_lock = None
+_context_cache_retry_at = 0.0
+
+# Back off this long after the API refuses to create a cached context
+CONTEXT_CACHE_RETRY_SECONDS = 300
+
+# Event loop that runs the blocking analyze_image() calls, in a daemon thread
+_sync_loop = None
+_sync_loop_lock = threading.Lock()
+
 
 def _get_client() -> genai.Client:
     """Get or create the Gemini client."""
@@ -24,25 +68,23 @@ def _get_client() -> genai.Client:
     return _client
 
 
-def _build_reference_examples() -> str:
-    """Build reference examples from loaded JSON data."""
-    examples = []
-
-    # Add examples from male/unisex looks
-    for look in REFERENCE_DATA.get("looks", {}).get("male_unisex", [])[:3]:
-        for search in look.get("searches", [])[:1]:
-            examples.append(f"- {look['name']} -> \"{search['query']}\"")
-
-    # Add examples from female looks
-    for look in REFERENCE_DATA.get("looks", {}).get("female", [])[:3]:
-        for search in look.get("searches", [])[:1]:
-            examples.append(f"- {look['name']} -> \"{search['query']}\"")
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """Get or start the event loop that serves analyze_image()."""
+    global _sync_loop
+    with _sync_loop_lock:
+        if _sync_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="gemini-sync", daemon=True).start()
+            _sync_loop = loop
+    return _sync_loop
 
-    # Add accessory examples
-    for acc in REFERENCE_DATA.get("looks", {}).get("accessories", [])[:5]:
-        examples.append(f"- {acc['name_ua']} -> \"{acc['query']}\"")
 
-    return "\n".join(examples)
+def _get_semaphore() -> asyncio.Semaphore:
+    """Get or create the semaphore bounding concurrent Gemini calls."""
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    return _semaphore
 
 
 ANALYSIS_PROMPT = """Ти - експерт з моди для БОЖЕВІЛЬНОЇ ПЛЯЖНОЇ ВЕЧІРКИ (Beach Trash Party, Zatoka vibes, Verka Serduchka style).
@@ -80,84 +122,509 @@ ANALYSIS_PROMPT = """Ти - експерт з моди для БОЖЕВІЛЬН
 Вітання має бути коротке (до 10 слів), веселе, в стилі пляжної вечірки.
 Приклади стилю: "Ого, який лук!", "Вау, це щось!", "О, бачу стиль!", "Ех, красунчик!"
 
-Поверни ТІЛЬКИ валідний JSON без markdown форматування:
-{{
-  "greeting_ua": "Твоє унікальне смішне вітання українською",
-  "people": [
-    {{
-      "description_ua": "Опис людини українською",
-      "items": [
-        {{"name_ua": "Назва українською", "search_query_id": "Indonesian query with color+pattern+style+murah", "category": "top/bottom/accessory/footwear/headwear"}}
-      ]
-    }}
-  ]
-}}
+Поверни ТІЛЬКИ JSON за заданою схемою відповіді, без markdown форматування.
+"""
+
+REPAIR_PROMPT = """Цей JSON-відповідь пошкоджена (обрізана або з синтаксичними помилками).
+Виправ її за заданою схемою, НЕ змінюючи змісту і НЕ вигадуючи нових предметів.
+Поверни ТІЛЬКИ валідний JSON.
+
+{fragment}
 """
 
 
-def analyze_image(image_bytes: bytes) -> dict[str, Any]:
+ALBUM_PROMPT = """Це альбом з {count} фото, пронумерованих від 1 до {count} у порядку надсилання.
+Проаналізуй КОЖНЕ фото. Для кожної людини вкажи "photo_index" - номер фото (1-{count}), на якому вона є.
+Одне спільне вітання для всього альбому.
+"""
+
+
+def _get_compiled_prompt() -> tuple[str, str]:
     """
-    Analyze an image to identify clothing items.
+    Return the rendered analysis prompt and its version.
 
-    Args:
-        image_bytes: The image data as bytes.
+    The prompt is rendered once and reused until the reference data changes
+    (see reference_artifact).
 
     Returns:
-        Dictionary containing identified clothing items and crazy ideas.
+        Tuple of (prompt text, short version digest of model and prompt).
     """
-    client = _get_client()
+    global _compiled_prompt
+    artifact = get_reference_artifact()
+    if _compiled_prompt is None or _compiled_prompt[0] != artifact.source_digest:
+        prompt = ANALYSIS_PROMPT.format(examples=artifact.prompt_examples)
+        digest = hashlib.sha256(f"{GEMINI_MODEL}\n{prompt}".encode("utf-8"))
+        _compiled_prompt = (artifact.source_digest, prompt, digest.hexdigest()[:16])
+        logger.info(f"Compiled analysis prompt version {_compiled_prompt[2]}")
+    return _compiled_prompt[1], _compiled_prompt[2]
 
-    # Build prompt with reference examples
-    examples = _build_reference_examples()
-    prompt = ANALYSIS_PROMPT.format(examples=examples)
 
-    # Convert image bytes to base64
-    image_base64 = base64.b64encode(image_bytes).decode("utf-8")
+def get_analysis_version() -> str:
+    """
+    Identify the prompt/model combination used for analysis.
 
-    # Create the content with image
-    contents = [
-        types.Content(
-            role="user",
-            parts=[
-                types.Part.from_text(text=prompt),
-                types.Part.from_bytes(
-                    data=image_bytes,
-                    mime_type="image/jpeg"
+    Cached results are keyed by this value so that changing the prompt,
+    the reference examples or the model invalidates them.
+
+    Returns:
+        Short hex digest of the model name and the rendered prompt.
+    """
+    return _get_compiled_prompt()[1]
+
+
+async def _get_cached_context(client: genai.Client) -> str | None:
+    """
+    Get the name of a Gemini cached context holding the analysis prompt.
+
+    The context is created on first use, recreated when the prompt changes
+    or the cache is about to expire, and skipped for a while if the API
+    refuses to create it (e.g. the prompt is below the minimum cacheable size).
+
+    Args:
+        client: The Gemini client.
+
+    Returns:
+        The cached content name, or None to send the prompt inline.
+    """
+    global _context_cache, _context_cache_lock, _context_cache_retry_at
+
+    if not GEMINI_CONTEXT_CACHE:
+        return None
+
+    prompt, version = _get_compiled_prompt()
+    if _context_cache_lock is None:
+        _context_cache_lock = asyncio.Lock()
+
+    async with _context_cache_lock:
+        now = time.time()
+        if (
+            _context_cache is not None
+            and _context_cache[0] == version
+            and _context_cache[2] - now > 60
+        ):
+            return _context_cache[1]
+        if now < _context_cache_retry_at:
+            return None
+
+        try:
+            cached = await client.aio.caches.create(
+                model=GEMINI_MODEL,
+                config=types.CreateCachedContentConfig(
+                    display_name=f"tokopedia-analysis-prompt-{version}",
+                    contents=[
+                        types.Content(role="user", parts=[types.Part.from_text(text=prompt)])
+                    ],
+                    ttl=f"{GEMINI_CONTEXT_CACHE_TTL_SECONDS}s",
                 ),
-            ]
+            )
+        except Exception as e:
+            logger.warning(f"Could not create Gemini cached context, sending prompt inline: {e}")
+            _context_cache_retry_at = now + CONTEXT_CACHE_RETRY_SECONDS
+            return None
+
+        stale = _context_cache
+        _context_cache = (version, cached.name, now + GEMINI_CONTEXT_CACHE_TTL_SECONDS)
+        logger.info(f"Created Gemini cached context {cached.name} for prompt version {version}")
+
+    if stale is not None and stale[0] != version:
+        try:
+            await client.aio.caches.delete(name=stale[1])
+        except Exception as e:
+            logger.warning(f"Could not delete stale cached context {stale[1]}: {e}")
+
+    return _context_cache[1]
+
+
+def _build_contents(
+    image_bytes: bytes,
+    mime_type: str,
+    include_prompt: bool = True,
+) -> list[types.Content]:
+    """Build the request contents: the analysis prompt (unless cached) followed by the image."""
+    parts = []
+    if include_prompt:
+        prompt, _ = _get_compiled_prompt()
+        parts.append(types.Part.from_text(text=prompt))
+
+    # Create the content with image
+    parts.append(
+        types.Part.from_bytes(
+            data=image_bytes,
+            mime_type=mime_type
         )
-    ]
+    )
+    return [types.Content(role="user", parts=parts)]
+
+
+def _build_album_contents(
+    images: list[tuple[bytes, str]],
+    include_prompt: bool = True,
+) -> list[types.Content]:
+    """Build the request contents for a multi-image album: prompt, album note, numbered images."""
+    parts = []
+    if include_prompt:
+        prompt, _ = _get_compiled_prompt()
+        parts.append(types.Part.from_text(text=prompt))
+    parts.append(types.Part.from_text(text=ALBUM_PROMPT.format(count=len(images))))
+
+    for number, (image_bytes, mime_type) in enumerate(images, start=1):
+        parts.append(types.Part.from_text(text=f"Фото {number}:"))
+        parts.append(types.Part.from_bytes(data=image_bytes, mime_type=mime_type))
+    return [types.Content(role="user", parts=parts)]
+
+
+def _request_config(
+    cached_context: str | None,
+    schema: type[BaseModel] | None = None,
+) -> types.GenerateContentConfig:
+    """Build the generation config: structured JSON output, plus the cached prompt if any."""
+    return types.GenerateContentConfig(
+        cached_content=cached_context,
+        response_mime_type="application/json",
+        response_schema=schema or analysis_schema.AnalysisResult,
+    )
 
-    logger.info(f"Analyzing image with Gemini model: {GEMINI_MODEL}")
 
-    response = client.models.generate_content(
-        model=GEMINI_MODEL,
-        contents=contents,
+def _log_usage(response: types.GenerateContentResponse, image_size: int) -> None:
+    """Log upload size and token usage so preprocessing savings are measurable."""
+    usage = response.usage_metadata
+    if usage is None:
+        return
+    logger.info(
+        f"Gemini usage: {image_size} image bytes, "
+        f"{usage.prompt_token_count} prompt tokens, "
+        f"{usage.candidates_token_count} output tokens, "
+        f"{usage.total_token_count} total tokens"
     )
 
-    # Parse the response
-    response_text = response.text.strip()
 
-    # Remove markdown code blocks if present
-    if response_text.startswith("```json"):
-        response_text = response_text[7:]
-    if response_text.startswith("```"):
-        response_text = response_text[3:]
-    if response_text.endswith("```"):
-        response_text = response_text[:-3]
-    response_text = response_text.strip()
+def _error_result(response_text: str, reason: str) -> dict[str, Any]:
+    """Build the fallback structure returned when a response cannot be parsed."""
+    return {
+        "people": [],
+        "crazy_ideas": [],
+        "error": f"Failed to parse response: {reason}",
+        "raw_response": response_text
+    }
+
+
+def _parse_response(
+    response_text: str,
+    schema: type[BaseModel] | None = None,
+) -> dict[str, Any] | None:
+    """Validate the model's JSON answer, repairing it locally if needed."""
+    with metrics.span("parse"):
+        result = analysis_schema.parse_analysis(
+            response_text, schema or analysis_schema.AnalysisResult
+        )
+    if result is not None:
+        logger.info(f"Successfully parsed response with {len(result['people'])} people detected")
+    return result
 
-    try:
-        result = json.loads(response_text)
-        logger.info(f"Successfully parsed response with {len(result.get('people', []))} people detected")
+
+def _repair_config(schema: type[BaseModel]) -> types.GenerateContentConfig:
+    """Build the generation config for a text-only JSON repair request."""
+    return types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_schema=schema,
+    )
+
+
+async def _parse_or_repair(
+    client: genai.Client,
+    response_text: str,
+    schema: type[BaseModel] | None = None,
+) -> dict[str, Any]:
+    """
+    Parse a response; if it is beyond local repair, ask the model to fix the text.
+
+    The retry sends only the broken JSON text (no image or analysis prompt)
+    to the cheaper repair model.
+    """
+    schema = schema or analysis_schema.AnalysisResult
+    result = _parse_response(response_text, schema)
+    if result is not None:
         return result
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Gemini response as JSON: {e}")
+
+    logger.warning(f"Asking {GEMINI_REPAIR_MODEL} to repair unparseable response")
+    metrics.inc("repair_requests_total")
+    try:
+        with metrics.span("repair_call"):
+            repaired = await client.aio.models.generate_content(
+                model=GEMINI_REPAIR_MODEL,
+                contents=REPAIR_PROMPT.format(fragment=response_text),
+                config=_repair_config(schema),
+            )
+        result = _parse_response(repaired.text or "", schema)
+    except errors.APIError as e:
+        logger.error(f"Repair request failed: {e}")
+
+    if result is None:
+        analysis_schema.record_unrecoverable()
+        logger.error(f"Failed to parse Gemini response ({analysis_schema.get_parse_stats()})")
         logger.error(f"Raw response: {response_text}")
-        # Return a fallback structure
-        return {
-            "people": [],
-            "crazy_ideas": [],
-            "error": f"Failed to parse response: {str(e)}",
-            "raw_response": response_text
-        }
+        return _error_result(response_text, "invalid JSON")
+    return result
+
+
+async def analyze_image_async(
+    image_bytes: bytes,
+    mime_type: str = "image/jpeg",
+    timeout: float | None = GEMINI_TIMEOUT_SECONDS,
+    client: genai.Client | None = None,
+    model: str = GEMINI_MODEL,
+) -> dict[str, Any]:
+    """
+    Analyze an image to identify clothing items without blocking the event loop.
+
+    At most GEMINI_MAX_CONCURRENCY calls run at once; further callers wait
+    for a slot. Cancelling the calling task aborts the in-flight request.
+    With GEMINI_CONTEXT_CACHE enabled, the prompt is served from a Gemini
+    cached context and only the image is sent.
+
+    Args:
+        image_bytes: The image data as bytes.
+        mime_type: MIME type of the image data.
+        timeout: Deadline in seconds for the model, including retries, once
+            a slot is acquired, or None to wait indefinitely.
+        client: Gemini client to use instead of the shared one.
+        model: Gemini model to ask (the cached context only applies to
+            GEMINI_MODEL).
+
+    Returns:
+        Dictionary containing identified clothing items and crazy ideas.
+
+    Raises:
+        TimeoutError: If the model does not answer within the timeout.
+    """
+    global _context_cache
+
+    client = client or _get_client()
+    cached_context = await _get_cached_context(client) if model == GEMINI_MODEL else None
+
+    async with _get_semaphore():
+        logger.info(f"Analyzing image with Gemini model: {model}")
+        with metrics.span("model_call"):
+            try:
+                response = await get_model_caller(model).call(
+                    lambda: client.aio.models.generate_content(
+                        model=model,
+                        contents=_build_contents(
+                            image_bytes, mime_type, include_prompt=cached_context is None
+                        ),
+                        config=_request_config(cached_context),
+                    ),
+                    timeout,
+                )
+            except errors.ClientError as e:
+                if cached_context is None or e.code not in (400, 403, 404):
+                    raise
+                # The cached context may have expired or been deleted server-side
+                logger.warning(f"Request with cached context failed, retrying inline: {e}")
+                _context_cache = None
+                response = await get_model_caller(model).call(
+                    lambda: client.aio.models.generate_content(
+                        model=model,
+                        contents=_build_contents(image_bytes, mime_type),
+                        config=_request_config(None),
+                    ),
+                    timeout,
+                )
+
+    _log_usage(response, len(image_bytes))
+    return await _parse_or_repair(client, response.text or "")
+
+
+def _split_album_result(result: dict[str, Any], count: int) -> list[dict[str, Any]]:
+    """
+    Map an album analysis back to its source photos.
+
+    People without a valid photo_index are attributed to the first photo.
+
+    Args:
+        result: Parsed analysis of the whole album.
+        count: Number of photos in the album.
+
+    Returns:
+        One analysis dict per photo, in album order.
+    """
+    if "error" in result:
+        return [result] * count
+
+    per_photo = [
+        {"greeting_ua": result.get("greeting_ua"), "people": []} for _ in range(count)
+    ]
+    for person in result.get("people", []):
+        photo_index = person.pop("photo_index", 1)
+        if not isinstance(photo_index, int) or not 1 <= photo_index <= count:
+            photo_index = 1
+        per_photo[photo_index - 1]["people"].append(person)
+    return per_photo
+
+
+async def analyze_images_async(
+    images: list[tuple[bytes, str]],
+    timeout: float | None = GEMINI_TIMEOUT_SECONDS,
+    client: genai.Client | None = None,
+) -> list[dict[str, Any]]:
+    """
+    Analyze several images (e.g. a Telegram album) in a single model call.
+
+    The prompt is sent once for the whole album, and the model tags each
+    person with the number of the photo they appear in.
+
+    Args:
+        images: (image bytes, MIME type) pairs in album order.
+        timeout: Deadline in seconds for the model, including retries, once
+            a slot is acquired, or None to wait indefinitely.
+        client: Gemini client to use instead of the shared one.
+
+    Returns:
+        One analysis dict per image, in the same order as images.
+
+    Raises:
+        TimeoutError: If the model does not answer within the timeout.
+    """
+    client = client or _get_client()
+    cached_context = await _get_cached_context(client)
+
+    async with _get_semaphore():
+        logger.info(f"Analyzing album of {len(images)} images with Gemini model: {GEMINI_MODEL}")
+        with metrics.span("album_model_call"):
+            response = await get_model_caller(GEMINI_MODEL).call(
+                lambda: client.aio.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=_build_album_contents(
+                        images, include_prompt=cached_context is None
+                    ),
+                    config=_request_config(cached_context, analysis_schema.AlbumAnalysisResult),
+                ),
+                timeout,
+            )
+
+    _log_usage(response, sum(len(image_bytes) for image_bytes, _ in images))
+    result = await _parse_or_repair(
+        client, response.text or "", analysis_schema.AlbumAnalysisResult
+    )
+    return _split_album_result(result, len(images))
+
+
+async def analyze_image_stream(
+    image_bytes: bytes,
+    mime_type: str = "image/jpeg",
+    timeout: float | None = GEMINI_TIMEOUT_SECONDS,
+    client: genai.Client | None = None,
+    model: str = GEMINI_MODEL,
+) -> AsyncIterator[StreamEvent]:
+    """
+    Analyze an image, yielding the greeting, people and items as they stream in.
+
+    Uses the same concurrency limit and prompt caching as analyze_image_async().
+    The final event has kind "result" and carries the fully parsed analysis.
+
+    Args:
+        image_bytes: The image data as bytes.
+        mime_type: MIME type of the image data.
+        timeout: Seconds allowed for the whole stream once a slot is acquired,
+            or None to wait indefinitely.
+        client: Gemini client to use instead of the shared one.
+        model: Gemini model to ask.
+
+    Yields:
+        StreamEvent objects in document order.
+
+    Raises:
+        TimeoutError: If the stream does not finish within the timeout.
+    """
+    client = client or _get_client()
+    cached_context = await _get_cached_context(client) if model == GEMINI_MODEL else None
+    parser = AnalysisStreamParser()
+    chunks = []
+    last_response = None
+
+    async with _get_semaphore():
+        logger.info(f"Streaming analysis with Gemini model: {model}")
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = None if timeout is None else started + timeout
+
+        # Streams are not retried or hedged (events may already be shown), but
+        # they count towards the circuit breaker
+        breaker = get_model_caller(model).breaker
+        breaker.check()
+        healthy = None
+        stream = None
+        try:
+            stream = await asyncio.wait_for(
+                client.aio.models.generate_content_stream(
+                    model=model,
+                    contents=_build_contents(
+                        image_bytes, mime_type, include_prompt=cached_context is None
+                    ),
+                    config=_request_config(cached_context),
+                ),
+                timeout,
+            )
+            while True:
+                remaining = None if deadline is None else max(deadline - loop.time(), 0)
+                try:
+                    last_response = await asyncio.wait_for(anext(stream), remaining)
+                except StopAsyncIteration:
+                    break
+
+                if not chunks:
+                    metrics.observe(
+                        "stage_seconds", loop.time() - started, stage="model_first_chunk"
+                    )
+                chunk = last_response.text or ""
+                chunks.append(chunk)
+                for event in parser.feed(chunk):
+                    yield event
+            healthy = True
+        except Exception as e:
+            healthy = not is_retryable(e)
+            raise
+        finally:
+            if healthy is None:
+                breaker.abandon()
+            else:
+                breaker.record(healthy)
+            if stream is not None:
+                await stream.aclose()
+            # Includes time the consumer spent between chunks (progress edits)
+            metrics.observe("stage_seconds", loop.time() - started, stage="model_stream")
+
+    if last_response is not None:
+        _log_usage(last_response, len(image_bytes))
+    yield StreamEvent("result", None, await _parse_or_repair(client, "".join(chunks)))
+
+
+def analyze_image(
+    image_bytes: bytes,
+    mime_type: str = "image/jpeg",
+    client: genai.Client | None = None,
+    model: str = GEMINI_MODEL,
+) -> dict[str, Any]:
+    """
+    Analyze an image to identify clothing items.
+
+    Blocking wrapper around analyze_image_async() for scripts and other
+    synchronous callers, so they get the same retries, circuit breaker,
+    hedging and repair handling. Every call runs on one long-lived event
+    loop in a background thread: the shared client's connection pool, the
+    concurrency semaphore and the context cache lock belong to the loop that
+    first used them, so a process should use either this or the async API.
+
+    Args:
+        image_bytes: The image data as bytes.
+        mime_type: MIME type of the image data.
+        client: Gemini client to use instead of the shared one.
+        model: Gemini model to ask.
+
+    Returns:
+        Dictionary containing identified clothing items and crazy ideas.
+    """
+    return asyncio.run_coroutine_threadsafe(
+        analyze_image_async(image_bytes, mime_type, client=client, model=model),
+        _get_sync_loop(),
+    ).result()
@@ -0,0 +1,191 @@
+"""Minimal asyncio HTTP/1.1 server for webhooks and operational endpoints."""
+
+import asyncio
+import json
+import logging
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from urllib.parse import parse_qsl
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are small; anything bigger than this is not for us
+MAX_BODY_BYTES = 1024 * 1024
+HEADER_TIMEOUT_SECONDS = 30.0
+
+
+@dataclass
+class Request:
+    """A parsed HTTP request."""
+
+    method: str
+    path: str
+    headers: dict[str, str]
+    body: bytes
+    query: dict[str, str] = field(default_factory=dict)
+
+    def json(self):
+        """Decode the body as JSON."""
+        return json.loads(self.body)
+
+
+@dataclass
+class Response:
+    """An HTTP response to send back."""
+
+    status: int = 200
+    body: bytes = b""
+    content_type: str = "text/plain; charset=utf-8"
+    headers: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def json(cls, data, status: int = 200) -> "Response":
+        """Build a JSON response."""
+        return cls(status, json.dumps(data).encode(), "application/json")
+
+
+RouteHandler = Callable[[Request], Awaitable[Response]]
+
+
+class HTTPServer:
+    """
+    Route requests by (method, path) to async handlers.
+
+    Connections are kept alive between requests. close() stops accepting new
+    connections and waits for requests already being handled to finish.
+    """
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self._routes: dict[tuple[str, str], RouteHandler] = {}
+        self._server: asyncio.Server | None = None
+        self._connections: set[asyncio.StreamWriter] = set()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closing = False
+
+    def route(self, method: str, path: str, handler: RouteHandler) -> None:
+        """Register a handler for a method and exact path."""
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        """Start listening (port 0 picks a free port and updates `port`)."""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP server listening on {self.host}:{self.port}")
+
+    async def close(self) -> None:
+        """Stop accepting connections and wait for in-flight requests."""
+        self._closing = True
+        if self._server is not None:
+            self._server.close()
+        await self._idle.wait()
+        for writer in list(self._connections):
+            writer.close()
+        if self._server is not None:
+            await self._server.wait_closed()
+        logger.info("HTTP server closed")
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Handle requests on one connection until it closes."""
+        self._connections.add(writer)
+        try:
+            while not self._closing:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), HEADER_TIMEOUT_SECONDS
+                    )
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+
+                self._in_flight += 1
+                self._idle.clear()
+                try:
+                    keep_alive = await self._handle(head, reader, writer)
+                finally:
+                    self._in_flight -= 1
+                    if self._in_flight == 0:
+                        self._idle.set()
+                if not keep_alive:
+                    break
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _handle(
+        self,
+        head: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> bool:
+        """Read one request, dispatch it and write the response. Returns keep-alive."""
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                if line:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", "0"))
+            if length < 0:
+                raise ValueError(f"negative Content-Length {length}")
+        except ValueError:
+            await self._write(writer, Response(400, b"Bad request"), keep_alive=False)
+            return False
+
+        if length > MAX_BODY_BYTES:
+            await self._write(writer, Response(413, b"Payload too large"), keep_alive=False)
+            return False
+
+        try:
+            body = await reader.readexactly(length) if length else b""
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return False
+
+        keep_alive = (
+            not self._closing
+            and version == "HTTP/1.1"
+            and headers.get("connection", "").lower() != "close"
+        )
+        path, _, query = target.partition("?")
+        request = Request(method.upper(), path, headers, body, dict(parse_qsl(query)))
+
+        handler = self._routes.get((request.method, request.path))
+        if handler is None:
+            if any(path == request.path for _, path in self._routes):
+                response = Response(405, b"Method not allowed")
+            else:
+                response = Response(404, b"Not found")
+        else:
+            try:
+                response = await handler(request)
+            except Exception as e:
+                logger.error(f"Error handling {request.method} {request.path}: {e}", exc_info=True)
+                response = Response(500, b"Internal server error")
+
+        await self._write(writer, response, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    async def _write(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        """Serialize a response onto the connection."""
+        reason = HTTPStatus(response.status).phrase
+        headers = {
+            "Content-Type": response.content_type,
+            "Content-Length": str(len(response.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+            **response.headers,
+        }
+        head = f"HTTP/1.1 {response.status} {reason}\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in headers.items()
+        )
+        try:
+            writer.write(head.encode("latin-1") + b"\r\n" + response.body)
+            await writer.drain()
+        except ConnectionError:
+            pass
@@ -0,0 +1,149 @@
+"""Image preprocessing that shrinks photos before they are sent to Gemini."""
+
+import io
+import logging
+from collections.abc import Sequence
+from dataclasses import dataclass
+from typing import BinaryIO
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+from telegram import PhotoSize
+
+from .config import IMAGE_JPEG_QUALITY, IMAGE_MAX_EDGE, PHOTO_MIN_EDGE
+
+logger = logging.getLogger(__name__)
+
+# Magic-number prefixes of the formats Gemini accepts
+_MIME_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+@dataclass
+class PreparedImage:
+    """Image payload ready to upload to Gemini."""
+
+    data: bytes
+    mime_type: str
+    width: int | None = None
+    height: int | None = None
+
+
+def detect_mime_type(data: bytes, default: str = "image/jpeg") -> str:
+    """
+    Detect an image's MIME type from its leading bytes.
+
+    Args:
+        data: Encoded image data.
+        default: MIME type to assume when the format is not recognised.
+
+    Returns:
+        The detected MIME type.
+    """
+    for signature, mime_type in _MIME_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1"):
+        return "image/heic"
+    return default
+
+
+def open_image_source(image: bytes | BinaryIO) -> BinaryIO:
+    """
+    Get a readable file object over encoded image data, positioned at its start.
+
+    Args:
+        image: The data in memory, or a (spooled temporary) file holding it.
+
+    Returns:
+        A BytesIO over the bytes (no copy is made), or the rewound file itself.
+    """
+    if isinstance(image, bytes):
+        return io.BytesIO(image)
+    image.seek(0)
+    return image
+
+
+def select_photo_size(
+    photo_sizes: Sequence[PhotoSize],
+    min_edge: int = PHOTO_MIN_EDGE,
+) -> PhotoSize:
+    """
+    Pick the smallest Telegram PhotoSize that is still good enough to analyze.
+
+    Args:
+        photo_sizes: The sizes from update.message.photo (smallest first).
+        min_edge: Minimum length of the longest edge, in pixels.
+
+    Returns:
+        The smallest size whose longest edge reaches min_edge, or the largest
+        size if none does.
+    """
+    for photo_size in sorted(photo_sizes, key=lambda size: size.width * size.height):
+        if max(photo_size.width, photo_size.height) >= min_edge:
+            return photo_size
+    return photo_sizes[-1]
+
+
+def preprocess_image(
+    image_bytes: bytes | BinaryIO,
+    max_edge: int = IMAGE_MAX_EDGE,
+    quality: int = IMAGE_JPEG_QUALITY,
+) -> PreparedImage:
+    """
+    Downsample and re-encode an image for upload.
+
+    Images whose longest edge exceeds max_edge are shrunk and re-encoded as
+    JPEG. Small JPEGs are passed through untouched to avoid another round of
+    lossy compression, and undecodable data is passed through with its
+    detected MIME type so the model can still try.
+
+    Args:
+        image_bytes: Encoded image data, or a file holding it (e.g. a spooled
+            download, which is then decoded without reading it all into memory).
+        max_edge: Maximum length of the longest edge, in pixels.
+        quality: JPEG quality used when re-encoding.
+
+    Returns:
+        The prepared image.
+    """
+    source = open_image_source(image_bytes)
+    mime_type = detect_mime_type(source.read(16))
+    size = source.seek(0, io.SEEK_END)
+    source.seek(0)
+
+    try:
+        with Image.open(source) as image:
+            width, height = image.size
+            if max(width, height) <= max_edge and mime_type == "image/jpeg":
+                prepared = PreparedImage(_read_all(image_bytes), mime_type, width, height)
+            else:
+                # Let the JPEG decoder downscale by a power of two before resampling
+                image.draft("RGB", (max_edge, max_edge))
+                image = ImageOps.exif_transpose(image)
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+                out = io.BytesIO()
+                image.save(out, format="JPEG", quality=quality)
+                prepared = PreparedImage(out.getvalue(), "image/jpeg", *image.size)
+    except (UnidentifiedImageError, OSError) as e:
+        logger.warning(f"Could not preprocess image, sending as-is: {e}")
+        prepared = PreparedImage(_read_all(image_bytes), mime_type)
+
+    logger.info(
+        f"Preprocessed image: {size} -> {len(prepared.data)} bytes "
+        f"({prepared.width}x{prepared.height}, {prepared.mime_type})"
+    )
+    return prepared
+
+
+def _read_all(image: bytes | BinaryIO) -> bytes:
+    """The image data as bytes (the same object if it already is)."""
+    return image if isinstance(image, bytes) else open_image_source(image).read()
@@ -0,0 +1,381 @@
+"""Durable photo job queue in SQLite, shared safely by several worker processes."""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from typing import Any, TypeVar
+
+from .config import (
+    JOB_LEASE_SECONDS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETENTION_SECONDS,
+    JOB_STORE_PATH,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# How long to wait for another process's write transaction
+_BUSY_TIMEOUT_SECONDS = 10.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    update_id INTEGER NOT NULL UNIQUE,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    file_id TEXT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    lease_until REAL,
+    processing_message_id INTEGER,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+CREATE INDEX IF NOT EXISTS jobs_chat_file ON jobs (chat_id, file_id);
+"""
+
+# Jobs nobody holds: released ones, and reservations or claims that ran out
+_CLAIMABLE = (
+    "state IN ('pending', 'claimed') AND (lease_until IS NULL OR lease_until < ?)"
+)
+
+
+@dataclass
+class Job:
+    """
+    A photo or album job as stored.
+
+    payload holds whatever the bot needs to redo the work after a restart
+    (the serialized updates); attempts counts how often it was claimed.
+    """
+
+    id: int
+    update_id: int
+    chat_id: int
+    user_id: int
+    kind: str
+    payload: list[dict[str, Any]]
+    attempts: int
+    processing_message_id: int | None = None
+
+
+def default_worker_id() -> str:
+    """
+    Identify this process among the workers sharing a store.
+
+    The random part tells a restarted process from the one that crashed
+    (containers often reuse the PID), so it does not renew the dead one's leases.
+    """
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobStore:
+    """
+    Persistent job table with deduplication and leases.
+
+    A job moves pending -> claimed -> done (or failed). Claims are leases:
+    the owning process renews them while it works, and once a lease expires
+    (the process died) any process may claim the job again. A job added
+    unclaimed (for another process to pick up) is reserved for one lease
+    period too. Jobs are unique per update_id, so Telegram redeliveries are
+    recognized, and a photo that is already queued or running in the same
+    chat is not queued twice. Finished jobs are kept for `retention` seconds.
+
+    The database is only used from a thread of the store's own: a statement
+    may wait up to _BUSY_TIMEOUT_SECONDS for another process's lock, which
+    must not stall an event loop. Async code calls the methods through run(),
+    which also keeps their transactions from interleaving.
+
+    A store with a `shard` (index, count) only takes over the jobs of chats
+    with chat_id % count == index, the chats the worker pool sends to that
+    worker, so a chat's photos stay with one process and in order.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        worker_id: str | None = None,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        retention: float = JOB_RETENTION_SECONDS,
+        shard: tuple[int, int] | None = None,
+    ):
+        self.path = Path(path)
+        self.worker_id = worker_id or default_worker_id()
+        self.shard = shard
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retention = retention
+
+        # Job counts as of the last stats() call, for metrics
+        self.counts: dict[str, int] = {}
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-store")
+        # Opened on that thread, so sqlite3 rejects use from any other
+        self._db = self._executor.submit(self._connect).result()
+
+    async def run(self, method: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Call one of the store's methods on its database thread.
+
+        Example: `job = await store.run(store.claim, job_id)`.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, partial(method, *args, **kwargs)
+        )
+
+    def add(
+        self,
+        update_id: int,
+        chat_id: int,
+        user_id: int,
+        file_id: str | None,
+        kind: str,
+        payload: list[dict[str, Any]],
+        claim: bool = True,
+    ) -> Job | None:
+        """
+        Record a new job, claimed by this worker unless `claim` is False.
+
+        Args:
+            update_id: Telegram update the job came from (the dedup key).
+            chat_id: Chat to reply to.
+            user_id: User who sent the photo.
+            file_id: file_unique_id of the (first) photo.
+            kind: "photo" or "album".
+            payload: JSON-serializable data needed to run the job.
+            claim: Whether this worker takes the job right away; otherwise
+                it is left for the process it is dispatched to (see claim()).
+
+        Returns:
+            The new job, or None if it duplicates a known update or an
+            unfinished job for the same photo in the same chat.
+        """
+        now = time.time()
+        with self._transaction():
+            if file_id is not None and self._db.execute(
+                "SELECT 1 FROM jobs WHERE chat_id = ? AND file_id = ? "
+                "AND state IN ('pending', 'claimed')",
+                (chat_id, file_id),
+            ).fetchone():
+                return None
+            row = self._db.execute(
+                "INSERT INTO jobs (update_id, chat_id, user_id, file_id, kind, payload, "
+                "state, attempts, claimed_by, lease_until, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (update_id) DO NOTHING RETURNING id",
+                (
+                    update_id, chat_id, user_id, file_id, kind,
+                    json.dumps(payload, ensure_ascii=False),
+                    "claimed" if claim else "pending",
+                    1 if claim else 0,
+                    self.worker_id if claim else None,
+                    now + self.lease_seconds,
+                    now, now,
+                ),
+            ).fetchone()
+        if row is None:
+            return None
+        return Job(row["id"], update_id, chat_id, user_id, kind, payload, int(claim))
+
+    def claim_abandoned(self, limit: int) -> list[Job]:
+        """
+        Claim pending jobs and jobs whose owner stopped renewing its lease.
+
+        Jobs that were already claimed `max_attempts` times are marked failed
+        instead, so a photo that crashes its worker cannot loop forever. With
+        a shard, only that shard's jobs are considered.
+
+        Args:
+            limit: Maximum number of jobs to claim.
+
+        Returns:
+            The claimed jobs, oldest first.
+        """
+        now = time.time()
+        claimable, params = _CLAIMABLE, (now,)
+        if self.shard is not None:
+            index, count = self.shard
+            # As Python's %, which the pool shards by (SQLite's keeps the sign)
+            claimable += " AND ((chat_id % ?) + ?) % ? = ?"
+            params += (count, count, count, index)
+        with self._transaction():
+            self._db.execute(
+                "UPDATE jobs SET state = 'failed', result = ?, updated_at = ? "
+                f"WHERE attempts >= ? AND {claimable}",
+                (json.dumps({"error": "too many attempts"}), now, self.max_attempts, *params),
+            )
+            rows = self._db.execute(
+                "UPDATE jobs SET state = 'claimed', claimed_by = ?, lease_until = ?, "
+                "attempts = attempts + 1, updated_at = ? "
+                f"WHERE id IN (SELECT id FROM jobs WHERE {claimable} ORDER BY id LIMIT ?) "
+                "RETURNING *",
+                (self.worker_id, now + self.lease_seconds, now, *params, limit),
+            ).fetchall()
+        jobs = sorted((self._job(row) for row in rows), key=lambda job: job.id)
+        if jobs:
+            logger.info(f"Claimed {len(jobs)} abandoned job(s)")
+        return jobs
+
+    def claim(self, job_id: int) -> Job | None:
+        """
+        Claim a job that was added unclaimed for this worker.
+
+        Returns:
+            The job, or None if it is finished or held by another worker.
+        """
+        now = time.time()
+        row = self._db.execute(
+            "UPDATE jobs SET state = 'claimed', claimed_by = ?, lease_until = ?, "
+            "attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND (state = 'pending' OR (state = 'claimed' AND lease_until < ?)) "
+            "RETURNING *",
+            (self.worker_id, now + self.lease_seconds, now, job_id, now),
+        ).fetchone()
+        return self._job(row) if row is not None else None
+
+    def renew(self) -> int:
+        """Extend the leases of every job this worker holds; returns how many."""
+        now = time.time()
+        return self._db.execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? "
+            "WHERE state = 'claimed' AND claimed_by = ?",
+            (now + self.lease_seconds, now, self.worker_id),
+        ).rowcount
+
+    def set_processing_message(self, job_id: int, message_id: int) -> None:
+        """Remember the "processing" message so a resumed job can clean it up."""
+        self._db.execute(
+            "UPDATE jobs SET processing_message_id = ? WHERE id = ?", (message_id, job_id)
+        )
+
+    def complete(self, job_id: int, result: dict[str, Any] | None = None) -> None:
+        """Mark a job done, keeping its result for the retention window."""
+        self._finish(job_id, "done", result)
+
+    def fail(self, job_id: int, reason: str) -> None:
+        """Mark a job failed so it is not retried."""
+        self._finish(job_id, "failed", {"error": reason})
+
+    def release(self, job_id: int) -> None:
+        """Hand a claimed job back to the pool, e.g. when the local queue is full."""
+        self._db.execute(
+            "UPDATE jobs SET state = 'pending', claimed_by = NULL, lease_until = NULL, "
+            "attempts = MAX(attempts - 1, 0), updated_at = ? "
+            "WHERE id = ? AND state = 'claimed' AND claimed_by = ?",
+            (time.time(), job_id, self.worker_id),
+        )
+
+    def release_all(self) -> int:
+        """Hand back every job this worker still holds (graceful shutdown)."""
+        return self._db.execute(
+            "UPDATE jobs SET state = 'pending', claimed_by = NULL, lease_until = NULL, "
+            "attempts = MAX(attempts - 1, 0), updated_at = ? "
+            "WHERE state = 'claimed' AND claimed_by = ?",
+            (time.time(), self.worker_id),
+        ).rowcount
+
+    def purge(self) -> int:
+        """Delete finished jobs older than the retention window; returns how many."""
+        return self._db.execute(
+            "DELETE FROM jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - self.retention,),
+        ).rowcount
+
+    def stats(self) -> dict[str, int]:
+        """Number of jobs in each state (also kept in `counts`)."""
+        counts = dict.fromkeys(("pending", "claimed", "done", "failed"), 0)
+        for state, count in self._db.execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+        ):
+            counts[state] = count
+        self.counts = counts
+        return counts
+
+    async def close(self) -> None:
+        """Close the database connection and stop the database thread."""
+        await self.run(self._db.close)
+        self._executor.shutdown()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open the database and create the schema if needed."""
+        # Autocommit mode; multi-statement changes use explicit transactions
+        db = sqlite3.connect(self.path, timeout=_BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        return db
+
+    def _finish(self, job_id: int, state: str, result: dict[str, Any] | None) -> None:
+        """Record a job's final state and result."""
+        self._db.execute(
+            "UPDATE jobs SET state = ?, result = ?, claimed_by = NULL, lease_until = NULL, "
+            "updated_at = ? WHERE id = ?",
+            (
+                state,
+                json.dumps(result, ensure_ascii=False) if result is not None else None,
+                time.time(),
+                job_id,
+            ),
+        )
+
+    def _transaction(self):
+        """Write transaction that takes the database lock up front."""
+        return _ImmediateTransaction(self._db)
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Job:
+        return Job(
+            id=row["id"],
+            update_id=row["update_id"],
+            chat_id=row["chat_id"],
+            user_id=row["user_id"],
+            kind=row["kind"],
+            payload=json.loads(row["payload"]),
+            attempts=row["attempts"],
+            processing_message_id=row["processing_message_id"],
+        )
+
+
+class _ImmediateTransaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error."""
+
+    def __init__(self, db: sqlite3.Connection):
+        self._db = db
+
+    def __enter__(self) -> None:
+        self._db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+# Shared store; None when JOB_STORE_PATH is not configured
+_store = None
+
+
+def get_job_store() -> JobStore | None:
+    """Get or create the shared job store, or None if durable jobs are disabled."""
+    global _store
+    if _store is None and JOB_STORE_PATH:
+        _store = JobStore(JOB_STORE_PATH)
+    return _store
@@ -0,0 +1,130 @@
+"""Incremental JSON parsing of streamed Gemini analysis responses."""
+
+import json
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass
+class StreamEvent:
+    """
+    A piece of the analysis that became available while streaming.
+
+    kind is one of:
+        "greeting": data is the greeting_ua string.
+        "person": data is a person's description_ua string.
+        "item": data is a complete item dict belonging to person_index.
+        "result": data is the full parsed analysis (last event).
+    """
+
+    kind: str
+    person_index: int | None
+    data: Any
+
+
+class _Frame:
+    """An open JSON object or array."""
+
+    __slots__ = ("is_object", "path", "start", "key", "expect_key", "index")
+
+    def __init__(self, is_object: bool, path: list, start: int):
+        self.is_object = is_object
+        self.path = path
+        self.start = start
+        self.key = None
+        self.expect_key = is_object
+        self.index = 0
+
+    def child_path(self) -> list:
+        """Path of a value nested directly in this frame."""
+        return self.path + [self.key if self.is_object else self.index]
+
+
+class AnalysisStreamParser:
+    """
+    Scan streamed analysis JSON and report each piece as soon as it closes.
+
+    Feed text chunks in arrival order; each call returns the events that the
+    new text completed. Text outside the top-level object (such as markdown
+    fences) is ignored.
+    """
+
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._stack: list[_Frame] = []
+        self._in_string = False
+        self._escaped = False
+        self._string_start = 0
+
+    def feed(self, chunk: str) -> list[StreamEvent]:
+        """
+        Consume the next chunk of response text.
+
+        Args:
+            chunk: Newly received text.
+
+        Returns:
+            Events completed by this chunk, in document order.
+        """
+        self._text += chunk
+        events = []
+        text = self._text
+
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    self._on_string(json.loads(text[self._string_start:pos + 1]), events)
+                continue
+
+            if not self._stack:
+                if char in "{[":
+                    self._stack.append(_Frame(char == "{", [], pos))
+                continue
+
+            frame = self._stack[-1]
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in "{[":
+                self._stack.append(_Frame(char == "{", frame.child_path(), pos))
+            elif char in "}]":
+                closed = self._stack.pop()
+                if closed.is_object and _is_item_path(closed.path):
+                    item = json.loads(text[closed.start:pos + 1])
+                    events.append(StreamEvent("item", closed.path[1], item))
+            elif char == ",":
+                if frame.is_object:
+                    frame.expect_key = True
+                else:
+                    frame.index += 1
+            elif char == ":":
+                frame.expect_key = False
+
+        self._pos = len(text)
+        return events
+
+    def _on_string(self, value: str, events: list[StreamEvent]) -> None:
+        """Handle a completed string token."""
+        frame = self._stack[-1]
+        if frame.is_object and frame.expect_key:
+            frame.key = value
+            return
+
+        path = frame.child_path()
+        if path == ["greeting_ua"]:
+            events.append(StreamEvent("greeting", None, value))
+        elif len(path) == 3 and path[0] == "people" and path[2] == "description_ua":
+            events.append(StreamEvent("person", path[1], value))
+
+
+def _is_item_path(path: list) -> bool:
+    """Whether a path points at people[i].items[j]."""
+    return len(path) == 4 and path[0] == "people" and path[2] == "items"
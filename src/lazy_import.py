@@ -0,0 +1,51 @@
+"""Deferred imports of heavy modules that are not needed to start the bot."""
+
+import importlib
+import logging
+import time
+from types import ModuleType
+
+logger = logging.getLogger(__name__)
+
+
+class LazyModule:
+    """
+    Stand-in for a module that is imported on first attribute access.
+
+    `genai = lazy_import("google.genai")` costs nothing at import time;
+    `genai.Client` then imports google.genai (once) and returns its attribute.
+    Imports go through importlib, so concurrent first uses from several
+    threads are safe.
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def __getattr__(self, attribute: str):
+        module = self._module
+        if module is None:
+            module = self.__dict__["_module"] = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name: str) -> ModuleType:
+    """Return a stand-in for the module `name` that imports it on first use."""
+    return LazyModule(name)  # type: ignore[return-value]
+
+
+def warm_up(*names: str) -> None:
+    """
+    Import modules ahead of their first use, e.g. in a thread once the bot is ready.
+
+    Args:
+        names: Absolute module names.
+    """
+    for name in names:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        logger.info(f"Imported {name} in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,62 @@
+"""Aggregation of Telegram album (media group) updates."""
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from telegram import Update
+
+from .config import MEDIA_GROUP_WINDOW_SECONDS
+
+logger = logging.getLogger(__name__)
+
+AlbumHandler = Callable[[list[Update], Any], Awaitable[None]]
+
+
+class MediaGroupCollector:
+    """
+    Collect the photos of an album and hand them over as one batch.
+
+    Telegram delivers each photo of an album as a separate update sharing a
+    media_group_id. The collector buffers them and calls the handler once no
+    new photo has arrived for `window` seconds.
+    """
+
+    def __init__(self, handler: AlbumHandler, window: float = MEDIA_GROUP_WINDOW_SECONDS):
+        self.handler = handler
+        self.window = window
+        self._groups: dict[str, list[Update]] = {}
+        self._timers: dict[str, asyncio.Task] = {}
+
+    def add(self, media_group_id: str, update: Update, context: Any) -> None:
+        """
+        Buffer an album update and (re)start the group's collection timer.
+
+        Args:
+            media_group_id: The album identifier.
+            update: The update carrying one of the album's photos.
+            context: Handler context passed through to the album handler.
+        """
+        self._groups.setdefault(media_group_id, []).append(update)
+
+        timer = self._timers.get(media_group_id)
+        if timer is not None:
+            timer.cancel()
+        self._timers[media_group_id] = asyncio.create_task(
+            self._flush_later(media_group_id, context)
+        )
+
+    async def _flush_later(self, media_group_id: str, context: Any) -> None:
+        """Wait out the collection window, then dispatch the album."""
+        await asyncio.sleep(self.window)
+
+        self._timers.pop(media_group_id, None)
+        updates = self._groups.pop(media_group_id, [])
+        updates.sort(key=lambda update: update.message.message_id)
+        logger.info(f"Collected album {media_group_id} with {len(updates)} photo(s)")
+
+        try:
+            await self.handler(updates, context)
+        except Exception as e:
+            logger.error(f"Error handling album {media_group_id}: {e}", exc_info=True)
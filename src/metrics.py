@@ -0,0 +1,325 @@
+"""In-process counters, latency histograms and a /metrics endpoint."""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from collections.abc import Callable
+from pathlib import Path
+
+from .http_server import HTTPServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "fashionbot_"
+
+# Upper bounds in seconds; Telegram calls take ~0.1-1 s, model calls 5-60 s
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, as used by Prometheus.
+
+    Recording is a bisect and two additions, so it is cheap enough to leave
+    on in production. Quantiles are estimated by linear interpolation within
+    the bucket that contains them.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last bucket is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Record one value."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0 < q < 1) of the recorded values."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.bounds[-1]
+
+    def summary(self) -> dict[str, float]:
+        """Count, sum, mean and p50/p95/p99 of the recorded values."""
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else 0.0,
+            **{f"p{round(q * 100)}": self.quantile(q) for q in QUANTILES},
+        }
+
+    def copy(self) -> "Histogram":
+        """An independent copy, e.g. to send to another process."""
+        clone = Histogram(self.bounds)
+        clone.counts = list(self.counts)
+        clone.sum = self.sum
+        clone.count = self.count
+        return clone
+
+
+class Span:
+    """Context manager that records its duration as a pipeline stage."""
+
+    __slots__ = ("registry", "stage", "start")
+
+    def __init__(self, registry: "MetricsRegistry", stage: str):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.registry.observe("stage_seconds", time.perf_counter() - self.start, stage=self.stage)
+        if exc_type is not None:
+            self.registry.inc("stage_errors_total", stage=self.stage)
+
+
+def _labels(labels: dict[str, str]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: str = "") -> str:
+    parts = [f'{key}="{value}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class MetricsRegistry:
+    """
+    Named counters and histograms with optional labels, plus gauge collectors.
+
+    Metrics of other processes (the worker pool's) can be merged in with
+    merge_remote(); they are reported next to this process's own, with a
+    `worker` label in the Prometheus output.
+    """
+
+    def __init__(self):
+        self._counters: dict[str, dict[Labels, float]] = {}
+        self._histograms: dict[str, dict[Labels, Histogram]] = {}
+        self._collectors: dict[str, Callable[[], dict[str, float]]] = {}
+        self._remote: dict[str, dict] = {}
+
+    def inc(self, name: str, amount: float = 1.0, **labels: str) -> None:
+        """Increase a counter."""
+        series = self._counters.setdefault(name, {})
+        key = _labels(labels)
+        series[key] = series.get(key, 0.0) + amount
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+        **labels: str,
+    ) -> None:
+        """Record a value into a histogram."""
+        series = self._histograms.setdefault(name, {})
+        key = _labels(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def span(self, stage: str) -> Span:
+        """Time a pipeline stage: `with metrics.span("download"): ...`."""
+        return Span(self, stage)
+
+    def register_collector(self, name: str, collect: Callable[[], dict[str, float]]) -> None:
+        """Report the numeric values of `collect()` as gauges named `name_<key>`."""
+        self._collectors[name] = collect
+
+    def _gauges(self) -> dict[str, float]:
+        gauges = {}
+        for name, collect in self._collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Metrics collector {name} failed: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    gauges[f"{name}_{key}"] = value
+        return gauges
+
+    def export(self) -> dict:
+        """
+        A picklable copy of the raw metrics, for merge_remote() in another process.
+
+        Histograms keep their buckets (not just quantiles), so the receiving
+        side reports them as exactly as this process would.
+        """
+        return {
+            "counters": {name: dict(series) for name, series in self._counters.items()},
+            "histograms": {
+                name: {key: hist.copy() for key, hist in series.items()}
+                for name, series in self._histograms.items()
+            },
+            "gauges": self._gauges(),
+        }
+
+    def merge_remote(self, source: str, exported: dict) -> None:
+        """Report another process's export() as `source`, replacing its previous one."""
+        self._remote[source] = exported
+
+    def snapshot(self) -> dict:
+        """All metrics as a JSON-serializable dict, with histogram quantiles."""
+        snapshot = _snapshot_of(self._counters, self._histograms, self._gauges())
+        if self._remote:
+            snapshot["workers"] = {
+                source: _snapshot_of(
+                    exported["counters"], exported["histograms"], exported["gauges"]
+                )
+                for source, exported in sorted(self._remote.items())
+            }
+        return snapshot
+
+    def render_prometheus(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        # Each metric with the series of this process and those of every worker
+        counters: dict[str, list[tuple[Labels, float]]] = {}
+        histograms: dict[str, list[tuple[Labels, Histogram]]] = {}
+        gauges: dict[str, list[tuple[Labels, float]]] = {}
+        sources = [((), self._counters, self._histograms, self._gauges())]
+        for source, exported in sorted(self._remote.items()):
+            sources.append((
+                (("worker", source),),
+                exported["counters"], exported["histograms"], exported["gauges"],
+            ))
+        for extra, source_counters, source_histograms, source_gauges in sources:
+            for name, series in source_counters.items():
+                counters.setdefault(name, []).extend(
+                    (key + extra, value) for key, value in series.items()
+                )
+            for name, series in source_histograms.items():
+                histograms.setdefault(name, []).extend(
+                    (key + extra, hist) for key, hist in series.items()
+                )
+            for name, value in source_gauges.items():
+                gauges.setdefault(name, []).append((extra, value))
+
+        lines = []
+        for name, series in sorted(counters.items()):
+            lines.append(f"# TYPE {PREFIX}{name} counter")
+            for key, value in series:
+                lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# TYPE {PREFIX}{name} histogram")
+            for key, hist in series:
+                cumulative = 0
+                for bound, bucket_count in zip((*hist.bounds, "+Inf"), hist.counts):
+                    cumulative += bucket_count
+                    le = _format_labels(key, f'le="{bound}"')
+                    lines.append(f"{PREFIX}{name}_bucket{le} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_format_labels(key)} {hist.sum}")
+                lines.append(f"{PREFIX}{name}_count{_format_labels(key)} {hist.count}")
+
+        for name, series in sorted(gauges.items()):
+            lines.append(f"# TYPE {PREFIX}{name} gauge")
+            for key, value in series:
+                lines.append(f"{PREFIX}{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path: str) -> None:
+        """Atomically write snapshot() to a JSON file."""
+        _write_json(path, self.snapshot())
+
+
+def _write_json(path: str, snapshot: dict) -> None:
+    """Atomically write a snapshot to a JSON file."""
+    target = Path(path)
+    tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps(snapshot, indent=2), encoding="utf-8")
+    os.replace(tmp_path, target)
+
+
+def _snapshot_of(
+    counters: dict[str, dict[Labels, float]],
+    histograms: dict[str, dict[Labels, Histogram]],
+    gauges: dict[str, float],
+) -> dict:
+    return {
+        "counters": {
+            name: {_format_labels(key) or "total": value for key, value in series.items()}
+            for name, series in counters.items()
+        },
+        "histograms": {
+            name: {_format_labels(key) or "all": hist.summary() for key, hist in series.items()}
+            for name, series in histograms.items()
+        },
+        "gauges": gauges,
+    }
+
+
+# Process-wide registry
+metrics = MetricsRegistry()
+
+
+def add_metrics_routes(server: HTTPServer, registry: MetricsRegistry = metrics) -> None:
+    """Serve GET /metrics (Prometheus text) and GET /metrics.json on a server."""
+
+    async def prometheus(request: Request) -> Response:
+        return Response(
+            200, registry.render_prometheus().encode(), "text/plain; version=0.0.4"
+        )
+
+    async def as_json(request: Request) -> Response:
+        return Response.json(registry.snapshot())
+
+    server.route("GET", "/metrics", prometheus)
+    server.route("GET", "/metrics.json", as_json)
+
+
+async def dump_json_periodically(
+    path: str,
+    interval: float,
+    registry: MetricsRegistry = metrics,
+) -> None:
+    """
+    Write the metrics snapshot to `path` every `interval` seconds until cancelled.
+
+    The snapshot is taken on the event loop, which is the only thread that
+    changes the metrics; just the encoding and the write run in a thread.
+    """
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(_write_json, path, registry.snapshot())
+            except Exception as e:
+                logger.warning(f"Could not write metrics to {path}: {e}")
+    finally:
+        # Keep the final numbers when shutting down
+        try:
+            registry.dump_json(path)
+        except Exception as e:
+            logger.warning(f"Could not write metrics to {path}: {e}")
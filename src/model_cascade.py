@@ -0,0 +1,248 @@
+"""
+Tiered analysis: a fast Gemini model first, the pro model only when needed.
+
+The fast model's answer is scored on parse validity, item count and query
+detail; photos scoring below CASCADE_MIN_SCORE are re-analyzed with
+GEMINI_MODEL.
+
+Offline evaluation against recorded results of both tiers:
+    python -m src.model_cascade record PHOTO_DIR recorded.jsonl
+    python -m src.model_cascade eval recorded.jsonl [--thresholds 0.5,0.7,0.9]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import Any
+
+from .config import CASCADE_MIN_SCORE, GEMINI_FAST_MODEL, GEMINI_MODEL
+from .gemini_analyzer import analyze_image_async
+from .image_preprocessing import preprocess_image
+from .lazy_import import lazy_import
+from .metrics import metrics
+from .reference_index import normalize_tokens
+from .resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Loaded on first use (see gemini_analyzer)
+errors = lazy_import("google.genai.errors")
+
+# A good answer lists at least this many items per person...
+MIN_ITEMS_PER_PERSON = 2
+# ...with queries of at least this many words (color + pattern + style + murah)
+DETAILED_QUERY_WORDS = 4
+
+# Score weights: parsed at all, enough items, detailed queries
+VALIDITY_WEIGHT = 0.2
+ITEMS_WEIGHT = 0.4
+DETAIL_WEIGHT = 0.4
+
+FirstPass = Callable[[str], Awaitable[dict[str, Any]]]
+
+
+def score_analysis(result: dict[str, Any] | None) -> float:
+    """
+    Score how usable an analysis is, from 0 (unusable) to 1.
+
+    Args:
+        result: Parsed analysis, possibly an error result.
+
+    Returns:
+        Weighted score of parse validity, items per person and query detail;
+        a parsed result without people scores 1.
+    """
+    if not result or "error" in result:
+        return 0.0
+    people = result.get("people") or []
+    if not people:
+        # A clean "nobody in the photo" answer is complete; pro would say the same
+        return 1.0
+    items = [item for person in people for item in person.get("items", [])]
+    if not items:
+        return 0.0
+
+    items_score = min(1.0, len(items) / (MIN_ITEMS_PER_PERSON * len(people)))
+    detail_score = statistics.mean(
+        min(1.0, len(normalize_tokens(item.get("search_query_id", ""))) / DETAILED_QUERY_WORDS)
+        for item in items
+    )
+    return VALIDITY_WEIGHT + ITEMS_WEIGHT * items_score + DETAIL_WEIGHT * detail_score
+
+
+async def analyze_image_cascade(
+    image_bytes: bytes,
+    mime_type: str = "image/jpeg",
+    first_pass: FirstPass | None = None,
+    min_score: float = CASCADE_MIN_SCORE,
+) -> dict[str, Any]:
+    """
+    Analyze with GEMINI_FAST_MODEL, escalating to GEMINI_MODEL on a low score.
+
+    Args:
+        image_bytes: The image data as bytes.
+        mime_type: MIME type of the image data.
+        first_pass: Runs the fast tier given a model name (e.g. a streaming
+            analysis); defaults to analyze_image_async().
+        min_score: Fast results scoring below this are escalated.
+
+    Returns:
+        The analysis of whichever tier produced the final answer.
+
+    Raises:
+        TimeoutError: If the pro model does not answer within the timeout.
+    """
+    started = time.monotonic()
+    try:
+        if first_pass is not None:
+            fast_result = await first_pass(GEMINI_FAST_MODEL)
+        else:
+            fast_result = await analyze_image_async(
+                image_bytes, mime_type, model=GEMINI_FAST_MODEL
+            )
+    except (TimeoutError, CircuitOpenError, errors.APIError) as e:
+        logger.warning(f"Fast tier failed, escalating: {e}")
+        fast_result = None
+    fast_seconds = time.monotonic() - started
+    fast_score = score_analysis(fast_result)
+    metrics.observe("cascade_tier_seconds", fast_seconds, tier="fast")
+
+    if fast_score >= min_score:
+        metrics.inc("cascade_routes_total", tier="fast")
+        logger.info(
+            f"Cascade kept {GEMINI_FAST_MODEL}: score {fast_score:.2f} >= {min_score:.2f}, "
+            f"fast tier {fast_seconds:.1f}s"
+        )
+        return fast_result
+
+    started = time.monotonic()
+    pro_result = await analyze_image_async(image_bytes, mime_type, model=GEMINI_MODEL)
+    pro_seconds = time.monotonic() - started
+    metrics.observe("cascade_tier_seconds", pro_seconds, tier="pro")
+    metrics.inc("cascade_routes_total", tier="pro")
+    logger.info(
+        f"Cascade escalated to {GEMINI_MODEL}: score {fast_score:.2f} < {min_score:.2f}, "
+        f"fast tier {fast_seconds:.1f}s, pro tier {pro_seconds:.1f}s"
+    )
+
+    # A broken pro answer is worse than a weak fast one
+    if fast_result is not None and score_analysis(pro_result) < fast_score:
+        return fast_result
+    return pro_result
+
+
+def _query_tokens(result: dict[str, Any] | None) -> set[str]:
+    """All search query tokens of an analysis."""
+    if not result:
+        return set()
+    return {
+        token
+        for person in result.get("people", [])
+        for item in person.get("items", [])
+        for token in normalize_tokens(item.get("search_query_id", ""))
+    }
+
+
+def evaluate(records: list[dict[str, Any]], thresholds: list[float]) -> list[dict[str, float]]:
+    """
+    Replay the routing decision over recorded results of both tiers.
+
+    Each record holds "fast" and "pro" analyses and their "fast_seconds" and
+    "pro_seconds" latencies. Agreement is the token Jaccard similarity of the
+    chosen answer's search queries with the pro answer's.
+
+    Args:
+        records: Recorded results.
+        thresholds: Values of min_score to evaluate.
+
+    Returns:
+        One row per threshold with escalation rate, latency and agreement.
+    """
+    rows = []
+    for threshold in thresholds:
+        latencies = []
+        agreements = []
+        escalated = 0
+        for record in records:
+            latency = record["fast_seconds"]
+            chosen = record["fast"]
+            if score_analysis(record["fast"]) < threshold:
+                escalated += 1
+                latency += record["pro_seconds"]
+                chosen = record["pro"]
+            latencies.append(latency)
+
+            pro_tokens = _query_tokens(record["pro"])
+            chosen_tokens = _query_tokens(chosen)
+            union = pro_tokens | chosen_tokens
+            agreements.append(len(pro_tokens & chosen_tokens) / len(union) if union else 1.0)
+
+        latencies.sort()
+        rows.append({
+            "threshold": threshold,
+            "escalation_rate": escalated / len(records),
+            "mean_seconds": statistics.mean(latencies),
+            "p95_seconds": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            "agreement": statistics.mean(agreements),
+        })
+    return rows
+
+
+async def record(photo_dir: str, output: str) -> None:
+    """Analyze every photo in a directory with both tiers and save the results."""
+    paths = sorted(
+        path for path in Path(photo_dir).iterdir()
+        if path.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")
+    )
+    with open(output, "w", encoding="utf-8") as out:
+        for path in paths:
+            prepared = preprocess_image(path.read_bytes())
+            entry = {"photo": path.name}
+            for tier, model in (("fast", GEMINI_FAST_MODEL), ("pro", GEMINI_MODEL)):
+                started = time.monotonic()
+                entry[tier] = await analyze_image_async(
+                    prepared.data, prepared.mime_type, model=model
+                )
+                entry[f"{tier}_seconds"] = time.monotonic() - started
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            logger.info(f"Recorded {path.name}")
+
+
+def main() -> None:
+    """Record or evaluate cascade results from the command line."""
+    parser = argparse.ArgumentParser(description="Offline evaluation of the model cascade")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = commands.add_parser("record", help="Analyze photos with both tiers")
+    record_parser.add_argument("photo_dir")
+    record_parser.add_argument("output")
+
+    eval_parser = commands.add_parser("eval", help="Evaluate thresholds on recorded results")
+    eval_parser.add_argument("recorded")
+    eval_parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.8,0.9")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "record":
+        asyncio.run(record(args.photo_dir, args.output))
+        return
+
+    with open(args.recorded, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    thresholds = [float(value) for value in args.thresholds.split(",")]
+
+    print(f"{'threshold':>9} {'escalated':>9} {'mean s':>7} {'p95 s':>7} {'agreement':>9}")
+    for row in evaluate(records, thresholds):
+        print(
+            f"{row['threshold']:>9.2f} {row['escalation_rate']:>9.0%} "
+            f"{row['mean_seconds']:>7.2f} {row['p95_seconds']:>7.2f} {row['agreement']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""Perceptual hashing and near-duplicate lookup for incoming photos."""
+
+import logging
+import os
+import tempfile
+from collections import OrderedDict
+from itertools import combinations
+from pathlib import Path
+from typing import BinaryIO
+
+from PIL import Image
+
+from .config import ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX_ENTRIES, NEAR_DUPLICATE_MAX_ENTRIES
+from .image_preprocessing import open_image_source
+from .lazy_import import lazy_import
+
+logger = logging.getLogger(__name__)
+
+# Only needed once photos arrive
+np = lazy_import("numpy")
+
+# Kept next to the disk tier of the analysis cache, whose keys it indexes
+INDEX_FILE_NAME = "near-duplicates.log"
+
+HASH_SIZE = 8
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def dhash(image_bytes: bytes | BinaryIO, hash_size: int = HASH_SIZE) -> int:
+    """
+    Compute a difference hash (dHash) of an image.
+
+    The image is decoded at reduced resolution, converted to grayscale and
+    shrunk to (hash_size + 1) x hash_size; each bit records whether a pixel
+    is brighter than its left neighbour. Resizing and recompression change
+    only a few bits, so similar photos end up a small Hamming distance apart.
+
+    Args:
+        image_bytes: Encoded image data, or a file holding it.
+        hash_size: Hash side length; the hash has hash_size ** 2 bits.
+
+    Returns:
+        The hash as an unsigned integer.
+    """
+    with Image.open(open_image_source(image_bytes)) as image:
+        # Let the JPEG decoder skip most of the work via DCT scaling
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        gray = image.convert("L").resize(
+            (hash_size + 1, hash_size), Image.Resampling.BOX
+        )
+
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Return the number of differing bits between two hashes."""
+    return (a ^ b).bit_count()
+
+
+class HammingIndex:
+    """
+    Multi-index hash table for Hamming-distance search.
+
+    Each hash is split into `chunks` disjoint substrings, and each substring
+    is indexed in its own table. By the pigeonhole principle, two hashes
+    within distance r agree to within r // chunks bits on at least one
+    substring, so a search only probes the few buckets near the query's
+    substrings and verifies the candidates it finds there.
+
+    Entries are keyed by value; the oldest entries are evicted once
+    max_entries is reached.
+    """
+
+    def __init__(
+        self,
+        bits: int = HASH_BITS,
+        chunks: int = 4,
+        max_entries: int | None = None,
+    ):
+        if bits % chunks:
+            raise ValueError("bits must be divisible by chunks")
+        self.bits = bits
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.max_entries = max_entries
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._hashes: OrderedDict[str, int] = OrderedDict()
+        self._tables: list[dict[int, list[tuple[int, str]]]] = [
+            {} for _ in range(chunks)
+        ]
+        self._probe_masks: dict[int, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def add(self, hash_value: int, value: str) -> None:
+        """
+        Index a hash under a value, replacing any previous hash for that value.
+
+        Args:
+            hash_value: The perceptual hash.
+            value: Identifier to return from searches (e.g. a cache key).
+        """
+        if value in self._hashes:
+            self.remove(value)
+
+        self._hashes[value] = hash_value
+        entry = (hash_value, value)
+        for table, chunk in zip(self._tables, self._split(hash_value)):
+            table.setdefault(chunk, []).append(entry)
+
+        if self.max_entries is not None:
+            while len(self._hashes) > self.max_entries:
+                self.remove(next(iter(self._hashes)))
+
+    def remove(self, value: str) -> None:
+        """Remove a value from the index if present."""
+        hash_value = self._hashes.pop(value, None)
+        if hash_value is None:
+            return
+        entry = (hash_value, value)
+        for table, chunk in zip(self._tables, self._split(hash_value)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.remove(entry)
+                if not bucket:
+                    del table[chunk]
+
+    def search(self, hash_value: int, max_distance: int) -> list[tuple[int, str]]:
+        """
+        Find all indexed values within a Hamming distance of a hash.
+
+        Args:
+            hash_value: The query hash.
+            max_distance: Maximum number of differing bits.
+
+        Returns:
+            List of (distance, value) pairs, closest first.
+        """
+        masks = self._get_probe_masks(max_distance // self.chunks)
+        matches: dict[str, int] = {}
+
+        for table, chunk in zip(self._tables, self._split(hash_value)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if not bucket:
+                    continue
+                for candidate, value in bucket:
+                    distance = (candidate ^ hash_value).bit_count()
+                    if distance <= max_distance:
+                        matches[value] = distance
+
+        return sorted((distance, value) for value, distance in matches.items())
+
+    def nearest(self, hash_value: int, max_distance: int) -> tuple[int, str] | None:
+        """
+        Find the closest indexed value within a Hamming distance.
+
+        Args:
+            hash_value: The query hash.
+            max_distance: Maximum number of differing bits.
+
+        Returns:
+            (distance, value) of the best match, or None if nothing is close enough.
+        """
+        matches = self.search(hash_value, max_distance)
+        return matches[0] if matches else None
+
+    def _split(self, hash_value: int) -> list[int]:
+        """Split a hash into its substrings."""
+        return [
+            (hash_value >> (i * self.chunk_bits)) & self._chunk_mask
+            for i in range(self.chunks)
+        ]
+
+    def _get_probe_masks(self, radius: int) -> list[int]:
+        """Return all substring XOR masks with at most `radius` bits set."""
+        radius = min(radius, self.chunk_bits)
+        masks = self._probe_masks.get(radius)
+        if masks is None:
+            masks = [0]
+            for flips in range(1, radius + 1):
+                for positions in combinations(range(self.chunk_bits), flips):
+                    mask = 0
+                    for position in positions:
+                        mask |= 1 << position
+                    masks.append(mask)
+            self._probe_masks[radius] = masks
+        return masks
+
+
+class PersistentHammingIndex(HammingIndex):
+    """
+    HammingIndex whose additions are appended to a log file and replayed on load.
+
+    Removals are not logged: entries whose cache key has expired since are
+    dropped again by the first lookup that finds them. A log that has grown
+    to more than twice the live entries is rewritten when it is loaded.
+
+    Args:
+        path: The log file.
+        kwargs: Passed on to HammingIndex.
+    """
+
+    def __init__(self, path: str | Path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = Path(path)
+        self._load()
+
+    def add(self, hash_value: int, value: str) -> None:
+        """Index a hash under a value and log it (see HammingIndex.add())."""
+        super().add(hash_value, value)
+        try:
+            with open(self.path, "a", encoding="ascii") as f:
+                f.write(f"{hash_value:x} {value}\n")
+        except OSError as e:
+            logger.warning(f"Could not log near-duplicate index entry to {self.path}: {e}")
+
+    def _load(self) -> None:
+        """Replay the log, skipping malformed lines."""
+        try:
+            lines = self.path.read_text(encoding="ascii").splitlines()
+        except FileNotFoundError:
+            return
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning(f"Ignoring unreadable near-duplicate index {self.path}: {e}")
+            return
+
+        for line in lines:
+            try:
+                hash_hex, value = line.split()
+                HammingIndex.add(self, int(hash_hex, 16), value)
+            except ValueError:
+                continue
+        logger.info(f"Loaded {len(self)} near-duplicate index entries from {self.path}")
+        if len(lines) > 2 * len(self):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Atomically rewrite the log with only the live entries."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.")
+            try:
+                with os.fdopen(fd, "w", encoding="ascii") as f:
+                    for value, hash_value in self._hashes.items():
+                        f.write(f"{hash_value:x} {value}\n")
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Could not compact near-duplicate index {self.path}: {e}")
+
+
+_index = None
+
+
+def get_near_duplicate_index() -> HammingIndex:
+    """
+    Get or create the shared near-duplicate index.
+
+    With the analysis cache's disk tier on, the index is kept in a log file
+    next to it, so that it survives restarts like the results it points to.
+    Without it, the index holds no more entries than the memory tier can.
+    """
+    global _index
+    if _index is None:
+        if ANALYSIS_CACHE_DIR:
+            Path(ANALYSIS_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+            _index = PersistentHammingIndex(
+                Path(ANALYSIS_CACHE_DIR) / INDEX_FILE_NAME, max_entries=NEAR_DUPLICATE_MAX_ENTRIES
+            )
+        else:
+            _index = HammingIndex(
+                max_entries=min(NEAR_DUPLICATE_MAX_ENTRIES, ANALYSIS_CACHE_MAX_ENTRIES)
+            )
+    return _index
@@ -0,0 +1,295 @@
+"""
+Memory-bounded photo downloads.
+
+Photos being processed are counted against a byte budget (per process):
+a download waits while the photos already in flight add up to more than
+PHOTO_MEMORY_BUDGET_BYTES, and each handler shrinks its reservation as it
+drops buffers it no longer needs. Downloads above PHOTO_SPOOL_THRESHOLD_BYTES
+are streamed into a temporary file instead of being held in RAM; hashing and
+preprocessing read them from there.
+"""
+
+import asyncio
+import logging
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import BinaryIO
+
+import httpx
+from telegram import File
+from telegram.error import NetworkError
+
+from .config import PHOTO_MEMORY_BUDGET_BYTES, PHOTO_SPOOL_THRESHOLD_BYTES
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks a streamed download is read in, and of the batches of
+# chunks written to the spool at once (each write is one hop to a thread)
+_CHUNK_SIZE = 64 * 1024
+_WRITE_BATCH_SIZE = 1024 * 1024
+
+# Whole-download deadline for streamed downloads (PTB's own downloads use its
+# request timeouts)
+_DOWNLOAD_TIMEOUT_SECONDS = 60.0
+
+
+class Reservation:
+    """Bytes held against a ByteBudget; give them back with resize() or release()."""
+
+    def __init__(self, budget: "ByteBudget", nbytes: int):
+        self._budget = budget
+        self.nbytes = nbytes
+
+    def resize(self, nbytes: int) -> None:
+        """
+        Change the reserved amount without waiting.
+
+        Used to account for the actual size once a download is done, and to
+        give back what a finished stage no longer holds. Growing never
+        waits, so it can take the budget over its limit until released.
+        """
+        delta = nbytes - self.nbytes
+        self.nbytes = nbytes
+        self._budget._adjust(delta)
+
+    def release(self) -> None:
+        """Give back everything; releasing twice is harmless."""
+        self.resize(0)
+
+
+class ByteBudget:
+    """
+    Limit on the bytes held by photos in flight, shared by all handlers.
+
+    reserve() waits until the requested bytes fit. Waiters are served in
+    order, so a large photo is not starved by a stream of small ones, and
+    a reservation larger than the whole budget is granted once nothing else
+    is held rather than never.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters: deque[tuple[int, asyncio.Future]] = deque()
+        self._stats = {
+            "peak_bytes": 0,
+            "reservations": 0,
+            "waits": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    async def reserve(self, nbytes: int) -> Reservation:
+        """
+        Reserve `nbytes`, waiting until they fit in the budget.
+
+        Args:
+            nbytes: Bytes the caller is about to hold (e.g. the file size).
+
+        Returns:
+            The reservation; release it when the bytes are freed.
+        """
+        self._stats["reservations"] += 1
+        if not self._waiters and self._fits(nbytes):
+            self._adjust(nbytes)
+            return Reservation(self, nbytes)
+
+        self._stats["waits"] += 1
+        started = time.monotonic()
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (nbytes, waiter)
+        self._waiters.append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller gave up
+                self._adjust(-nbytes)
+            else:
+                if entry in self._waiters:
+                    self._waiters.remove(entry)
+                # Callers queued behind this one may fit now
+                self._wake()
+            raise
+
+        waited = time.monotonic() - started
+        self._stats["wait_seconds_total"] += waited
+        self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], waited)
+        metrics.observe("photo_budget_wait_seconds", waited)
+        return Reservation(self, nbytes)
+
+    def stats(self) -> dict[str, int | float]:
+        """Bytes in use, waiting callers and wait counters."""
+        return {
+            "limit_bytes": self.limit,
+            "in_use_bytes": self.in_use,
+            "waiting": len(self._waiters),
+            **self._stats,
+        }
+
+    def _fits(self, nbytes: int) -> bool:
+        return self.in_use == 0 or self.in_use + nbytes <= self.limit
+
+    def _adjust(self, delta: int) -> None:
+        """Account for bytes taken (delta > 0) or given back, waking waiters that now fit."""
+        self.in_use += delta
+        self._stats["peak_bytes"] = max(self._stats["peak_bytes"], self.in_use)
+        if delta < 0:
+            self._wake()
+
+    def _wake(self) -> None:
+        """Grant waiting reservations in order for as long as they fit."""
+        while self._waiters and self._fits(self._waiters[0][0]):
+            nbytes, waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_use += nbytes
+            self._stats["peak_bytes"] = max(self._stats["peak_bytes"], self.in_use)
+            waiter.set_result(None)
+
+
+@dataclass
+class DownloadedPhoto:
+    """A downloaded photo: bytes in memory, or a spooled temporary file."""
+
+    data: bytes | BinaryIO
+    size: int
+
+    @property
+    def spooled(self) -> bool:
+        return not isinstance(self.data, bytes)
+
+    def close(self) -> None:
+        """Drop the photo's buffer (or delete its temporary file); closing twice is harmless."""
+        if self.spooled:
+            self.data.close()
+        self.data = b""
+
+
+class _BytesSink:
+    """Write target that keeps the written bytes objects instead of copying them."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(data)
+        return len(data)
+
+    def getvalue(self) -> bytes:
+        """The written data (join returns a single bytes chunk as-is, uncopied)."""
+        return b"".join(self._chunks)
+
+    def chunks(self) -> list[bytes]:
+        """The written bytes objects, in order."""
+        return self._chunks
+
+
+async def download_photo(
+    file: File, spool_threshold: int = PHOTO_SPOOL_THRESHOLD_BYTES
+) -> DownloadedPhoto:
+    """
+    Download a Telegram file into memory, or into a temporary file if it is large.
+
+    Small files are kept as the bytes object the Bot API client returns
+    (download_as_bytearray() would copy it twice). Files above
+    `spool_threshold`, or of unknown size, go to a SpooledTemporaryFile that
+    moves to disk beyond the threshold; files on Telegram's servers are
+    streamed there in chunks rather than fetched whole.
+
+    Args:
+        file: The file from bot.get_file().
+        spool_threshold: Largest download kept in memory, in bytes.
+
+    Returns:
+        The downloaded photo.
+    """
+    if file.file_size is not None and file.file_size <= spool_threshold:
+        sink = _BytesSink()
+        await file.download_to_memory(sink)
+        data = sink.getvalue()
+        metrics.inc("download_bytes_total", len(data))
+        return DownloadedPhoto(data, len(data))
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_threshold)
+    try:
+        if file.file_size is not None:
+            # Known to exceed the threshold: skip the in-memory stage
+            spool.rollover()
+        file_path = getattr(file, "file_path", None) or ""
+        if file_path.startswith(("https://", "http://")):
+            await _stream_to(file_path, spool)
+        else:
+            # The Bot API client returns the whole body at once; write it to
+            # disk off the event loop and drop it
+            sink = _BytesSink()
+            await file.download_to_memory(sink)
+            await asyncio.to_thread(_write_chunks, spool, sink.chunks())
+            del sink
+        size = spool.tell()
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+
+    metrics.inc("download_bytes_total", size)
+    metrics.inc("spooled_downloads_total")
+    return DownloadedPhoto(spool, size)
+
+
+def _write_chunks(out: BinaryIO, chunks: list[bytes]) -> None:
+    """Write chunks to a file (called in a thread: the spool may be on disk)."""
+    for chunk in chunks:
+        out.write(chunk)
+
+
+async def _stream_to(url: str, out: BinaryIO) -> None:
+    """Stream a file URL into `out`, writing it in batches off the event loop."""
+    try:
+        async with asyncio.timeout(_DOWNLOAD_TIMEOUT_SECONDS):
+            async with get_download_client().stream("GET", url) as response:
+                response.raise_for_status()
+                batch, batch_size = [], 0
+                async for chunk in response.aiter_bytes(_CHUNK_SIZE):
+                    batch.append(chunk)
+                    batch_size += len(chunk)
+                    if batch_size >= _WRITE_BATCH_SIZE:
+                        await asyncio.to_thread(_write_chunks, out, batch)
+                        batch, batch_size = [], 0
+                if batch:
+                    await asyncio.to_thread(_write_chunks, out, batch)
+    except (httpx.HTTPError, TimeoutError) as e:
+        # The URL carries the bot token, so it must not end up in messages or logs
+        raise NetworkError(f"Photo download failed: {type(e).__name__}") from None
+
+
+# Shared budget and streaming client, created on first use
+_budget = None
+_client = None
+
+
+def get_photo_budget() -> ByteBudget:
+    """Get or create the shared photo byte budget."""
+    global _budget
+    if _budget is None:
+        _budget = ByteBudget(PHOTO_MEMORY_BUDGET_BYTES)
+    return _budget
+
+
+def get_download_client() -> httpx.AsyncClient:
+    """Get or create the HTTP client used for streamed downloads."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(timeout=_DOWNLOAD_TIMEOUT_SECONDS)
+    return _client
+
+
+async def close_download_client() -> None:
+    """Close the streaming client's connections, if it was ever used."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
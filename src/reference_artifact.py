@@ -0,0 +1,210 @@
+"""
+Reference data compiled into a precomputed artifact for fast startup.
+
+Parsing the reference JSON and building the query index on every start is
+wasted work when the file has not changed. The artifact holds everything
+the bot derives from it (the raw data, the prompt examples, the query index
+and the encoded search URL of every reference query) as one pickle that is
+recompiled when the JSON's mtime and content hash no longer match.
+
+The artifact is a pickle: only point REFERENCE_ARTIFACT_PATH at a location
+the bot itself writes.
+
+Usage (e.g. during a build, so the first start finds it ready):
+    python -m src.reference_artifact
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config import REFERENCE_ARTIFACT_PATH, REFERENCE_DATA_PATH, reference_data_mtime
+from .reference_index import ReferenceQueryIndex
+
+logger = logging.getLogger(__name__)
+
+# Bump when the artifact's contents or ReferenceQueryIndex's attributes change,
+# so artifacts written by older code are recompiled
+ARTIFACT_FORMAT = 1
+
+
+@dataclass
+class ReferenceArtifact:
+    """Everything derived from the reference JSON, plus what it was derived from."""
+
+    format: int
+    source_mtime: int | None
+    source_digest: str
+    reference_data: dict
+    prompt_examples: str
+    index: ReferenceQueryIndex
+    urls: dict[str, str]
+
+
+def build_prompt_examples(reference_data: dict) -> str:
+    """Build reference examples from loaded JSON data."""
+    examples = []
+
+    # Add examples from male/unisex looks
+    for look in reference_data.get("looks", {}).get("male_unisex", [])[:3]:
+        for search in look.get("searches", [])[:1]:
+            examples.append(f"- {look['name']} -> \"{search['query']}\"")
+
+    # Add examples from female looks
+    for look in reference_data.get("looks", {}).get("female", [])[:3]:
+        for search in look.get("searches", [])[:1]:
+            examples.append(f"- {look['name']} -> \"{search['query']}\"")
+
+    # Add accessory examples
+    for acc in reference_data.get("looks", {}).get("accessories", [])[:5]:
+        examples.append(f"- {acc['name_ua']} -> \"{acc['query']}\"")
+
+    return "\n".join(examples)
+
+
+def compile_reference_data(source: bytes, mtime: int | None) -> ReferenceArtifact:
+    """
+    Compile the reference JSON into an artifact.
+
+    Args:
+        source: The JSON file's content (empty if the file is missing).
+        mtime: The JSON file's modification time in ns.
+
+    Returns:
+        The compiled artifact.
+    """
+    # Imported here because tokopedia_search uses this module's artifact
+    from .tokopedia_search import encode_search_url
+
+    reference_data = json.loads(source) if source else {}
+    index = ReferenceQueryIndex.from_reference_data(reference_data)
+    return ReferenceArtifact(
+        format=ARTIFACT_FORMAT,
+        source_mtime=mtime,
+        source_digest=hashlib.sha256(source).hexdigest(),
+        reference_data=reference_data,
+        prompt_examples=build_prompt_examples(reference_data),
+        index=index,
+        urls={entry.query: encode_search_url(entry.query) for entry in index.entries},
+    )
+
+
+def load_reference_artifact(
+    source_path: Path = REFERENCE_DATA_PATH,
+    artifact_path: Path = REFERENCE_ARTIFACT_PATH,
+) -> ReferenceArtifact:
+    """
+    Load the artifact if it matches the reference JSON, else compile and save it.
+
+    An artifact whose recorded mtime matches is used as is. Otherwise the
+    JSON is hashed: an unchanged hash (e.g. after a fresh checkout) only
+    updates the recorded mtime, a changed one recompiles.
+
+    Args:
+        source_path: The reference JSON.
+        artifact_path: Where the artifact is kept.
+
+    Returns:
+        An artifact matching the current reference JSON.
+    """
+    started = time.perf_counter()
+    try:
+        mtime = source_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+
+    artifact = _read_artifact(artifact_path)
+    if artifact is not None and mtime is not None and artifact.source_mtime == mtime:
+        logger.info(
+            f"Loaded reference artifact ({len(artifact.index)} queries) "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        return artifact
+
+    source = source_path.read_bytes() if mtime is not None else b""
+    if artifact is not None and artifact.source_digest == hashlib.sha256(source).hexdigest():
+        artifact.source_mtime = mtime
+    else:
+        artifact = compile_reference_data(source, mtime)
+        logger.info(
+            f"Compiled reference artifact ({len(artifact.index)} queries) "
+            f"in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+    _write_artifact(artifact_path, artifact)
+    return artifact
+
+
+def _read_artifact(path: Path) -> ReferenceArtifact | None:
+    """Read an artifact; None if it is missing, unreadable or from older code."""
+    try:
+        with open(path, "rb") as f:
+            artifact = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable reference artifact {path}: {e}")
+        return None
+    if not isinstance(artifact, ReferenceArtifact) or artifact.format != ARTIFACT_FORMAT:
+        return None
+    return artifact
+
+
+def _write_artifact(path: Path, artifact: ReferenceArtifact) -> None:
+    """Save an artifact atomically; on failure it is only kept in memory."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        logger.warning(f"Could not save reference artifact to {path}: {e}")
+
+
+# How often lookups check the reference JSON's mtime for edits
+RELOAD_CHECK_INTERVAL_SECONDS = 5.0
+
+# Shared artifact; reloaded when the reference JSON's mtime changes
+_artifact = None
+_checked_at = 0.0
+
+
+def get_reference_artifact() -> ReferenceArtifact:
+    """
+    Get the reference artifact, recompiling it if the reference file changed.
+
+    The file is stat()ed at most once per RELOAD_CHECK_INTERVAL_SECONDS, so
+    edits show up after that delay rather than on the very next lookup.
+    """
+    global _artifact, _checked_at
+    now = time.monotonic()
+    if _artifact is None:
+        _artifact = load_reference_artifact()
+        _checked_at = now
+    elif now - _checked_at >= RELOAD_CHECK_INTERVAL_SECONDS:
+        _checked_at = now
+        if _artifact.source_mtime != reference_data_mtime():
+            _artifact = load_reference_artifact()
+    return _artifact
+
+
+def main() -> None:
+    """Compile the reference artifact ahead of the first start."""
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    artifact = load_reference_artifact()
+    print(f"{REFERENCE_ARTIFACT_PATH}: {len(artifact.index)} queries, "
+          f"{len(artifact.urls)} URLs, source {artifact.source_digest[:16]}")
+
+
+if __name__ == "__main__":
+    main()
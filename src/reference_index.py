@@ -0,0 +1,223 @@
+"""Fuzzy search index over the proven Tokopedia queries in the reference data."""
+
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Indonesian keywords that identify the clothing category of a query
+_CATEGORY_KEYWORDS = {
+    "top": (
+        "kemeja", "kaos", "baju", "jaket", "tank", "crop", "blouse",
+        "atasan", "rompi", "hoodie", "sweater",
+    ),
+    "bottom": ("celana", "rok", "legging", "shorts", "jeans"),
+    "footwear": ("sandal", "sepatu", "sneakers", "boots", "heels", "slipper"),
+    "headwear": ("topi", "wig", "bando", "helm", "bandana", "kupluk", "mahkota"),
+}
+
+# Weight of token TF-IDF cosine vs. character-trigram Jaccard in the final score
+TFIDF_WEIGHT = 0.6
+TRIGRAM_WEIGHT = 0.4
+
+# Terms in fewer entries than this always generate candidates
+MIN_CANDIDATE_POSTINGS = 200
+
+
+def normalize_tokens(text: str) -> list[str]:
+    """Lowercase a query and split it into word tokens."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _trigrams(text: str) -> set[str]:
+    """Character trigrams of a normalized, space-padded string."""
+    padded = f"  {' '.join(normalize_tokens(text))} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def infer_category(query: str) -> str:
+    """
+    Guess the clothing category of an Indonesian query.
+
+    Args:
+        query: The Tokopedia search query.
+
+    Returns:
+        One of top, bottom, footwear, headwear or accessory (the fallback).
+    """
+    tokens = set(normalize_tokens(query))
+    for category, keywords in _CATEGORY_KEYWORDS.items():
+        if tokens.intersection(keywords):
+            return category
+    return "accessory"
+
+
+@dataclass
+class ReferenceEntry:
+    """A canonical query from the reference data."""
+
+    query: str
+    name: str
+    category: str
+
+
+class ReferenceQueryIndex:
+    """
+    Inverted index with TF-IDF and trigram similarity over reference queries.
+
+    Candidates are gathered only from the postings of selective terms (those
+    in at most ~2% of entries) and then scored in full, so lookup cost stays
+    roughly flat as the reference file grows.
+    """
+
+    def __init__(self, entries: list[ReferenceEntry]):
+        self.entries = entries
+        self._exact: dict[str, int] = {}
+        self._token_postings: dict[str, list[int]] = defaultdict(list)
+        self._trigram_postings: dict[str, list[int]] = defaultdict(list)
+        self._weights_by_entry: list[dict[str, float]] = []
+        self._trigrams_by_entry: list[set[str]] = []
+
+        documents = [
+            normalize_tokens(f"{entry.query} {entry.name}") for entry in entries
+        ]
+        document_frequency: dict[str, int] = defaultdict(int)
+        for tokens in documents:
+            for token in set(tokens):
+                document_frequency[token] += 1
+
+        count = len(entries)
+        # Tokens never seen in the reference data still count towards the query's norm
+        self._unseen_idf = math.log(count + 1) + 1
+        self._idf = {
+            token: math.log((count + 1) / (frequency + 1)) + 1
+            for token, frequency in document_frequency.items()
+        }
+        # Terms this common are too unselective to generate candidates on their own
+        self._max_candidate_postings = max(MIN_CANDIDATE_POSTINGS, int(count * 0.02))
+
+        for entry_id, (entry, tokens) in enumerate(zip(entries, documents)):
+            self._exact.setdefault(entry.query.lower(), entry_id)
+            if entry.name:
+                self._exact.setdefault(entry.name.lower(), entry_id)
+
+            weights = self._weights(tokens)
+            self._weights_by_entry.append(weights)
+            for token in weights:
+                self._token_postings[token].append(entry_id)
+
+            trigrams = _trigrams(entry.query)
+            self._trigrams_by_entry.append(trigrams)
+            for trigram in trigrams:
+                self._trigram_postings[trigram].append(entry_id)
+
+    @classmethod
+    def from_reference_data(cls, reference_data: dict) -> "ReferenceQueryIndex":
+        """Build the index from the reference JSON structure."""
+        looks = reference_data.get("looks", {})
+        entries = []
+        seen = set()
+
+        for acc in looks.get("accessories", []):
+            if acc.get("query") and acc["query"].lower() not in seen:
+                seen.add(acc["query"].lower())
+                entries.append(ReferenceEntry(acc["query"], acc.get("name_ua", ""), "accessory"))
+
+        for look_type in ["male_unisex", "female"]:
+            for look in looks.get(look_type, []):
+                for search in look.get("searches", []):
+                    query = search.get("query")
+                    if query and query.lower() not in seen:
+                        seen.add(query.lower())
+                        entries.append(
+                            ReferenceEntry(query, look.get("name", ""), infer_category(query))
+                        )
+
+        return cls(entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def exact(self, query: str) -> ReferenceEntry | None:
+        """Return the entry whose query or name equals this text (case-insensitive)."""
+        entry_id = self._exact.get(query.lower())
+        return None if entry_id is None else self.entries[entry_id]
+
+    def search(
+        self,
+        query: str,
+        k: int = 5,
+        category: str | None = None,
+    ) -> list[tuple[ReferenceEntry, float]]:
+        """
+        Find the reference queries most similar to a query.
+
+        Args:
+            query: Free-text query (Indonesian search or Ukrainian name).
+            k: Maximum number of results.
+            category: Only return entries of this category.
+
+        Returns:
+            Up to k (entry, score) pairs, best first; scores are in [0, 1].
+        """
+        query_weights = self._weights(normalize_tokens(query))
+        query_trigrams = _trigrams(query)
+
+        # Gather candidates from selective tokens and trigrams only
+        candidates: set[int] = set()
+        shortest: list[int] = []
+        for postings in [
+            *(self._token_postings.get(token) for token in query_weights),
+            *(self._trigram_postings.get(trigram) for trigram in query_trigrams),
+        ]:
+            if not postings:
+                continue
+            if len(postings) <= self._max_candidate_postings:
+                candidates.update(postings)
+            elif not shortest or len(postings) < len(shortest):
+                shortest = postings
+        if not candidates:
+            # Every term is common; fall back to the least common one
+            candidates.update(shortest)
+
+        scored = []
+        for entry_id in candidates:
+            entry = self.entries[entry_id]
+            if category is not None and entry.category != category:
+                continue
+            entry_weights = self._weights_by_entry[entry_id]
+            cosine = sum(
+                weight * entry_weights.get(token, 0.0)
+                for token, weight in query_weights.items()
+            )
+            entry_trigrams = self._trigrams_by_entry[entry_id]
+            overlap = len(query_trigrams & entry_trigrams)
+            union = len(query_trigrams) + len(entry_trigrams) - overlap
+            jaccard = overlap / union if union else 0.0
+            scored.append((TFIDF_WEIGHT * cosine + TRIGRAM_WEIGHT * jaccard, entry_id))
+
+        scored.sort(reverse=True)
+        return [(self.entries[entry_id], score) for score, entry_id in scored[:k]]
+
+    def _weights(self, tokens: list[str]) -> dict[str, float]:
+        """L2-normalized TF-IDF weights of a token list."""
+        counts: dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        weights = {
+            token: count * self._idf.get(token, self._unseen_idf)
+            for token, count in counts.items()
+        }
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        return {token: weight / norm for token, weight in weights.items()} if norm else {}
+
+
+def get_reference_index() -> ReferenceQueryIndex:
+    """Get the reference query index, rebuilding it if the reference file changed."""
+    # Imported here because reference_artifact imports this module
+    from .reference_artifact import get_reference_artifact
+
+    return get_reference_artifact().index
@@ -0,0 +1,299 @@
+"""Deadlines, retries, hedged requests and a circuit breaker for model calls."""
+
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+import httpx
+
+from .config import (
+    BREAKER_COOLDOWN_SECONDS,
+    BREAKER_FAILURE_RATE,
+    BREAKER_MIN_CALLS,
+    BREAKER_WINDOW,
+    GEMINI_ATTEMPT_TIMEOUT_SECONDS,
+    GEMINI_HEDGE,
+    GEMINI_HEDGE_MIN_DELAY_SECONDS,
+    GEMINI_MAX_ATTEMPTS,
+    GEMINI_MODEL,
+    GEMINI_RETRY_BASE_SECONDS,
+    GEMINI_RETRY_MAX_SECONDS,
+)
+from .lazy_import import lazy_import
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Loaded on first use (see gemini_analyzer)
+errors = lazy_import("google.genai.errors")
+
+# Successful call latencies kept for the hedge delay
+LATENCY_WINDOW = 200
+# Hedge only once the p95 is based on this many samples
+MIN_LATENCY_SAMPLES = 20
+
+# Characters of a model name that cannot appear in a metric name
+_NON_METRIC_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open."""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether an error is transient: timeouts, 5xx, 429 and transport failures."""
+    if isinstance(error, (TimeoutError, httpx.TransportError)):
+        return True
+    if isinstance(error, errors.ServerError):
+        return True
+    return isinstance(error, errors.ClientError) and error.code == 429
+
+
+class CircuitBreaker:
+    """
+    Fail fast while the model keeps failing.
+
+    Tracks the outcome of the last `window` calls. Once at least `min_calls`
+    are known and the failure rate reaches `failure_rate`, the circuit opens
+    and calls are refused for `cooldown` seconds. Then a single probe call is
+    let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(
+        self,
+        failure_rate: float = BREAKER_FAILURE_RATE,
+        window: int = BREAKER_WINDOW,
+        min_calls: int = BREAKER_MIN_CALLS,
+        cooldown: float = BREAKER_COOLDOWN_SECONDS,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes: deque[bool] = deque(maxlen=window)
+        self._opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """Current state: closed, open or half_open."""
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at < self.cooldown:
+            return "open"
+        return "half_open"
+
+    def check(self) -> None:
+        """
+        Let a call through or refuse it.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with a
+                probe already in flight.
+        """
+        state = self.state
+        if state == "closed":
+            return
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return
+        metrics.inc("circuit_rejections_total")
+        raise CircuitOpenError("Model calls are failing; circuit breaker is open")
+
+    def record(self, success: bool) -> None:
+        """Record the outcome of a call that was let through."""
+        if self._opened_at is not None:
+            if not self._probing:
+                return
+            self._probing = False
+            if success:
+                logger.info("Circuit breaker closed after a successful probe")
+                self._opened_at = None
+                self._outcomes.clear()
+            else:
+                self._opened_at = time.monotonic()
+            return
+
+        self._outcomes.append(success)
+        failures = self._outcomes.count(False)
+        if (
+            len(self._outcomes) >= self.min_calls
+            and failures / len(self._outcomes) >= self.failure_rate
+        ):
+            logger.warning(
+                f"Circuit breaker opened: {failures}/{len(self._outcomes)} recent calls failed"
+            )
+            metrics.inc("circuit_opened_total")
+            self._opened_at = time.monotonic()
+
+    def abandon(self) -> None:
+        """Forget a call that was let through but never finished (e.g. cancelled)."""
+        self._probing = False
+
+    def stats(self) -> dict[str, float]:
+        """Current state (0 closed, 1 half-open, 2 open) and recent failure rate."""
+        outcomes = len(self._outcomes)
+        return {
+            "state": {"closed": 0, "half_open": 1, "open": 2}[self.state],
+            "recent_failure_rate": self._outcomes.count(False) / outcomes if outcomes else 0.0,
+        }
+
+
+class ResilientCaller:
+    """
+    Run an async call with a deadline, retries, optional hedging and a breaker.
+
+    Each attempt is limited to `attempt_timeout` seconds and the whole call
+    (including backoff) to the deadline passed to call(). Only retryable
+    errors are retried, with jittered exponential backoff, and only they
+    count as failures for the breaker - a 400 says nothing about API health.
+    With hedging, a duplicate attempt is started if the first has not
+    finished after the p95 of recent latencies; the first to succeed wins.
+    """
+
+    def __init__(
+        self,
+        breaker: CircuitBreaker | None = None,
+        max_attempts: int = GEMINI_MAX_ATTEMPTS,
+        attempt_timeout: float = GEMINI_ATTEMPT_TIMEOUT_SECONDS,
+        backoff_base: float = GEMINI_RETRY_BASE_SECONDS,
+        backoff_max: float = GEMINI_RETRY_MAX_SECONDS,
+        hedge: bool = GEMINI_HEDGE,
+        hedge_min_delay: float = GEMINI_HEDGE_MIN_DELAY_SECONDS,
+    ):
+        self.breaker = breaker or CircuitBreaker()
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def hedge_delay(self) -> float | None:
+        """Seconds to wait before hedging, or None if hedging is off or unwarmed."""
+        if not self.hedge or len(self._latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._latencies)
+        return max(self.hedge_min_delay, ordered[int(len(ordered) * 0.95) - 1])
+
+    async def call(self, attempt: Callable[[], Awaitable[T]], deadline: float | None) -> T:
+        """
+        Run `attempt` until it succeeds, fails permanently or runs out of time.
+
+        Args:
+            attempt: Starts one try, e.g. lambda: client.aio.models.generate_content(...).
+            deadline: Seconds allowed for the whole call, or None for no limit.
+
+        Returns:
+            The first successful result.
+
+        Raises:
+            CircuitOpenError: If the breaker refuses the call.
+            TimeoutError: If the deadline passes.
+            Exception: The last error if it is not retryable or attempts ran out.
+        """
+        self.breaker.check()
+        loop = asyncio.get_running_loop()
+        end = None if deadline is None else loop.time() + deadline
+
+        for attempt_number in range(1, self.max_attempts + 1):
+            remaining = None if end is None else end - loop.time()
+            if remaining is not None and remaining <= 0:
+                raise TimeoutError("Deadline exceeded")
+            timeout = self.attempt_timeout
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+
+            started = loop.time()
+            try:
+                result = await self._attempt(attempt, timeout)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                if not is_retryable(e):
+                    # The API answered, so it is healthy even if the request was bad
+                    self.breaker.record(True)
+                    raise
+                self.breaker.record(False)
+                if attempt_number == self.max_attempts or self.breaker.state != "closed":
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt_number - 1))
+                delay *= random.uniform(0.5, 1.0)
+                if end is not None and loop.time() + delay >= end:
+                    raise
+                metrics.inc("gemini_retries_total")
+                logger.warning(
+                    f"Model call failed ({type(e).__name__}), retry {attempt_number} "
+                    f"in {delay:.1f}s: {e}"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record(True)
+            self._latencies.append(loop.time() - started)
+            return result
+
+        raise AssertionError("unreachable")
+
+    async def _attempt(self, attempt: Callable[[], Awaitable[T]], timeout: float) -> T:
+        """One try, hedged with a duplicate if it is slower than usual."""
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None or hedge_delay >= timeout:
+            return await asyncio.wait_for(attempt(), timeout)
+
+        loop = asyncio.get_running_loop()
+        end = loop.time() + timeout
+        tasks = {asyncio.ensure_future(attempt())}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done:
+                metrics.inc("gemini_hedges_total")
+                logger.info(f"Model call slower than {hedge_delay:.1f}s, sending a hedged request")
+                tasks.add(asyncio.ensure_future(attempt()))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, timeout=max(end - loop.time(), 0), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise TimeoutError("Model call timed out")
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+# One caller per model: tiers differ in latency (the hedge delay) and fail
+# independently (a failing fast tier must not open the breaker for the pro
+# escalation that recovers from it)
+_model_callers: dict[str, ResilientCaller] = {}
+
+
+def get_model_caller(model: str = GEMINI_MODEL) -> ResilientCaller:
+    """Get or create the resilient caller (and breaker) for calls to `model`."""
+    caller = _model_callers.get(model)
+    if caller is None:
+        caller = _model_callers[model] = ResilientCaller()
+    return caller
+
+
+def breaker_stats() -> dict[str, float]:
+    """Breaker stats of every model called so far, keyed `<model>_<stat>`."""
+    return {
+        f"{_NON_METRIC_CHARS.sub('_', model)}_{key}": value
+        for model, caller in _model_callers.items()
+        for key, value in caller.breaker.stats().items()
+    }
@@ -1,9 +1,14 @@
 """Response formatter for Telegram bot messages."""
 
+import html
+import math
 import random
+import re
+from collections.abc import Callable
 from typing import Any
 
-from .tokopedia_search import generate_tokopedia_url
+from .config import RESPONSE_FORMAT
+from .tokopedia_search import generate_tokopedia_url, item_search_query
 
 # Fun greetings for responses
 GREETINGS = [
@@ -18,7 +23,23 @@ GREETINGS = [
 ]
 
 
-def format_analysis_response(analysis_result: dict[str, Any]) -> str:
+_HTML_TAG = re.compile(r"<[^>]*>")
+
+
+def visible_length(text: str) -> int:
+    """
+    Length of an HTML-formatted message as Telegram counts it.
+
+    Telegram's caption and message limits apply to the text after entity
+    parsing, so tags (including link URLs) do not count.
+    """
+    return len(html.unescape(_HTML_TAG.sub("", text)))
+
+
+def format_analysis_response(
+    analysis_result: dict[str, Any],
+    html_links: bool = RESPONSE_FORMAT == "html",
+) -> str:
     """
     Format the Gemini analysis result into a Telegram message.
 
@@ -26,14 +47,21 @@ def format_analysis_response(analysis_result: dict[str, Any]) -> str:
 
     Args:
         analysis_result: The parsed analysis from Gemini.
+        html_links: Render each item as one linked line (send with
+            parse_mode HTML) instead of a name followed by the bare URL.
+            The URLs then no longer count towards Telegram's length limits,
+            so most responses fit into the photo caption.
+            Items carrying "products" (see tokopedia_enrichment) also show
+            each product's price and a link to its photo.
 
     Returns:
         Formatted message string in Ukrainian.
     """
     if "error" in analysis_result:
+        error = analysis_result.get("error", "Невідома помилка")
         return (
             "Ой, щось пішло не так при аналізі фото! "
-            f"Помилка: {analysis_result.get('error', 'Невідома помилка')}"
+            f"Помилка: {html.escape(error) if html_links else error}"
         )
 
     people = analysis_result.get("people", [])
@@ -48,6 +76,8 @@ def format_analysis_response(analysis_result: dict[str, Any]) -> str:
 
     # Use LLM-generated greeting if available, fallback to random
     greeting = analysis_result.get("greeting_ua") or random.choice(GREETINGS)
+    if html_links:
+        return _format_html_response(greeting, people)
     lines.append(greeting)
     lines.append("")
 
@@ -61,12 +91,18 @@ def format_analysis_response(analysis_result: dict[str, Any]) -> str:
         items = person.get("items", [])
         for item in items:
             name_ua = item.get("name_ua", "Невідомий предмет")
-            search_query = item.get("search_query_id", "")
+            search_query = item_search_query(item)
 
             if search_query:
                 url = generate_tokopedia_url(search_query)
                 lines.append(f"{name_ua}")
                 lines.append(url)
+                # Products found by the enrichment stage, if it ran
+                for product in item.get("products", []):
+                    line = f"{product['price']}: {product['url']}"
+                    if product["thumbnail_url"]:
+                        line += f" (фото: {product['thumbnail_url']})"
+                    lines.append(line)
                 lines.append("")
 
         if len(people) > 1 and i < len(people) - 1:
@@ -75,6 +111,81 @@ def format_analysis_response(analysis_result: dict[str, Any]) -> str:
     return "\n".join(lines).strip()
 
 
+def _format_html_response(greeting: str, people: list[dict[str, Any]]) -> str:
+    """
+    Compact HTML rendering: a bold header per person and one link per item.
+
+    Blocks (greeting, then one per person) are separated by blank lines, so
+    split_message_for_caption() keeps each person's links together where it
+    can. Every line is complete on its own (tags are closed on the line that
+    opens them), so a block too large for one message can be split between
+    items (see split_blocks).
+    """
+    blocks = [html.escape(greeting)]
+    for i, person in enumerate(people):
+        lines = []
+        if len(people) > 1:
+            description = person.get("description_ua", f"Людина {i + 1}")
+            lines.append(f"<b>{html.escape(description)}</b>")
+
+        for item in person.get("items", []):
+            search_query = item_search_query(item)
+            if not search_query:
+                continue
+            url = html.escape(generate_tokopedia_url(search_query), quote=True)
+            name_ua = html.escape(item.get("name_ua", "Невідомий предмет"))
+            line = f'• <a href="{url}">{name_ua}</a>'
+            products = [_format_product_html(product) for product in item.get("products", [])]
+            if products:
+                line += " — " + ", ".join(products)
+            lines.append(line)
+
+        if lines:
+            blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+def _format_product_html(product: dict[str, str]) -> str:
+    """A found product as its linked price followed by a link to its photo."""
+    url = html.escape(product["url"], quote=True)
+    thumbnail_url = html.escape(product["thumbnail_url"], quote=True)
+    price = html.escape(product["price"])
+    if not thumbnail_url:
+        return f'<a href="{url}">{price}</a>'
+    return f'<a href="{url}">{price}</a> (<a href="{thumbnail_url}">фото</a>)'
+
+
+def format_album_response(
+    analysis_results: list[dict[str, Any]],
+    html_links: bool = RESPONSE_FORMAT == "html",
+) -> str:
+    """
+    Format the analyses of an album's photos into one Telegram message.
+
+    Args:
+        analysis_results: One parsed analysis per photo, in album order.
+        html_links: Use the compact HTML rendering (see format_analysis_response()).
+
+    Returns:
+        Formatted message string in Ukrainian.
+    """
+    usable = [result for result in analysis_results if "error" not in result]
+    if not usable:
+        return format_analysis_response(analysis_results[0], html_links)
+
+    greetings = [result.get("greeting_ua") for result in usable if result.get("greeting_ua")]
+    combined = {"greeting_ua": greetings[0] if greetings else None, "people": []}
+
+    for number, result in enumerate(analysis_results, start=1):
+        for i, person in enumerate(result.get("people", [])):
+            description = person.get("description_ua", f"Людина {i + 1}")
+            combined["people"].append(
+                {**person, "description_ua": f"Фото {number}: {description}"}
+            )
+
+    return format_analysis_response(combined, html_links)
+
+
 def format_start_message() -> str:
     """
     Format the welcome message for /start command.
@@ -101,66 +212,113 @@ def format_error_message(error: str | None = None) -> str:
     return f"{base_message} Спробуй ще раз пізніше."
 
 
+def format_queue_message(position: int) -> str:
+    """
+    Format the message shown while a photo waits for analysis.
+
+    Args:
+        position: Place in the queue, or 0 if analysis starts right away.
+
+    Returns:
+        Processing or queue-position message in Ukrainian.
+    """
+    if position <= 0:
+        return "Аналізую фото... Зачекай трохи!"
+    return f"Фото в черзі, ти {position}-й. Почну аналіз, щойно дійде черга!"
+
+
+def format_rejection_message(reason: str, retry_after: float = 0.0) -> str:
+    """
+    Format the reply to a photo that was not accepted for analysis.
+
+    Args:
+        reason: "rate_limited" or "queue_full".
+        retry_after: Seconds until the user may send another photo.
+
+    Returns:
+        Rejection message in Ukrainian.
+    """
+    if reason == "rate_limited":
+        seconds = max(1, math.ceil(retry_after))
+        return f"Забагато фото за раз! Надішли наступне через {seconds} с."
+    return "Зараз забагато фото в обробці. Спробуй ще раз за хвилинку!"
+
+
 def split_message_for_caption(
     text: str,
     caption_limit: int = 900,
-    message_limit: int = 4096
+    message_limit: int = 4096,
+    length: Callable[[str], int] = len,
+    split_blocks: bool = False,
 ) -> tuple[str, list[str]]:
     """
     Split text into caption and follow-up messages.
 
     Keeps item name + URL pairs together (they're separated by single newline).
-    Splits at double newlines (between items).
+    Splits at double newlines (between items). A block longer than
+    message_limit is always split between its lines, since Telegram would
+    reject it whole.
 
     Args:
         text: The full response text.
         caption_limit: Max chars for photo caption.
         message_limit: Max chars for text messages.
+        length: Measures a block; pass visible_length() for HTML text.
+        split_blocks: Also split blocks that merely do not fit between their
+            lines, filling each message as far as possible. Only for text
+            whose every line stands alone, like the HTML rendering (one item
+            per line, tags closed on the line that opens them).
 
     Returns:
         Tuple of (caption, list of follow-up messages).
     """
-    if len(text) <= caption_limit:
+    if length(text) <= caption_limit:
         return text, []
 
-    # Split by double newlines to get logical blocks (greeting, items, etc.)
-    # Each item block contains: "item name\nURL"
-    blocks = text.split("\n\n")
+    # Split by double newlines to get logical blocks (greeting, items, etc.),
+    # then into the pieces messages are packed from: (separator before, text)
+    pieces = []
+    for block in text.split("\n\n"):
+        if split_blocks or length(block) > message_limit:
+            lines = block.split("\n")
+            pieces.append(("\n\n", lines[0]))
+            pieces.extend(("\n", line) for line in lines[1:])
+        else:
+            pieces.append(("\n\n", block))
 
-    caption_blocks = []
-    remaining_blocks = []
+    caption_pieces = []
+    remaining_pieces = []
     current_length = 0
 
-    for i, block in enumerate(blocks):
-        block_length = len(block) + (2 if caption_blocks else 0)  # +2 for "\n\n"
+    for i, (separator, piece) in enumerate(pieces):
+        piece_length = length(piece) + (len(separator) if caption_pieces else 0)
 
-        if current_length + block_length <= caption_limit:
-            caption_blocks.append(block)
-            current_length += block_length
+        if current_length + piece_length <= caption_limit:
+            caption_pieces.append(separator + piece if caption_pieces else piece)
+            current_length += piece_length
         else:
-            # This and all remaining blocks go to follow-up messages
-            remaining_blocks = blocks[i:]
+            # This and all remaining pieces go to follow-up messages
+            remaining_pieces = pieces[i:]
             break
 
-    caption = "\n\n".join(caption_blocks)
+    caption = "".join(caption_pieces)
 
     # Split remaining into message chunks
     follow_up_messages = []
-    if remaining_blocks:
-        current_chunk = ""
-        for block in remaining_blocks:
-            block_length = len(block) + (2 if current_chunk else 0)
-
-            if current_chunk and len(current_chunk) + block_length > message_limit:
-                follow_up_messages.append(current_chunk.strip())
-                current_chunk = block
-            else:
-                if current_chunk:
-                    current_chunk += "\n\n" + block
-                else:
-                    current_chunk = block
-
-        if current_chunk:
+    current_chunk = ""
+    current_length = 0
+    for separator, piece in remaining_pieces:
+        piece_length = length(piece) + (len(separator) if current_chunk else 0)
+
+        if current_chunk and current_length + piece_length > message_limit:
             follow_up_messages.append(current_chunk.strip())
+            current_chunk = piece
+            current_length = length(piece)
+        else:
+            current_chunk = current_chunk + separator + piece if current_chunk else piece
+            current_length += piece_length
+
+    if current_chunk:
+        follow_up_messages.append(current_chunk.strip())
 
     return caption, follow_up_messages
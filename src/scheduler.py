@@ -0,0 +1,247 @@
+"""Admission control and fair scheduling of photo analyses."""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass
+
+from .config import (
+    SCHEDULER_MAX_QUEUE,
+    SCHEDULER_WORKERS,
+    USER_BURST,
+    USER_RATE_PER_MINUTE,
+)
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable[None]]
+
+# Idle (full) buckets are dropped once this many users are tracked
+_MAX_TRACKED_USERS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        """Add the tokens accrued since the last update."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        """Take `cost` tokens if available."""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        """Seconds until `cost` tokens will be available."""
+        self._refill(time.monotonic())
+        missing = cost - self.tokens
+        return max(0.0, missing / self.rate) if self.rate > 0 else float("inf")
+
+    def is_full(self) -> bool:
+        """Whether the bucket has refilled completely."""
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+@dataclass
+class Admission:
+    """
+    Outcome of submitting a job.
+
+    reason is None when accepted, otherwise "rate_limited" (the user is over
+    their token bucket) or "queue_full" (the scheduler is shedding load).
+    position is the job's place in line once a worker frees up (1 = next),
+    or 0 when a worker is idle and the job starts right away.
+    """
+
+    accepted: bool
+    position: int = 0
+    reason: str | None = None
+    retry_after: float = 0.0
+
+
+class PhotoScheduler:
+    """
+    Bounded job queue with per-user rate limits and round-robin across chats.
+
+    Each chat has its own FIFO; workers take one job from each chat in turn,
+    so a chat that queues many photos cannot delay other chats by more than
+    one job per round. Jobs beyond `max_queue` are rejected rather than
+    queued, and users over their token bucket are rejected with a retry hint.
+    """
+
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        max_queue: int = SCHEDULER_MAX_QUEUE,
+        rate_per_minute: float = USER_RATE_PER_MINUTE,
+        burst: int = USER_BURST,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self._buckets: dict[int, TokenBucket] = {}
+        self._queues: dict[int, deque[tuple[float, Job]]] = {}
+        self._rotation: deque[int] = deque()
+        self._queued = 0
+        self._running = 0
+        self._available: asyncio.Semaphore | None = None
+        self._tasks: list[asyncio.Task] = []
+        self._stats = {
+            "accepted": 0,
+            "rate_limited": 0,
+            "shed": 0,
+            "completed": 0,
+            "failed": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+        }
+
+    def submit(self, chat_id: int, user_id: int, job: Job, cost: int = 1) -> Admission:
+        """
+        Admit a job or reject it.
+
+        Args:
+            chat_id: Chat the job belongs to (the fairness unit).
+            user_id: User charged for the job (the rate-limit unit).
+            job: Coroutine function to run once a worker is free.
+            cost: Tokens to charge, e.g. the number of photos in an album.
+
+        Returns:
+            The admission decision.
+        """
+        self._ensure_workers()
+
+        if self._queued >= self.max_queue:
+            self._stats["shed"] += 1
+            logger.warning(f"Shedding job from chat {chat_id}: queue is full ({self._queued})")
+            return Admission(False, reason="queue_full")
+
+        bucket = self._bucket(user_id)
+        cost = min(cost, self.burst)
+        if not bucket.try_acquire(cost):
+            self._stats["rate_limited"] += 1
+            logger.info(f"Rate limited user {user_id}")
+            return Admission(False, reason="rate_limited", retry_after=bucket.retry_after(cost))
+
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            self._rotation.append(chat_id)
+        queue.append((time.monotonic(), job))
+        self._queued += 1
+        self._stats["accepted"] += 1
+
+        position = self._position(chat_id, len(queue) - 1)
+        self._available.release()
+        return Admission(True, position=position)
+
+    def stats(self) -> dict[str, float]:
+        """Queue depth, running jobs and admission/wait counters."""
+        done = self._stats["completed"] + self._stats["failed"]
+        return {
+            "queue_depth": self._queued,
+            "running": self._running,
+            "chats_waiting": len(self._rotation),
+            **self._stats,
+            "wait_seconds_avg": self._stats["wait_seconds_total"] / done if done else 0.0,
+        }
+
+    async def join(self) -> None:
+        """Wait until every queued and running job has finished."""
+        while self._queued or self._running:
+            await asyncio.sleep(0.1)
+
+    async def close(self) -> None:
+        """Finish outstanding jobs, then stop the workers."""
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._available = None
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        """Get a user's token bucket, forgetting idle users when there are many."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= _MAX_TRACKED_USERS:
+                self._buckets = {
+                    uid: b for uid, b in self._buckets.items() if not b.is_full()
+                }
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _position(self, chat_id: int, index: int) -> int:
+        """Estimate the place in line of the job at `index` in a chat's queue."""
+        ahead = index
+        for other_id in self._rotation:
+            if other_id != chat_id:
+                ahead += min(len(self._queues[other_id]), index + 1)
+        idle = self.workers - self._running
+        return ahead - idle + 1 if ahead >= idle else 0
+
+    def _ensure_workers(self) -> None:
+        """Start the worker tasks on first use (needs a running event loop)."""
+        if self._tasks:
+            return
+        # Counts queued jobs; each worker takes one permit per job
+        self._available = asyncio.Semaphore(0)
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"photo-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    async def _worker(self) -> None:
+        """Run queued jobs, taking chats in round-robin order."""
+        while True:
+            await self._available.acquire()
+            chat_id = self._rotation.popleft()
+            queue = self._queues[chat_id]
+            enqueued_at, job = queue.popleft()
+            if queue:
+                self._rotation.append(chat_id)
+            else:
+                del self._queues[chat_id]
+            self._queued -= 1
+            self._running += 1
+
+            wait = time.monotonic() - enqueued_at
+            metrics.observe("scheduler_wait_seconds", wait)
+            self._stats["wait_seconds_total"] += wait
+            self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait)
+            try:
+                await job()
+                self._stats["completed"] += 1
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Scheduled job for chat {chat_id} failed: {e}", exc_info=True)
+            finally:
+                self._running -= 1
+
+
+# Shared scheduler; workers start on the first submit
+_scheduler = None
+
+
+def get_photo_scheduler() -> PhotoScheduler:
+    """Get or create the shared photo scheduler."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = PhotoScheduler()
+    return _scheduler
@@ -0,0 +1,234 @@
+"""Outbound Bot API calls paced to Telegram's rate limits, with flood-control retries."""
+
+import asyncio
+import itertools
+import logging
+import time
+from collections.abc import Awaitable, Callable, Hashable
+from datetime import timedelta
+from typing import Any, TypeVar
+
+from telegram import LinkPreviewOptions, Message
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from .config import (
+    RESPONSE_FORMAT,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_CHAT_RATE_PER_SECOND,
+    TELEGRAM_GLOBAL_RATE_PER_SECOND,
+)
+from .metrics import metrics
+from .scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# A call throttled this many times in a row fails
+MAX_ATTEMPTS = 3
+
+# Idle chats are forgotten once this many are tracked
+_MAX_TRACKED_CHATS = 10000
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Return how long Telegram asked us to wait, in seconds."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+def message_options(text_message: bool = True) -> dict[str, Any]:
+    """Keyword arguments that send or edit a formatted response."""
+    if RESPONSE_FORMAT != "html":
+        return {}
+    options: dict[str, Any] = {"parse_mode": ParseMode.HTML}
+    if text_message:
+        # A preview of the first Tokopedia link would dwarf the list
+        options["link_preview_options"] = LinkPreviewOptions(is_disabled=True)
+    return options
+
+
+class _ChatState:
+    """Per-chat token bucket, send order, flood-control pause and pending edits."""
+
+    def __init__(self, rate: float, burst: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.lock = asyncio.Lock()
+        self.paused_until = 0.0
+        self.latest: dict[Hashable, int] = {}
+
+    def is_idle(self) -> bool:
+        return not self.lock.locked() and not self.latest and self.bucket.is_full()
+
+
+class TelegramSender:
+    """
+    Send Bot API calls without tripping Telegram's flood control.
+
+    Every call takes a token from the global bucket and from its chat's
+    bucket, and calls to one chat go out one at a time in order. A
+    RetryAfter pauses the chat for as long as Telegram asks and the call is
+    retried. Calls sharing a coalesce key (e.g. edits of one message) are
+    coalesced: a queued call is dropped when a newer one with the same key
+    arrives, so only the latest content is sent.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE_PER_SECOND,
+        chat_rate: float = TELEGRAM_CHAT_RATE_PER_SECOND,
+        chat_burst: int = TELEGRAM_CHAT_BURST,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: dict[int, _ChatState] = {}
+        self._sequence = itertools.count()
+        self._stats = {
+            "sent": 0,
+            "coalesced": 0,
+            "retry_after": 0,
+            "wait_seconds_total": 0.0,
+        }
+
+    async def send(
+        self,
+        chat_id: int,
+        call: Callable[[], Awaitable[T]],
+        coalesce_key: Hashable | None = None,
+    ) -> T | None:
+        """
+        Run a Bot API call once the rate limits allow it.
+
+        Args:
+            chat_id: Chat the call sends to.
+            call: Makes the request, e.g. lambda: message.reply_text(text).
+            coalesce_key: Calls with the same key replace each other while queued.
+
+        Returns:
+            The call's result, or None if a newer call with the same key replaced it.
+
+        Raises:
+            RetryAfter: If Telegram kept throttling the call.
+            TelegramError: Any other error of the call.
+        """
+        chat = self._chat(chat_id)
+        ticket = next(self._sequence)
+        if coalesce_key is not None:
+            chat.latest[coalesce_key] = ticket
+
+        async with chat.lock:
+            try:
+                for attempt in range(1, MAX_ATTEMPTS + 1):
+                    if not await self._wait_for_turn(
+                        chat, lambda: coalesce_key is None or chat.latest.get(coalesce_key) == ticket
+                    ):
+                        self._stats["coalesced"] += 1
+                        return None
+                    try:
+                        result = await call()
+                    except RetryAfter as e:
+                        delay = retry_after_seconds(e)
+                        chat.paused_until = max(chat.paused_until, time.monotonic() + delay)
+                        self._stats["retry_after"] += 1
+                        metrics.inc("telegram_retry_after_total")
+                        logger.warning(f"Flood control in chat {chat_id}: waiting {delay:.0f}s")
+                        if attempt == MAX_ATTEMPTS:
+                            raise
+                        continue
+                    self._stats["sent"] += 1
+                    return result
+            finally:
+                if coalesce_key is not None and chat.latest.get(coalesce_key) == ticket:
+                    del chat.latest[coalesce_key]
+        raise AssertionError("unreachable")
+
+    async def reply_text(self, message: Message, text: str, **kwargs) -> Message:
+        """Reply to a message with text."""
+        return await self.send(message.chat_id, lambda: message.reply_text(text, **kwargs))
+
+    async def reply_photo(self, message: Message, photo: Any, **kwargs) -> Message:
+        """Reply to a message with a photo (bytes or a file_id)."""
+        return await self.send(message.chat_id, lambda: message.reply_photo(photo, **kwargs))
+
+    async def edit_text(
+        self, message: Message, text: str, coalesce: bool = False, **kwargs
+    ) -> Message | None:
+        """Edit a text message; with `coalesce`, newer edits replace queued ones."""
+        return await self._edit(message, coalesce, lambda: message.edit_text(text, **kwargs))
+
+    async def edit_caption(
+        self, message: Message, caption: str, coalesce: bool = False, **kwargs
+    ) -> Message | None:
+        """Edit a photo's caption; with `coalesce`, newer edits replace queued ones."""
+        return await self._edit(
+            message, coalesce, lambda: message.edit_caption(caption, **kwargs)
+        )
+
+    def stats(self) -> dict[str, float]:
+        """Sent, coalesced and throttled calls, and time spent waiting for a turn."""
+        return {**self._stats, "chats": len(self._chats)}
+
+    async def _edit(
+        self, message: Message, coalesce: bool, call: Callable[[], Awaitable[Any]]
+    ) -> Message | None:
+        """Send an edit (an edit that changes nothing counts as sent); None if coalesced."""
+        key = ("edit", message.message_id) if coalesce else None
+        try:
+            if await self.send(message.chat_id, call, coalesce_key=key) is None:
+                return None
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
+        return message
+
+    async def _wait_for_turn(self, chat: _ChatState, wanted: Callable[[], bool]) -> bool:
+        """
+        Wait out a flood-control pause, then take a chat token and a global token.
+
+        Returns:
+            False, without taking tokens, once `wanted()` turns false (the
+            call was coalesced into a newer one).
+        """
+        started = time.monotonic()
+        while True:
+            if not wanted():
+                return False
+            now = time.monotonic()
+            wait = chat.paused_until - now
+            if wait <= 0:
+                wait = chat.bucket.retry_after()
+            if wait <= 0:
+                wait = self._global.retry_after()
+                if wait <= 0 and self._global.try_acquire():
+                    chat.bucket.try_acquire()
+                    break
+            await asyncio.sleep(max(wait, 0.001))
+        self._stats["wait_seconds_total"] += time.monotonic() - started
+        return True
+
+    def _chat(self, chat_id: int) -> _ChatState:
+        """Get a chat's state, forgetting idle chats when there are many."""
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            if len(self._chats) >= _MAX_TRACKED_CHATS:
+                self._chats = {
+                    cid: state for cid, state in self._chats.items() if not state.is_idle()
+                }
+            chat = self._chats[chat_id] = _ChatState(self.chat_rate, self.chat_burst)
+        return chat
+
+
+# Shared sender for all outbound messages of this process
+_sender = None
+
+
+def get_telegram_sender() -> TelegramSender:
+    """Get or create the shared Telegram sender."""
+    global _sender
+    if _sender is None:
+        _sender = TelegramSender()
+    return _sender
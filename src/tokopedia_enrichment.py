@@ -0,0 +1,274 @@
+"""
+Fetch the top Tokopedia products for analyzed items, with pooling and caching.
+
+The search endpoint is configurable (TOKOPEDIA_SEARCH_API_URL), so the bot can
+be pointed at a local stub server. It is called as
+
+    GET <url>?q=<query>&fcity=<BALI_CITY_IDS>&rows=<n>
+
+and must answer with JSON of the form
+
+    {"data": {"products": [{"name": ..., "url": ..., "price": ..., "image_url": ...}]}}
+
+(a top-level "products" list is accepted too). "price" may be a display string
+such as "Rp45.000" or a number of rupiah.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+
+from .config import (
+    BALI_CITY_IDS,
+    TOKOPEDIA_CACHE_MAX_ENTRIES,
+    TOKOPEDIA_CACHE_TTL_SECONDS,
+    TOKOPEDIA_ENRICH_RESULTS,
+    TOKOPEDIA_PER_HOST_LIMIT,
+    TOKOPEDIA_SEARCH_API_URL,
+    TOKOPEDIA_TIMEOUT_SECONDS,
+)
+from .metrics import metrics
+from .tokopedia_search import item_search_query
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclass
+class Product:
+    """A search result as shown to the user."""
+
+    name: str
+    price: str
+    url: str
+    thumbnail_url: str
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the cache key."""
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+def format_price(price: Any) -> str:
+    """Render a price as Tokopedia does ("Rp45.000"); strings are kept as they are."""
+    if isinstance(price, (int, float)):
+        return f"Rp{int(price):,}".replace(",", ".")
+    return str(price or "")
+
+
+def parse_products(data: Any, limit: int) -> list[Product]:
+    """
+    Extract products from a search response.
+
+    Args:
+        data: The decoded JSON response.
+        limit: Maximum number of products to return.
+
+    Returns:
+        Products that have at least a URL and a price, in result order.
+    """
+    if not isinstance(data, dict):
+        return []
+    raw = data.get("products")
+    if raw is None and isinstance(data.get("data"), dict):
+        raw = data["data"].get("products")
+    if not isinstance(raw, list):
+        return []
+
+    products = []
+    for entry in raw:
+        if not isinstance(entry, dict):
+            continue
+        url = entry.get("url")
+        price = format_price(entry.get("price") or entry.get("price_int"))
+        if not url or not price:
+            continue
+        products.append(Product(
+            name=str(entry.get("name", "")),
+            price=price,
+            url=str(url),
+            thumbnail_url=str(
+                entry.get("image_url") or entry.get("imageUrl") or entry.get("thumbnail") or ""
+            ),
+        ))
+        if len(products) >= limit:
+            break
+    return products
+
+
+class ProductCache:
+    """
+    LRU of search results with a TTL, keyed by normalized query and city filter.
+
+    Empty results are cached too, so a query that finds nothing is not
+    searched again until it expires.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[tuple[str, str], tuple[float, list[Product]]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple[str, str]) -> list[Product] | None:
+        """Look up the products of a query, or None on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, products = entry
+            if time.monotonic() - stored_at <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return products
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: tuple[str, str], products: list[Product]) -> None:
+        """Store the products of a query, evicting the least recently used entries."""
+        self._entries[key] = (time.monotonic(), products)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """Return hit/miss counters and the number of cached queries."""
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+
+class TokopediaEnricher:
+    """
+    Add the top products of every item's search to an analysis result.
+
+    All requests share one pooled HTTP client, so connections are reused
+    across responses. The searches of one response run concurrently, limited
+    per host; concurrent searches for the same query share one request, and
+    results are cached (see ProductCache). A search that fails or times out
+    leaves its item without products rather than failing the response.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        city_ids: str = BALI_CITY_IDS,
+        results: int = TOKOPEDIA_ENRICH_RESULTS,
+        timeout: float = TOKOPEDIA_TIMEOUT_SECONDS,
+        per_host_limit: int = TOKOPEDIA_PER_HOST_LIMIT,
+        cache: ProductCache | None = None,
+    ):
+        self.endpoint = endpoint
+        self.city_ids = city_ids
+        self.results = results
+        self.timeout = timeout
+        self.per_host_limit = per_host_limit
+        self.cache = cache or ProductCache(TOKOPEDIA_CACHE_MAX_ENTRIES, TOKOPEDIA_CACHE_TTL_SECONDS)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=per_host_limit, max_keepalive_connections=per_host_limit
+            ),
+            headers={"Accept": "application/json"},
+        )
+        self._host_slots: dict[str, asyncio.Semaphore] = {}
+        self._in_flight: dict[tuple[str, str], asyncio.Task] = {}
+        self._stats = {"requests": 0, "errors": 0, "shared": 0}
+
+    async def enrich(self, analysis_result: dict[str, Any]) -> dict[str, Any]:
+        """
+        Return a copy of an analysis result whose items carry "products".
+
+        The input (which may be shared with the analysis cache) is not
+        modified. Each item gets a list of Product dicts, empty if nothing
+        was found or the search failed.
+        """
+        if "error" in analysis_result:
+            return analysis_result
+
+        people = [
+            {**person, "items": [dict(item) for item in person.get("items", [])]}
+            for person in analysis_result.get("people", [])
+        ]
+        items = [item for person in people for item in person["items"]]
+        queries = [item_search_query(item) for item in items]
+        unique = list(dict.fromkeys(query for query in queries if query))
+
+        found = await asyncio.gather(*(self.search(query) for query in unique))
+        products = dict(zip(unique, found))
+        for item, query in zip(items, queries):
+            item["products"] = [asdict(product) for product in products.get(query, [])]
+        return {**analysis_result, "people": people}
+
+    async def search(self, query: str) -> list[Product]:
+        """Top products for a query, from the cache or the search endpoint."""
+        key = (normalize_query(query), self.city_ids)
+        products = self.cache.get(key)
+        if products is not None:
+            return products
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(key))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self._stats["shared"] += 1
+        # A caller giving up must not cancel the request other callers wait on
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict[str, int]:
+        """Requests, errors, shared searches and cache counters."""
+        cache = {f"cache_{name}": value for name, value in self.cache.stats().items()}
+        return {**self._stats, **cache}
+
+    async def close(self) -> None:
+        """Close the pooled connections."""
+        await self._client.aclose()
+
+    async def _fetch(self, key: tuple[str, str]) -> list[Product]:
+        """Run one search request; failures are logged and give no products."""
+        query, city_ids = key
+        host = urlsplit(self.endpoint).netloc
+        slots = self._host_slots.get(host)
+        if slots is None:
+            slots = self._host_slots[host] = asyncio.Semaphore(self.per_host_limit)
+
+        started = time.monotonic()
+        self._stats["requests"] += 1
+        try:
+            # The deadline includes waiting for a free slot
+            async with asyncio.timeout(self.timeout), slots:
+                response = await self._client.get(
+                    self.endpoint, params={"q": query, "fcity": city_ids, "rows": self.results}
+                )
+            response.raise_for_status()
+            products = parse_products(response.json(), self.results)
+        except (httpx.HTTPError, TimeoutError, ValueError) as e:
+            self._stats["errors"] += 1
+            metrics.inc("tokopedia_requests_total", outcome="error")
+            logger.warning(f"Tokopedia search for '{query}' failed: {type(e).__name__}: {e}")
+            return []
+
+        metrics.inc("tokopedia_requests_total", outcome="ok")
+        metrics.observe("tokopedia_search_seconds", time.monotonic() - started)
+        self.cache.put(key, products)
+        return products
+
+
+# Shared enricher; None when TOKOPEDIA_SEARCH_API_URL is not configured
+_enricher = None
+
+
+def get_tokopedia_enricher() -> TokopediaEnricher | None:
+    """Get or create the shared enricher, or None if enrichment is disabled."""
+    global _enricher
+    if _enricher is None and TOKOPEDIA_SEARCH_API_URL:
+        _enricher = TokopediaEnricher(TOKOPEDIA_SEARCH_API_URL)
+    return _enricher
@@ -2,7 +2,14 @@
 
 from urllib.parse import quote
 
-from .config import TOKOPEDIA_BASE_URL, REFERENCE_DATA
+from .config import (
+    REFERENCE_MATCH_MIN_SCORE,
+    REFERENCE_SNAP_MIN_SCORE,
+    REFERENCE_SNAP_QUERIES,
+    TOKOPEDIA_BASE_URL,
+)
+from .reference_artifact import get_reference_artifact
+from .reference_index import get_reference_index
 
 
 def generate_tokopedia_url(search_query: str) -> str:
@@ -15,10 +22,39 @@ def generate_tokopedia_url(search_query: str) -> str:
     Returns:
         Full Tokopedia search URL.
     """
+    # Reference queries come pre-encoded
+    url = get_reference_artifact().urls.get(search_query)
+    return url if url is not None else encode_search_url(search_query)
+
+
+def encode_search_url(search_query: str) -> str:
+    """Build the Tokopedia search URL of a query (without the precomputed lookup)."""
     encoded_query = quote(search_query, safe="")
     return f"{TOKOPEDIA_BASE_URL}{encoded_query}"
 
 
+def find_reference_queries(
+    query: str,
+    k: int = 5,
+    category: str | None = None,
+) -> list[tuple[str, float]]:
+    """
+    Find the proven reference queries most similar to a query.
+
+    Args:
+        query: The search query (or Ukrainian item name) to match.
+        k: Maximum number of results.
+        category: Optional category to filter by.
+
+    Returns:
+        List of (canonical Tokopedia query, score in [0, 1]) pairs, best first.
+    """
+    return [
+        (entry.query, score)
+        for entry, score in get_reference_index().search(query, k=k, category=category)
+    ]
+
+
 def find_similar_in_reference(query: str, category: str | None = None) -> str | None:
     """
     Find a similar item in reference data for better search terms.
@@ -30,25 +66,53 @@ def find_similar_in_reference(query: str, category: str | None = None) -> str |
     Returns:
         Better search query if found, None otherwise.
     """
-    query_lower = query.lower()
+    index = get_reference_index()
 
-    # Search in accessories first (they have direct queries)
-    for acc in REFERENCE_DATA.get("looks", {}).get("accessories", []):
-        if acc.get("query", "").lower() == query_lower:
-            return acc["query"]
-        if query_lower in acc.get("name_ua", "").lower():
-            return acc["query"]
+    exact = index.exact(query)
+    if exact is not None and (category is None or exact.category == category):
+        return exact.query
 
-    # Search in looks
-    for look_type in ["male_unisex", "female"]:
-        for look in REFERENCE_DATA.get("looks", {}).get(look_type, []):
-            for search in look.get("searches", []):
-                if search.get("query", "").lower() == query_lower:
-                    return search["query"]
+    matches = index.search(query, k=1, category=category)
+    if matches and matches[0][1] >= REFERENCE_MATCH_MIN_SCORE:
+        return matches[0][0].query
 
     return None
 
 
+def snap_search_query(query: str, category: str | None = None) -> str:
+    """
+    Replace a model-generated query with a proven reference query when they are close.
+
+    Args:
+        query: The model-generated Indonesian query.
+        category: The item's category, used to restrict candidates.
+
+    Returns:
+        The matching reference query, or the original query if none is close enough.
+    """
+    matches = get_reference_index().search(query, k=1, category=category)
+    if matches and matches[0][1] >= REFERENCE_SNAP_MIN_SCORE:
+        return matches[0][0].query
+    return query
+
+
+def item_search_query(item: dict) -> str:
+    """
+    Get the Tokopedia query for an analyzed item.
+
+    Args:
+        item: An item from the analysis result.
+
+    Returns:
+        The item's search_query_id, snapped to a reference query when
+        REFERENCE_SNAP_QUERIES is on; empty if the item has no query.
+    """
+    search_query = item.get("search_query_id", "")
+    if search_query and REFERENCE_SNAP_QUERIES:
+        search_query = snap_search_query(search_query, item.get("category"))
+    return search_query
+
+
 def get_accessory_suggestions(count: int = 3) -> list[dict]:
     """
     Get random accessory suggestions from reference data.
@@ -59,5 +123,5 @@ def get_accessory_suggestions(count: int = 3) -> list[dict]:
     Returns:
         List of accessory dictionaries.
     """
-    accessories = REFERENCE_DATA.get("looks", {}).get("accessories", [])
+    accessories = get_reference_artifact().reference_data.get("looks", {}).get("accessories", [])
     return accessories[:count] if accessories else []
@@ -0,0 +1,127 @@
+"""Webhook mode: receive Telegram updates through the embedded HTTP server."""
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from telegram import Update
+from telegram.ext import Application
+
+from .config import PORT, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+from .http_server import HTTPServer, Request, Response
+from .metrics import add_metrics_routes
+from .scheduler import get_photo_scheduler
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+
+class WebhookReceiver:
+    """
+    HTTP endpoints that feed Telegram updates into the application.
+
+    Updates are validated against the secret token and put on the
+    application's update queue, so handlers run exactly as they do with
+    polling. While draining, new updates get 503 so Telegram redelivers them
+    (to another instance, when several run behind a load balancer).
+    """
+
+    def __init__(self, application: Application, secret: str | None = WEBHOOK_SECRET):
+        self.application = application
+        self.secret = secret
+        self.draining = False
+
+    def register(self, server: HTTPServer, path: str = WEBHOOK_PATH) -> None:
+        """Add the webhook and health routes to a server."""
+        server.route("POST", path, self.handle_update)
+        server.route("GET", "/healthz", self.handle_health)
+
+    async def handle_update(self, request: Request) -> Response:
+        """Accept one update POSTed by Telegram."""
+        if self.secret is not None:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token.encode(), self.secret.encode()):
+                logger.warning("Rejected webhook request with an invalid secret token")
+                return Response(403, b"Forbidden")
+
+        if self.draining:
+            return Response(503, b"Shutting down")
+
+        try:
+            payload = request.json()
+            # de_json() turns `null` into None and fails oddly on other non-objects
+            if not isinstance(payload, dict):
+                raise TypeError(f"expected a JSON object, got {type(payload).__name__}")
+            update = Update.de_json(payload, self.application.bot)
+        except (ValueError, TypeError, KeyError, json.JSONDecodeError) as e:
+            logger.warning(f"Rejected malformed update: {e}")
+            return Response(400, b"Malformed update")
+
+        await self.application.update_queue.put(update)
+        return Response(200, b"ok")
+
+    async def handle_health(self, request: Request) -> Response:
+        """Report whether this instance accepts updates."""
+        if self.draining or not self.application.running:
+            return Response.json({"status": "draining"}, status=503)
+        return Response.json({
+            "status": "ok",
+            "queued_updates": self.application.update_queue.qsize(),
+            "scheduler": get_photo_scheduler().stats(),
+        })
+
+
+async def run_webhook(application: Application) -> None:
+    """
+    Serve updates over HTTP until SIGINT/SIGTERM, then drain and shut down.
+
+    On shutdown the server stops accepting updates, finishes the requests it
+    is reading, and the application processes every queued update and waits
+    for running handlers (and, through post_stop, queued photos) before exiting.
+
+    Args:
+        application: The configured bot application.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    receiver = WebhookReceiver(application)
+    server = HTTPServer(WEBHOOK_LISTEN, PORT)
+    receiver.register(server)
+    add_metrics_routes(server)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    await server.start()
+
+    if WEBHOOK_URL:
+        await application.bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Webhook registered at {WEBHOOK_URL}{WEBHOOK_PATH}")
+    else:
+        logger.info("WEBHOOK_URL is not set; serving without registering a webhook")
+
+    logger.info("Bot is ready! Receiving updates by webhook...")
+    await stop.wait()
+
+    logger.info("Draining: no longer accepting updates")
+    receiver.draining = True
+    await server.close()
+    # The webhook stays registered so other instances keep receiving updates
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
+    logger.info("Shutdown complete")
@@ -0,0 +1,295 @@
+"""Worker processes for photo jobs, sharded by chat and supervised by the ingress process."""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Any
+
+from telegram.ext import Application
+
+from .config import (
+    METRICS_JSON_INTERVAL_SECONDS,
+    METRICS_JSON_PATH,
+    SCHEDULER_MAX_QUEUE,
+    TELEGRAM_BOT_API,
+    WORKER_PROCESSES,
+    WORKER_SHUTDOWN_SECONDS,
+)
+from .job_store import get_job_store
+from .metrics import dump_json_periodically, metrics
+
+logger = logging.getLogger(__name__)
+
+# How often the supervisor checks on the workers
+SUPERVISE_INTERVAL_SECONDS = 1.0
+# A worker that crashes sooner than this after starting is restarted with
+# exponential backoff (1s, 2s, 4s, ... up to the maximum)
+STABLE_UPTIME_SECONDS = 60.0
+RESTART_BACKOFF_MAX_SECONDS = 30.0
+# How often each worker sends its metrics to the ingress process
+METRICS_REPORT_INTERVAL_SECONDS = 5.0
+
+# Workers are started fresh rather than forked from the ingress event loop
+_mp = multiprocessing.get_context("spawn")
+
+
+class WorkerPool:
+    """
+    Ingress side of the pool: N worker processes, each with its own job queue.
+
+    A job goes to worker chat_id % N, so a chat's photos are always handled
+    by the same process, in the order they arrived. Each worker runs its own
+    event loop and photo scheduler. A supervisor task restarts workers that
+    exit unexpectedly; stop() lets every worker finish its queue and exit.
+    Workers send their metrics back every few seconds, and the supervisor
+    merges them into this process's registry, so /metrics covers them too.
+    """
+
+    def __init__(self, processes: int = WORKER_PROCESSES, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.size = processes
+        self._queues = [_mp.Queue(max_queue) for _ in range(processes)]
+        self._metrics = _mp.Queue(4 * processes)
+        self._processes: list[multiprocessing.Process | None] = [None] * processes
+        self._started_at = [0.0] * processes
+        self._backoff = [0.0] * processes
+        self._restart_at: list[float | None] = [None] * processes
+        self._supervisor: asyncio.Task | None = None
+        self.restarts = 0
+
+    def start(self) -> None:
+        """Start the worker processes and their supervisor."""
+        for index in range(self.size):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+        logger.info(f"Started {self.size} worker process(es)")
+
+    def dispatch(self, chat_id: int, job: dict[str, Any]) -> bool:
+        """
+        Queue a job on the worker that owns the chat.
+
+        Args:
+            chat_id: Chat the job belongs to (the shard key).
+            job: Picklable job description.
+
+        Returns:
+            False if that worker's queue is full.
+        """
+        try:
+            self._queues[chat_id % self.size].put_nowait(job)
+        except queue.Full:
+            metrics.inc("worker_queue_full_total")
+            return False
+        return True
+
+    def stats(self) -> dict[str, float]:
+        """Live workers, restarts and queued jobs."""
+        queued = 0
+        for jobs in self._queues:
+            try:
+                queued += jobs.qsize()
+            except NotImplementedError:
+                # Not available on macOS
+                pass
+        return {
+            "workers": self.size,
+            "alive": sum(1 for p in self._processes if p is not None and p.is_alive()),
+            "restarts": self.restarts,
+            "queued": queued,
+        }
+
+    async def stop(self, timeout: float = WORKER_SHUTDOWN_SECONDS) -> None:
+        """
+        Ask every worker to finish its queued jobs and exit.
+
+        Workers still running after `timeout` seconds are terminated; their
+        unfinished jobs stay in the job store (if enabled) for the next start.
+        """
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            await asyncio.gather(self._supervisor, return_exceptions=True)
+            self._supervisor = None
+
+        for jobs in self._queues:
+            try:
+                await asyncio.to_thread(jobs.put, None, True, timeout)
+            except queue.Full:
+                pass
+
+        # Workers report their final metrics as they exit, and cannot exit
+        # while their reports are stuck in a full queue
+        collector = asyncio.create_task(self._collect_metrics_periodically())
+        deadline = time.monotonic() + timeout
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Worker {index} did not stop in time; terminating it")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+        collector.cancel()
+        await asyncio.gather(collector, return_exceptions=True)
+        self._collect_metrics()
+        logger.info("All worker processes stopped")
+
+    def _spawn(self, index: int) -> None:
+        """Start (or restart) worker `index` on its queue."""
+        old = self._processes[index]
+        if old is not None:
+            old.close()
+        process = _mp.Process(
+            target=_worker_main,
+            args=(index, self.size, self._queues[index], self._metrics),
+            name=f"photo-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+        self._restart_at[index] = None
+
+    async def _supervise(self) -> None:
+        """Restart workers that died, backing off if they keep crashing."""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL_SECONDS)
+            self._collect_metrics()
+            now = time.monotonic()
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                if self._restart_at[index] is None:
+                    uptime = now - self._started_at[index]
+                    if uptime < STABLE_UPTIME_SECONDS:
+                        self._backoff[index] = min(
+                            RESTART_BACKOFF_MAX_SECONDS, max(1.0, self._backoff[index] * 2)
+                        )
+                    else:
+                        self._backoff[index] = 0.0
+                    logger.error(
+                        f"Worker {index} exited with code {process.exitcode} after "
+                        f"{uptime:.0f}s; restarting in {self._backoff[index]:.0f}s"
+                    )
+                    metrics.inc("worker_restarts_total")
+                    self.restarts += 1
+                    self._restart_at[index] = now + self._backoff[index]
+                if now >= self._restart_at[index]:
+                    self._spawn(index)
+
+    def _collect_metrics(self) -> None:
+        """Merge the metrics reports the workers have sent since the last call."""
+        while True:
+            try:
+                index, exported = self._metrics.get_nowait()
+            except queue.Empty:
+                return
+            metrics.merge_remote(str(index), exported)
+
+    async def _collect_metrics_periodically(self) -> None:
+        """Merge metrics reports every SUPERVISE_INTERVAL_SECONDS until cancelled."""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL_SECONDS)
+            self._collect_metrics()
+
+
+# Set in worker processes, which never dispatch jobs themselves
+_in_worker = False
+
+
+def _worker_main(
+    index: int,
+    size: int,
+    jobs: multiprocessing.Queue,
+    metrics_reports: multiprocessing.Queue,
+) -> None:
+    """Entry point of a worker process."""
+    global _in_worker
+    _in_worker = True
+    # Ctrl+C and SIGTERM reach the whole process group; the ingress process
+    # coordinates the shutdown by closing the queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format=f"%(asctime)s - worker-{index} - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
+    asyncio.run(_run_worker(index, size, jobs, metrics_reports))
+
+
+def _report_metrics(index: int, metrics_reports: multiprocessing.Queue) -> None:
+    """Send this worker's metrics to the ingress process, unless it is behind on reading them."""
+    try:
+        metrics_reports.put_nowait((index, metrics.export()))
+    except queue.Full:
+        pass
+
+
+async def _report_metrics_periodically(
+    index: int, metrics_reports: multiprocessing.Queue
+) -> None:
+    """Report metrics every METRICS_REPORT_INTERVAL_SECONDS until cancelled."""
+    while True:
+        await asyncio.sleep(METRICS_REPORT_INTERVAL_SECONDS)
+        _report_metrics(index, metrics_reports)
+
+
+async def _run_worker(
+    index: int,
+    size: int,
+    jobs: multiprocessing.Queue,
+    metrics_reports: multiprocessing.Queue,
+) -> None:
+    """Run dispatched jobs until the ingress process sends the stop marker."""
+    # Imported here because the bot module imports this one
+    from . import bot
+
+    store = get_job_store()
+    if store is not None:
+        # Take over only the jobs of this worker's chats, which keeps them in order
+        store.shard = (index, size)
+
+    application = Application.builder().token(TELEGRAM_BOT_API).build()
+    await application.initialize()
+    await bot.start_warm_up(application)
+    await bot.start_job_maintenance(application)
+
+    dump_task = None
+    if METRICS_JSON_PATH:
+        dump_task = asyncio.create_task(dump_json_periodically(
+            f"{METRICS_JSON_PATH}.worker{index}", METRICS_JSON_INTERVAL_SECONDS
+        ))
+    report_task = asyncio.create_task(_report_metrics_periodically(index, metrics_reports))
+    logger.info(f"Worker {index} ready")
+
+    loop = asyncio.get_running_loop()
+    while True:
+        job = await loop.run_in_executor(None, jobs.get)
+        if job is None:
+            break
+        try:
+            await bot.run_dispatched_job(application, job)
+        except Exception as e:
+            logger.error(f"Could not start dispatched job: {e}", exc_info=True)
+
+    logger.info(f"Worker {index} stopping")
+    await bot.drain_scheduler(application)
+    report_task.cancel()
+    await asyncio.gather(report_task, return_exceptions=True)
+    _report_metrics(index, metrics_reports)
+    if dump_task is not None:
+        dump_task.cancel()
+        await asyncio.gather(dump_task, return_exceptions=True)
+    await application.shutdown()
+
+
+# Shared pool of the ingress process; None when WORKER_PROCESSES is 0
+_pool = None
+
+
+def get_worker_pool() -> WorkerPool | None:
+    """Get or create the worker pool, or None if jobs run in this process."""
+    global _pool
+    if _pool is None and WORKER_PROCESSES > 0 and not _in_worker:
+        _pool = WorkerPool()
+    return _pool
@@ -0,0 +1,35 @@
+"""Tests for the analysis cache's hit and miss accounting."""
+
+from src.analysis_cache import AnalysisCache
+
+
+def test_peek_is_not_counted(tmp_path):
+    cache = AnalysisCache(disk_dir=tmp_path)
+    assert cache.peek("missing") is None
+    cache.put("key", {"people": []})
+    assert cache.peek("key") == {"people": []}
+    assert cache.stats()["hits"] == 0
+    assert cache.stats()["misses"] == 0
+
+    assert cache.get("missing") is None
+    assert cache.get("key") == {"people": []}
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_hits_are_counted_once(tmp_path):
+    AnalysisCache(disk_dir=tmp_path).put("key", {"people": []})
+    cache = AnalysisCache(disk_dir=tmp_path)
+    assert cache.get("key") == {"people": []}
+    assert cache.get("key") == {"people": []}
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["hits"] == 2
+
+
+def test_near_duplicate_hit_replaces_the_exact_miss():
+    cache = AnalysisCache()
+    assert cache.get("resized-photo") is None
+    cache.record_near_duplicate_hit()
+    assert cache.stats() == {
+        "hits": 1, "disk_hits": 0, "near_duplicate_hits": 1, "misses": 0, "entries": 0,
+    }
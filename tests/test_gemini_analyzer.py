@@ -0,0 +1,28 @@
+"""Tests for the blocking analysis wrapper."""
+
+import asyncio
+
+from benchmarks.fakes import FakeGeminiClient, LatencyModel, load_recorded_responses
+from src.gemini_analyzer import analyze_image
+
+
+class LoopBoundClient(FakeGeminiClient):
+    """A fake client that, like a pooled HTTP client, only works on its first loop."""
+
+    loop = None
+
+    async def _respond(self, model: str) -> str:
+        loop = asyncio.get_running_loop()
+        self.loop = self.loop or loop
+        if loop is not self.loop or loop.is_closed():
+            raise RuntimeError("Event loop is closed")
+        return await super()._respond(model)
+
+
+def test_analyze_image_can_be_called_repeatedly():
+    client = LoopBoundClient(load_recorded_responses(), LatencyModel(0.001, 0.0))
+    first = analyze_image(b"photo", client=client)
+    second = analyze_image(b"photo", client=client)
+    assert "error" not in first
+    assert "error" not in second
+    assert client.calls == 2
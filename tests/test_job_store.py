@@ -0,0 +1,99 @@
+"""Tests for running the job store off the event loop."""
+
+import asyncio
+import sqlite3
+
+import pytest
+
+from src.job_store import JobStore
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_jobs_go_through_the_store_thread(tmp_path):
+    async def scenario():
+        store = JobStore(tmp_path / "jobs.db", worker_id="ingress")
+        job = await store.run(store.add, 1, 10, 20, "photo-a", "photo", [{}], claim=False)
+        assert job is not None
+        assert await store.run(store.add, 1, 10, 20, "photo-a", "photo", [{}]) is None
+
+        worker = JobStore(tmp_path / "jobs.db", worker_id="worker")
+        claimed = await worker.run(worker.claim, job.id)
+        assert claimed.attempts == 1
+        await worker.run(worker.complete, job.id, {"ok": True})
+        assert (await store.run(store.stats))["done"] == 1
+        assert store.counts["done"] == 1
+
+        # Direct calls from the event loop's thread are refused
+        with pytest.raises(sqlite3.ProgrammingError):
+            store.stats()
+
+        await worker.close()
+        await store.close()
+
+    run(scenario())
+
+
+def test_waiting_for_another_process_lock_does_not_block_the_loop(tmp_path):
+    async def scenario():
+        store = JobStore(tmp_path / "jobs.db")
+        other = sqlite3.connect(tmp_path / "jobs.db", isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")
+
+        add = asyncio.create_task(store.run(store.add, 1, 10, 20, "photo-a", "photo", [{}]))
+        # The loop keeps running while the store waits for the lock
+        await asyncio.sleep(0.2)
+        assert not add.done()
+        other.execute("COMMIT")
+        assert (await asyncio.wait_for(add, 5)) is not None
+
+        other.close()
+        await store.close()
+
+    run(scenario())
+
+
+def test_restarted_process_with_the_same_pid_does_not_renew_old_leases(tmp_path, monkeypatch):
+    monkeypatch.setattr("socket.gethostname", lambda: "worker-host")
+    monkeypatch.setattr("os.getpid", lambda: 7)
+
+    async def scenario():
+        crashed = JobStore(tmp_path / "jobs.db", lease_seconds=0.2)
+        job = await crashed.run(crashed.add, 1, 10, 20, "photo-a", "photo", [{}])
+        await crashed.close()
+
+        # Same host and PID after the restart, but a new process
+        restarted = JobStore(tmp_path / "jobs.db", lease_seconds=0.2)
+        assert restarted.worker_id != crashed.worker_id
+        await asyncio.sleep(0.1)
+        assert await restarted.run(restarted.renew) == 0
+        await asyncio.sleep(0.2)
+        resumed = await restarted.run(restarted.claim_abandoned, 10)
+        assert [resumed_job.id for resumed_job in resumed] == [job.id]
+        await restarted.close()
+
+    run(scenario())
+
+
+def test_sharded_store_takes_over_only_its_chats(tmp_path):
+    async def scenario():
+        ingress = JobStore(tmp_path / "jobs.db", lease_seconds=0.05)
+        chats = [4, 5, -3, -4, 7]
+        for update_id, chat_id in enumerate(chats):
+            await ingress.run(
+                ingress.add, update_id, chat_id, 1, f"photo-{update_id}", "photo", [{}],
+                claim=False,
+            )
+        await asyncio.sleep(0.1)
+
+        # Worker 1 of 2 gets the odd chats, by Python's % as in WorkerPool.dispatch()
+        worker = JobStore(tmp_path / "jobs.db", shard=(1, 2))
+        claimed = await worker.run(worker.claim_abandoned, 10)
+        assert [job.chat_id for job in claimed] == [chat for chat in chats if chat % 2 == 1]
+
+        await worker.close()
+        await ingress.close()
+
+    run(scenario())
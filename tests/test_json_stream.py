@@ -0,0 +1,95 @@
+"""Tests for streamed analysis parsing and the repair of truncated responses."""
+
+import json
+
+from src.analysis_schema import parse_analysis, repair_truncated_json
+from src.json_stream import AnalysisStreamParser
+
+ANALYSIS = {
+    "greeting_ua": "Привіт, \"модник\" {}!",
+    "people": [
+        {
+            "description_ua": "Людина в куртці",
+            "items": [
+                {"name_ua": "Куртка", "search_query_id": "jaket hitam murah", "category": "top"},
+                {"name_ua": "Штани {x}", "search_query_id": "celana \\ murah", "category": "bottom"},
+            ],
+        },
+        {
+            "description_ua": "Друга людина",
+            "items": [
+                {"name_ua": "Кепка", "search_query_id": "topi merah murah", "category": "headwear"},
+            ],
+        },
+    ],
+}
+
+FENCED = "```json\n" + json.dumps(ANALYSIS, ensure_ascii=False, indent=2) + "\n```"
+
+
+def feed_in_chunks(text: str, size: int) -> list[tuple[int, object]]:
+    """Feed the text in chunks; return (characters fed so far, event) pairs."""
+    parser = AnalysisStreamParser()
+    events = []
+    for start in range(0, len(text), size):
+        for event in parser.feed(text[start:start + size]):
+            events.append((start + size, event))
+    return events
+
+
+def test_events_come_in_document_order_for_any_chunking():
+    expected = [
+        ("greeting", None, ANALYSIS["greeting_ua"]),
+        ("person", 0, "Людина в куртці"),
+        ("item", 0, ANALYSIS["people"][0]["items"][0]),
+        ("item", 0, ANALYSIS["people"][0]["items"][1]),
+        ("person", 1, "Друга людина"),
+        ("item", 1, ANALYSIS["people"][1]["items"][0]),
+    ]
+    for size in (1, 3, 7, 64, len(FENCED)):
+        events = [event for _, event in feed_in_chunks(FENCED, size)]
+        assert [(e.kind, e.person_index, e.data) for e in events] == expected
+
+
+def test_items_are_emitted_as_soon_as_they_close():
+    events = feed_in_chunks(FENCED, 5)
+    first_item = next(fed for fed, event in events if event.kind == "item")
+    # The first item is out long before the rest of the response arrives
+    assert first_item < FENCED.index("Штани")
+    assert first_item >= FENCED.index('"top"')
+
+
+def test_an_unfinished_item_is_not_emitted():
+    parser = AnalysisStreamParser()
+    text = json.dumps(ANALYSIS, ensure_ascii=False)
+    cut = text.index('"category": "bottom"')
+    kinds = [event.kind for event in parser.feed(text[:cut])]
+    assert kinds == ["greeting", "person", "item"]
+    assert [event.data for event in parser.feed(text[cut:])][0] == ANALYSIS["people"][0]["items"][1]
+
+
+def test_repair_keeps_the_complete_items_of_a_truncated_response():
+    text = json.dumps(ANALYSIS, ensure_ascii=False)
+    truncated = text[:text.index('"Кепка"') + 4]
+
+    repaired = repair_truncated_json(truncated)
+    assert repaired["greeting_ua"] == ANALYSIS["greeting_ua"]
+    assert repaired["people"][0] == ANALYSIS["people"][0]
+    assert repaired["people"][1]["description_ua"] == "Друга людина"
+    # The half-written item is cut back to its opening brace; salvage drops it
+    assert repaired["people"][1]["items"] == [{}]
+
+
+def test_repair_gives_up_without_any_json():
+    assert repair_truncated_json("Sorry, I can't help with that.") is None
+
+
+def test_parse_analysis_salvages_a_fenced_truncated_response():
+    truncated = FENCED[:FENCED.index('"Кепка"')]
+
+    result = parse_analysis(truncated)
+    assert result == {"greeting_ua": ANALYSIS["greeting_ua"], "people": [ANALYSIS["people"][0]]}
+
+
+def test_parse_analysis_returns_a_valid_fenced_response_unchanged():
+    assert parse_analysis(FENCED) == ANALYSIS
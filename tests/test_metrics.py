@@ -0,0 +1,72 @@
+"""Tests for merging worker metrics and writing metrics snapshots."""
+
+import asyncio
+import json
+import pickle
+
+from src.metrics import MetricsRegistry, dump_json_periodically
+
+
+def make_worker_registry(photos: int) -> MetricsRegistry:
+    registry = MetricsRegistry()
+    registry.inc("photos_total", photos)
+    registry.observe("stage_seconds", 0.2, stage="analyze")
+    registry.register_collector("scheduler", lambda: {"running": photos})
+    return registry
+
+
+def test_worker_metrics_are_reported_with_a_worker_label():
+    ingress = MetricsRegistry()
+    ingress.inc("updates_total")
+    for index in range(2):
+        # As sent over the worker pool's queue
+        exported = pickle.loads(pickle.dumps(make_worker_registry(index + 1).export()))
+        ingress.merge_remote(str(index), exported)
+
+    text = ingress.render_prometheus()
+    assert "fashionbot_updates_total 1.0" in text
+    assert 'fashionbot_photos_total{worker="1"} 2.0' in text
+    assert 'fashionbot_stage_seconds_count{stage="analyze",worker="0"} 1' in text
+    assert 'fashionbot_scheduler_running{worker="1"} 2' in text
+    assert text.count("# TYPE fashionbot_photos_total counter") == 1
+
+    snapshot = ingress.snapshot()
+    assert snapshot["workers"]["0"]["counters"]["photos_total"]["total"] == 1.0
+    assert snapshot["workers"]["1"]["gauges"]["scheduler_running"] == 2
+
+
+def test_newer_report_replaces_the_previous_one():
+    worker = make_worker_registry(1)
+    ingress = MetricsRegistry()
+    ingress.merge_remote("0", worker.export())
+    worker.inc("photos_total")
+    ingress.merge_remote("0", worker.export())
+    assert ingress.snapshot()["workers"]["0"]["counters"]["photos_total"]["total"] == 2.0
+
+
+def test_export_is_a_copy():
+    worker = make_worker_registry(1)
+    exported = worker.export()
+    worker.observe("stage_seconds", 0.3, stage="analyze")
+    assert exported["histograms"]["stage_seconds"][(("stage", "analyze"),)].count == 1
+
+
+def test_periodic_dump_survives_a_failed_write(tmp_path):
+    registry = make_worker_registry(1)
+
+    async def scenario():
+        # The first writes fail: the directory does not exist yet
+        target = tmp_path / "later" / "metrics.json"
+        dump = asyncio.create_task(
+            dump_json_periodically(str(target), 0.01, registry)
+        )
+        await asyncio.sleep(0.05)
+        target.parent.mkdir()
+        await asyncio.sleep(0.05)
+        assert not dump.done()
+        dump.cancel()
+        await asyncio.gather(dump, return_exceptions=True)
+        return json.loads(target.read_text(encoding="utf-8"))
+
+    snapshot = asyncio.run(scenario())
+    assert snapshot["counters"]["photos_total"]["total"] == 1.0
@@ -0,0 +1,100 @@
+"""Tests for the multi-index Hamming search behind near-duplicate lookup."""
+
+import random
+
+import pytest
+
+from src.perceptual_hash import HASH_BITS, HammingIndex, PersistentHammingIndex, hamming_distance
+
+
+def flip_bits(hash_value: int, count: int, rng: random.Random, bits: int = HASH_BITS) -> int:
+    for position in rng.sample(range(bits), count):
+        hash_value ^= 1 << position
+    return hash_value
+
+
+def make_hashes(rng: random.Random, bits: int = HASH_BITS) -> dict[str, int]:
+    """Clusters of hashes around a few bases, so every radius has some matches."""
+    hashes = {}
+    for base_number in range(4):
+        base = rng.getrandbits(bits)
+        for number in range(30):
+            flipped = flip_bits(base, rng.randint(0, bits // 2), rng, bits)
+            hashes[f"{base_number}-{number}"] = flipped
+    return hashes
+
+
+def brute_force(hashes: dict[str, int], query: int, max_distance: int) -> list[tuple[int, str]]:
+    return sorted(
+        (hamming_distance(query, hash_value), value)
+        for value, hash_value in hashes.items()
+        if hamming_distance(query, hash_value) <= max_distance
+    )
+
+
+@pytest.mark.parametrize("seed", range(2))
+def test_search_matches_a_brute_force_scan_at_every_radius(seed):
+    rng = random.Random(seed)
+    hashes = make_hashes(rng)
+    index = HammingIndex()
+    for value, hash_value in hashes.items():
+        index.add(hash_value, value)
+
+    queries = [flip_bits(hash_value, rng.randint(0, 8), rng) for hash_value in hashes.values()]
+    for max_distance in range(HASH_BITS + 1):
+        for query in rng.sample(queries, 2):
+            assert index.search(query, max_distance) == brute_force(hashes, query, max_distance)
+
+
+def test_search_matches_brute_force_with_uneven_chunks():
+    rng = random.Random(7)
+    hashes = make_hashes(rng, bits=24)
+    index = HammingIndex(bits=24, chunks=3)
+    for value, hash_value in hashes.items():
+        index.add(hash_value, value)
+
+    for max_distance in range(25):
+        for _ in range(5):
+            query = rng.getrandbits(24)
+            assert index.search(query, max_distance) == brute_force(hashes, query, max_distance)
+
+
+def test_removed_and_evicted_entries_are_not_found():
+    rng = random.Random(1)
+    hashes = make_hashes(rng)
+    index = HammingIndex(max_entries=50)
+    for value, hash_value in hashes.items():
+        index.add(hash_value, value)
+    live = dict(list(hashes.items())[-50:])
+    removed = next(iter(live))
+    index.remove(removed)
+    del live[removed]
+
+    assert len(index) == 49
+    for query in rng.sample(list(hashes.values()), 10):
+        assert index.search(query, 12) == brute_force(live, query, 12)
+
+
+def test_nearest_returns_the_closest_match():
+    index = HammingIndex()
+    index.add(0b1111, "far")
+    index.add(0b0001, "near")
+    assert index.nearest(0, 4) == (1, "near")
+    assert index.nearest(1 << 40, 0) is None
+
+
+def test_persistent_index_replays_the_latest_hash_per_value(tmp_path):
+    rng = random.Random(2)
+    hashes = make_hashes(rng)
+    path = tmp_path / "near-duplicates.log"
+    index = PersistentHammingIndex(path)
+    for value, hash_value in hashes.items():
+        index.add(hash_value, value)
+    # A re-added value keeps only its newest hash
+    hashes["0-0"] = rng.getrandbits(HASH_BITS)
+    index.add(hashes["0-0"], "0-0")
+
+    reloaded = PersistentHammingIndex(path)
+    assert len(reloaded) == len(hashes)
+    for query in rng.sample(list(hashes.values()), 10):
+        assert reloaded.search(query, 10) == brute_force(hashes, query, 10)
@@ -0,0 +1,264 @@
+"""Tests for the photo byte budget and spooled downloads."""
+
+import asyncio
+import io
+import threading
+
+import pytest
+from PIL import Image
+from telegram.error import NetworkError
+
+from src.analysis_cache import make_cache_key
+from src.http_server import HTTPServer, Response
+from src.image_preprocessing import preprocess_image
+from src.perceptual_hash import dhash
+from src.photo_download import (
+    ByteBudget,
+    _stream_to,
+    close_download_client,
+    download_photo,
+)
+
+
+def make_jpeg(width: int = 1600, height: int = 1200) -> bytes:
+    """A JPEG large enough to be downscaled by preprocessing."""
+    buffer = io.BytesIO()
+    Image.effect_noise((width, height), 40).convert("RGB").save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class FakeFile:
+    """A telegram.File stand-in: either downloaded by the Bot API client or from a URL."""
+
+    def __init__(self, data: bytes, file_size: int | None = None, file_path: str | None = None):
+        self._data = data
+        self.file_size = file_size
+        self.file_path = file_path
+        self.downloads = 0
+
+    async def download_to_memory(self, out) -> None:
+        self.downloads += 1
+        out.write(bytes(memoryview(self._data)))
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_reservations_within_limit_are_granted_at_once():
+    async def scenario():
+        budget = ByteBudget(100)
+        first = await budget.reserve(60)
+        second = await budget.reserve(40)
+        assert budget.in_use == 100
+        first.release()
+        second.release()
+        assert budget.in_use == 0
+        assert budget.stats()["waits"] == 0
+        assert budget.stats()["peak_bytes"] == 100
+
+    run(scenario())
+
+
+def test_reservation_waits_until_bytes_are_released():
+    async def scenario():
+        budget = ByteBudget(100)
+        held = await budget.reserve(80)
+        waiting = asyncio.create_task(budget.reserve(30))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        assert budget.stats()["waiting"] == 1
+
+        # Shrinking (e.g. to the prepared upload) is enough to let it in
+        held.resize(70)
+        granted = await asyncio.wait_for(waiting, 1)
+        assert budget.in_use == 100
+        assert budget.stats()["waits"] == 1
+
+        held.release()
+        granted.release()
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_waiters_are_served_in_order():
+    async def scenario():
+        budget = ByteBudget(100)
+        held = await budget.reserve(90)
+        large = asyncio.create_task(budget.reserve(60))
+        await asyncio.sleep(0)
+        small = asyncio.create_task(budget.reserve(5))
+        await asyncio.sleep(0)
+        # 5 bytes would fit, but not ahead of the photo that has waited longer
+        assert not small.done()
+
+        held.release()
+        await asyncio.wait_for(asyncio.gather(large, small), 1)
+        assert budget.in_use == 65
+
+    run(scenario())
+
+
+def test_oversized_reservation_runs_alone():
+    async def scenario():
+        budget = ByteBudget(100)
+        held = await budget.reserve(10)
+        oversized = asyncio.create_task(budget.reserve(500))
+        await asyncio.sleep(0)
+        assert not oversized.done()
+
+        held.release()
+        reservation = await asyncio.wait_for(oversized, 1)
+        assert budget.in_use == 500
+        reservation.release()
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_cancelled_waiter_gives_way_to_the_next():
+    async def scenario():
+        budget = ByteBudget(100)
+        held = await budget.reserve(50)
+        blocked = asyncio.create_task(budget.reserve(80))
+        await asyncio.sleep(0)
+        behind = asyncio.create_task(budget.reserve(40))
+        await asyncio.sleep(0)
+        assert not behind.done()
+
+        blocked.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await blocked
+        reservation = await asyncio.wait_for(behind, 1)
+        assert budget.in_use == 90
+        assert budget.stats()["waiting"] == 0
+
+        held.release()
+        reservation.release()
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_release_is_idempotent():
+    async def scenario():
+        budget = ByteBudget(100)
+        reservation = await budget.reserve(30)
+        reservation.release()
+        reservation.release()
+        assert budget.in_use == 0
+
+    run(scenario())
+
+
+def test_download_at_or_below_threshold_stays_in_memory():
+    data = b"x" * 1000
+    file = FakeFile(data, file_size=len(data))
+    photo = run(download_photo(file, spool_threshold=1000))
+    assert not photo.spooled
+    assert photo.data == data
+    assert photo.size == len(data)
+
+
+def test_download_above_threshold_is_spooled_to_disk():
+    data = make_jpeg()
+    file = FakeFile(data, file_size=len(data))
+    photo = run(download_photo(file, spool_threshold=len(data) - 1))
+    try:
+        assert photo.spooled
+        # Known to be large, so it went straight to a file on disk
+        assert photo.data._rolled
+        assert photo.size == len(data)
+        assert photo.data.read() == data
+    finally:
+        photo.close()
+    assert photo.data == b""
+
+
+def test_download_of_unknown_size_is_spooled_in_memory_when_small():
+    file = FakeFile(b"small", file_size=None)
+    photo = run(download_photo(file, spool_threshold=1000))
+    assert photo.spooled
+    assert not photo.data._rolled
+    assert photo.data.read() == b"small"
+    photo.close()
+
+
+def test_spooled_photo_hashes_and_preprocesses_like_bytes():
+    data = make_jpeg()
+    photo = run(download_photo(FakeFile(data, file_size=len(data)), spool_threshold=1024))
+    try:
+        assert make_cache_key(photo.data, "v1") == make_cache_key(data, "v1")
+        assert dhash(photo.data) == dhash(data)
+        assert preprocess_image(photo.data).data == preprocess_image(data).data
+    finally:
+        photo.close()
+
+
+def test_streamed_download_is_written_to_the_spool():
+    data = make_jpeg()
+
+    async def scenario():
+        server = HTTPServer("127.0.0.1", 0)
+
+        async def serve_file(request):
+            return Response(body=data, content_type="image/jpeg")
+
+        server.route("GET", "/file/bot123:secret/photo.jpg", serve_file)
+        await server.start()
+        base = f"http://127.0.0.1:{server.port}/file/bot123:secret"
+        try:
+            file = FakeFile(b"", file_size=len(data), file_path=f"{base}/photo.jpg")
+            photo = await download_photo(file, spool_threshold=1024)
+            assert file.downloads == 0
+            assert photo.data.read() == data
+            photo.close()
+
+            missing = FakeFile(b"", file_size=len(data), file_path=f"{base}/missing.jpg")
+            with pytest.raises(NetworkError) as raised:
+                await download_photo(missing, spool_threshold=1024)
+            # The URL holds the bot token
+            assert "secret" not in str(raised.value)
+        finally:
+            await close_download_client()
+            await server.close()
+
+    run(scenario())
+
+
+class ThreadRecordingFile(io.BytesIO):
+    """A file that records which threads wrote to it."""
+
+    def __init__(self):
+        super().__init__()
+        self.writer_threads = set()
+
+    def write(self, data) -> int:
+        self.writer_threads.add(threading.get_ident())
+        return super().write(data)
+
+
+def test_streamed_chunks_are_written_off_the_event_loop():
+    data = bytes(range(256)) * 12_000  # about 3 MB: several write batches
+
+    async def scenario():
+        server = HTTPServer("127.0.0.1", 0)
+
+        async def serve_file(request):
+            return Response(body=data, content_type="application/octet-stream")
+
+        server.route("GET", "/file.bin", serve_file)
+        await server.start()
+        out = ThreadRecordingFile()
+        try:
+            await _stream_to(f"http://127.0.0.1:{server.port}/file.bin", out)
+        finally:
+            await close_download_client()
+            await server.close()
+        return out
+
+    out = run(scenario())
+    assert out.getvalue() == data
+    assert out.writer_threads
+    assert threading.get_ident() not in out.writer_threads
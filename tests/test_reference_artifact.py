@@ -0,0 +1,48 @@
+"""Tests for reloading the reference artifact when the reference JSON changes."""
+
+from types import SimpleNamespace
+
+from src import reference_artifact
+
+
+def test_reference_file_is_checked_at_most_once_per_interval(monkeypatch):
+    now = [1000.0]
+    mtime = [1]
+    stats = []
+    loads = []
+
+    def fake_mtime():
+        stats.append(now[0])
+        return mtime[0]
+
+    def fake_load():
+        loads.append(now[0])
+        return SimpleNamespace(source_mtime=mtime[0])
+
+    monkeypatch.setattr(reference_artifact, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    monkeypatch.setattr(reference_artifact, "reference_data_mtime", fake_mtime)
+    monkeypatch.setattr(reference_artifact, "load_reference_artifact", fake_load)
+    monkeypatch.setattr(reference_artifact, "_artifact", None)
+    interval = reference_artifact.RELOAD_CHECK_INTERVAL_SECONDS
+
+    first = reference_artifact.get_reference_artifact()
+    for _ in range(100):
+        assert reference_artifact.get_reference_artifact() is first
+    assert stats == []
+
+    # An edit is picked up by the first lookup after the interval
+    mtime[0] = 2
+    now[0] += interval / 2
+    assert reference_artifact.get_reference_artifact() is first
+    now[0] += interval / 2
+    second = reference_artifact.get_reference_artifact()
+    assert second is not first
+    assert second.source_mtime == 2
+    assert stats == [1000.0 + interval]
+    assert loads == [1000.0, 1000.0 + interval]
+
+    # Unchanged file: checked again, not reloaded
+    now[0] += interval
+    assert reference_artifact.get_reference_artifact() is second
+    assert len(stats) == 2
+    assert len(loads) == 2
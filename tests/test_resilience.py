@@ -0,0 +1,192 @@
+"""Tests for the circuit breaker, hedged calls and token buckets."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src import resilience, scheduler
+from src.resilience import CircuitBreaker, CircuitOpenError, ResilientCaller
+from src.scheduler import TokenBucket
+
+
+class FakeClock:
+    """time.monotonic() stand-in that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(resilience, "time", SimpleNamespace(monotonic=fake))
+    monkeypatch.setattr(scheduler, "time", SimpleNamespace(monotonic=fake))
+    return fake
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_breaker_opens_at_the_failure_rate(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=10, min_calls=4, cooldown=30)
+    for success in (True, False, True):
+        breaker.check()
+        breaker.record(success)
+    # Too few calls to judge yet
+    assert breaker.state == "closed"
+
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_breaker_lets_one_probe_through_after_the_cooldown(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=2, cooldown=30)
+    for _ in range(2):
+        breaker.check()
+        breaker.record(False)
+    clock.advance(29)
+    assert breaker.state == "open"
+
+    clock.advance(1)
+    assert breaker.state == "half_open"
+    breaker.check()
+    # Only one probe at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.stats()["recent_failure_rate"] == 0.0
+    breaker.check()
+
+
+def test_failed_probe_reopens_for_another_cooldown(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=2, cooldown=30)
+    for _ in range(2):
+        breaker.check()
+        breaker.record(False)
+    clock.advance(30)
+    breaker.check()
+    breaker.record(False)
+    assert breaker.state == "open"
+    clock.advance(29)
+    assert breaker.state == "open"
+    clock.advance(1)
+    assert breaker.state == "half_open"
+
+
+def test_abandoned_probe_frees_the_half_open_slot(clock):
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=2, cooldown=30)
+    for _ in range(2):
+        breaker.check()
+        breaker.record(False)
+    clock.advance(30)
+    breaker.check()
+    breaker.abandon()
+    breaker.check()
+
+
+def test_caller_counts_only_retryable_errors_against_the_breaker(clock):
+    caller = ResilientCaller(
+        CircuitBreaker(failure_rate=0.5, window=4, min_calls=2, cooldown=30),
+        max_attempts=1,
+    )
+
+    async def bad_request():
+        raise ValueError("bad request")
+
+    async def timing_out():
+        raise TimeoutError
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(ValueError):
+                await caller.call(bad_request, None)
+        assert caller.breaker.state == "closed"
+
+        for _ in range(2):
+            with pytest.raises(TimeoutError):
+                await caller.call(timing_out, None)
+        assert caller.breaker.state == "open"
+        with pytest.raises(CircuitOpenError):
+            await caller.call(timing_out, None)
+
+    run(scenario())
+
+
+def test_caller_retries_transient_errors():
+    caller = ResilientCaller(max_attempts=3, backoff_base=0.001, backoff_max=0.001)
+    outcomes = [TimeoutError(), TimeoutError(), "ok"]
+
+    async def flaky():
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    assert run(caller.call(flaky, 5)) == "ok"
+    assert not outcomes
+
+
+def test_hedge_wins_and_the_slow_attempt_is_cancelled():
+    caller = ResilientCaller(hedge=True, hedge_min_delay=0.01)
+    caller._latencies.extend([0.01] * 20)
+    assert caller.hedge_delay() == pytest.approx(0.01)
+
+    started = []
+    cancelled = []
+
+    async def attempt():
+        number = len(started)
+        started.append(number)
+        try:
+            # The first attempt hangs; the hedged one answers quickly
+            await asyncio.sleep(10 if number == 0 else 0.001)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        return number
+
+    async def scenario():
+        result = await caller.call(attempt, 5)
+        # Let the cancellation reach the losing attempt
+        await asyncio.sleep(0)
+        return result
+
+    assert run(scenario()) == 1
+    assert started == [0, 1]
+    assert cancelled == [0]
+
+
+def test_no_hedge_before_enough_latency_samples():
+    caller = ResilientCaller(hedge=True, hedge_min_delay=0.01)
+    caller._latencies.extend([0.01] * 19)
+    assert caller.hedge_delay() is None
+
+
+def test_token_bucket_refills_over_time(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
+    assert bucket.retry_after() == pytest.approx(0.5)
+
+    clock.advance(0.5)
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+    # Never beyond capacity
+    clock.advance(60)
+    assert bucket.is_full()
+    assert all(bucket.try_acquire() for _ in range(3))
+    assert not bucket.try_acquire()
@@ -0,0 +1,69 @@
+"""Tests for splitting formatted responses into a caption and follow-ups."""
+
+import re
+
+from src.response_formatter import (
+    format_analysis_response,
+    split_message_for_caption,
+    visible_length,
+)
+
+_TAG = re.compile(r"</?(\w+)[^>]*>")
+
+
+def make_analysis(people: int, items: int) -> dict:
+    return {
+        "people": [
+            {
+                "description_ua": f"Людина {p}",
+                "items": [
+                    {"name_ua": f"Річ {p}-{i} " + "д" * 40, "search_query_id": f"item {p} {i}"}
+                    for i in range(items)
+                ],
+            }
+            for p in range(people)
+        ]
+    }
+
+
+def assert_balanced(text: str) -> None:
+    open_tags = []
+    for match in _TAG.finditer(text):
+        if match.group(0).startswith("</"):
+            assert open_tags.pop() == match.group(1)
+        else:
+            open_tags.append(match.group(1))
+    assert not open_tags
+
+
+def test_large_person_block_fills_the_caption():
+    response = format_analysis_response(make_analysis(people=2, items=30), html_links=True)
+    caption, follow_ups = split_message_for_caption(
+        response, 900, 4096, visible_length, split_blocks=True
+    )
+
+    assert 800 < visible_length(caption) <= 900
+    assert "Річ 0-0" in caption
+    for message in [caption, *follow_ups]:
+        assert visible_length(message) <= 4096
+        assert_balanced(message)
+    assert "\n".join([caption, *follow_ups]).count("• <a") == 60
+
+
+def test_block_over_message_limit_is_split_between_lines():
+    response = format_analysis_response(make_analysis(people=1, items=120), html_links=True)
+    caption, follow_ups = split_message_for_caption(response, 900, 4096, visible_length)
+
+    assert len(follow_ups) >= 2
+    for message in [caption, *follow_ups]:
+        assert visible_length(message) <= 4096
+        assert_balanced(message)
+
+
+def test_plain_blocks_stay_whole_by_default():
+    blocks = ["greeting", "name\nhttps://example.com/" + "x" * 80] * 10
+    caption, follow_ups = split_message_for_caption("\n\n".join(blocks), 200, 4096)
+
+    for message in [caption, *follow_ups]:
+        for block in message.split("\n\n"):
+            assert block in blocks
@@ -0,0 +1,138 @@
+"""Tests for fair scheduling, admission control and draining of photo jobs."""
+
+import asyncio
+
+from src.scheduler import PhotoScheduler
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def make_scheduler(workers: int = 1, max_queue: int = 100, burst: int = 100) -> PhotoScheduler:
+    return PhotoScheduler(workers=workers, max_queue=max_queue, rate_per_minute=1e9, burst=burst)
+
+
+def recording_job(log: list, name: str, gate: asyncio.Event | None = None):
+    async def job():
+        if gate is not None:
+            await gate.wait()
+        log.append(name)
+
+    return job
+
+
+def test_chats_take_turns_and_each_chat_stays_in_order():
+    async def scenario():
+        scheduler = make_scheduler()
+        log = []
+        gate = asyncio.Event()
+        # Occupy the only worker so everything else queues up
+        scheduler.submit(0, 0, recording_job(log, "busy", gate))
+        await asyncio.sleep(0)
+        for name in ("a1", "a2", "a3"):
+            assert scheduler.submit(1, 1, recording_job(log, name)).accepted
+        for name in ("b1", "b2"):
+            assert scheduler.submit(2, 2, recording_job(log, name)).accepted
+
+        gate.set()
+        await scheduler.close()
+        return log
+
+    assert run(scenario()) == ["busy", "a1", "b1", "a2", "b2", "a3"]
+
+
+def test_positions_reflect_the_round_robin():
+    async def scenario():
+        scheduler = make_scheduler()
+        gate = asyncio.Event()
+        assert scheduler.submit(0, 0, recording_job([], "busy", gate)).position == 0
+        await asyncio.sleep(0)
+        positions = [
+            scheduler.submit(1, 1, recording_job([], "a1")).position,
+            scheduler.submit(1, 1, recording_job([], "a2")).position,
+            scheduler.submit(2, 2, recording_job([], "b1")).position,
+        ]
+        gate.set()
+        await scheduler.close()
+        return positions
+
+    # b1 goes ahead of a2 once it is queued, but a2's estimate was made before
+    assert run(scenario()) == [1, 2, 2]
+
+
+def test_jobs_beyond_the_queue_bound_are_shed():
+    async def scenario():
+        scheduler = make_scheduler(max_queue=2)
+        log = []
+        gate = asyncio.Event()
+        scheduler.submit(0, 0, recording_job(log, "running", gate))
+        await asyncio.sleep(0)
+        admissions = [scheduler.submit(1, 1, recording_job(log, f"q{i}")) for i in range(3)]
+        stats = scheduler.stats()
+        gate.set()
+        await scheduler.close()
+        return admissions, stats, log
+
+    admissions, stats, log = run(scenario())
+    assert [admission.accepted for admission in admissions] == [True, True, False]
+    assert admissions[2].reason == "queue_full"
+    assert stats["queue_depth"] == 2
+    assert stats["shed"] == 1
+    assert log == ["running", "q0", "q1"]
+
+
+def test_users_over_their_burst_are_rate_limited():
+    async def scenario():
+        scheduler = PhotoScheduler(workers=1, max_queue=100, rate_per_minute=1, burst=2)
+        admissions = [scheduler.submit(1, 7, recording_job([], str(i))) for i in range(3)]
+        await scheduler.close()
+        return admissions
+
+    admissions = run(scenario())
+    assert [admission.accepted for admission in admissions] == [True, True, False]
+    assert admissions[2].reason == "rate_limited"
+    assert admissions[2].retry_after > 0
+
+
+def test_close_waits_for_running_and_queued_jobs():
+    async def scenario():
+        scheduler = make_scheduler(workers=2)
+        log = []
+
+        async def slow(name):
+            await asyncio.sleep(0.05)
+            log.append(name)
+
+        for i in range(5):
+            scheduler.submit(i, i, lambda name=f"job{i}": slow(name))
+        await asyncio.sleep(0)
+        assert scheduler.stats()["running"] == 2
+
+        await scheduler.close()
+        return log, scheduler.stats()
+
+    log, stats = run(scenario())
+    assert sorted(log) == [f"job{i}" for i in range(5)]
+    assert stats["queue_depth"] == 0
+    assert stats["running"] == 0
+    assert stats["completed"] == 5
+
+
+def test_failed_job_does_not_stop_the_worker():
+    async def scenario():
+        scheduler = make_scheduler()
+        log = []
+
+        async def failing():
+            raise RuntimeError("boom")
+
+        scheduler.submit(1, 1, failing)
+        scheduler.submit(1, 1, recording_job(log, "after"))
+        await scheduler.close()
+        return log, scheduler.stats()
+
+    log, stats = run(scenario())
+    assert log == ["after"]
+    assert stats["failed"] == 1
+    assert stats["completed"] == 1
@@ -0,0 +1,121 @@
+"""Tests for the webhook route and request framing of the embedded HTTP server."""
+
+import asyncio
+import json
+from types import SimpleNamespace
+
+from src.http_server import MAX_BODY_BYTES, HTTPServer
+from src.webhook import SECRET_HEADER, WebhookReceiver
+
+SECRET = "s3cret"
+UPDATE = {
+    "update_id": 42,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 7, "type": "private"},
+        "text": "hi",
+    },
+}
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def start_webhook() -> tuple[HTTPServer, SimpleNamespace]:
+    application = SimpleNamespace(bot=None, update_queue=asyncio.Queue(), running=True)
+    server = HTTPServer("127.0.0.1", 0)
+    WebhookReceiver(application, secret=SECRET).register(server, "/telegram")
+    await server.start()
+    return server, application
+
+
+async def send(server: HTTPServer, head: str, body: bytes = b"") -> tuple[int, bytes]:
+    """Send one raw request; return the response status and body."""
+    reader, writer = await asyncio.open_connection(server.host, server.port)
+    writer.write(head.encode("latin-1") + b"\r\n" + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    status_line, _, rest = response.partition(b"\r\n")
+    return int(status_line.split()[1]), rest.partition(b"\r\n\r\n")[2]
+
+
+async def post(server: HTTPServer, body: bytes, secret: str | None = SECRET) -> int:
+    head = (
+        "POST /telegram HTTP/1.1\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: close\r\n"
+    )
+    if secret is not None:
+        head += f"{SECRET_HEADER}: {secret}\r\n"
+    status, _ = await send(server, head, body)
+    return status
+
+
+def test_valid_update_is_handed_to_the_application():
+    async def scenario():
+        server, application = await start_webhook()
+        status = await post(server, json.dumps(UPDATE).encode())
+        update = application.update_queue.get_nowait()
+        await server.close()
+        return status, update
+
+    status, update = run(scenario())
+    assert status == 200
+    assert update.update_id == 42
+    assert update.message.chat.id == 7
+
+
+def test_wrong_or_missing_secret_is_forbidden():
+    async def scenario():
+        server, application = await start_webhook()
+        statuses = [
+            await post(server, json.dumps(UPDATE).encode(), secret="wrong"),
+            await post(server, json.dumps(UPDATE).encode(), secret=None),
+        ]
+        await server.close()
+        return statuses, application.update_queue.qsize()
+
+    assert run(scenario()) == ([403, 403], 0)
+
+
+def test_non_object_json_is_a_bad_request():
+    async def scenario():
+        server, application = await start_webhook()
+        statuses = [await post(server, body) for body in (b"null", b"[1, 2]", b"42", b"{not json")]
+        await server.close()
+        return statuses, application.update_queue.qsize()
+
+    assert run(scenario()) == ([400, 400, 400, 400], 0)
+
+
+def test_invalid_content_lengths_are_rejected():
+    async def scenario():
+        server, application = await start_webhook()
+        statuses = []
+        for length in ("-1", "abc", str(MAX_BODY_BYTES + 1)):
+            status, _ = await send(
+                server,
+                f"POST /telegram HTTP/1.1\r\n{SECRET_HEADER}: {SECRET}\r\n"
+                f"Content-Length: {length}\r\n",
+            )
+            statuses.append(status)
+        await server.close()
+        return statuses, application.update_queue.qsize()
+
+    assert run(scenario()) == ([400, 400, 413], 0)
+
+
+def test_unknown_routes_and_methods():
+    async def scenario():
+        server, _ = await start_webhook()
+        statuses = [
+            (await send(server, "GET /telegram HTTP/1.1\r\nConnection: close\r\n"))[0],
+            (await send(server, "GET /nope HTTP/1.1\r\nConnection: close\r\n"))[0],
+        ]
+        await server.close()
+        return statuses
+
+    assert run(scenario()) == [405, 404]